@@ -0,0 +1,32 @@
+import asyncio
+from typing import Callable, Any
+
+
+class LoopBridge:
+    # quickfix invokes the application callbacks on its own threads. The bridge hands the work over to the
+    # asyncio event loop so that all the processing happens on a single thread without any polling.
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        self.loop = loop if loop else asyncio.get_running_loop()
+
+    def detach_loop(self) -> None:
+        self.loop = None
+
+    def is_attached(self) -> bool:
+        return self.loop is not None and not self.loop.is_closed()
+
+    def call_in_loop(self, callback: Callable, *args: Any) -> None:
+        if self.is_attached():
+            self.loop.call_soon_threadsafe(callback, *args)
+        else:
+            # No event loop (yet), process right away on the calling thread
+            callback(*args)
+
+
+async def run_periodically(callback: Callable[[], Any], interval_secs: float) -> None:
+    while True:
+        callback()
+        await asyncio.sleep(interval_secs)
+
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Any
+
+import quickfix as fix
+
+from execution_ledger import ClOrdIDFills
+from fix_application import FIXApplication, FIXMessage, log
+from fix_log import iter_log_messages, get_sender_comp_id_per_message_log_file_path
+from server_application import ServerApplication
+
+
+class ServerCheckpoint:
+    # Periodically saves the in-memory server state (which isn't in the oms_orders.csv file) and, on start up,
+    # restores it and replays the FIX message log(s) from where the checkpoint was taken.
+    # Only the live state is saved: the ledger's closed ClOrdIDs are left out. The state is copied on the event loop
+    # and serialized and written on another thread (see run()).
+    DEFAULT_FILE_PATH = 'store/server_state.checkpoint.json'
+    DEFAULT_INTERVAL_SECS = 5.0
+    SETTING_FILE_PATH = 'CheckpointFilePath'
+    SETTING_INTERVAL_SECS = 'CheckpointIntervalSecs'
+    VERSION = 1
+
+    def __init__(self, application: ServerApplication, sender_comp_id_per_message_log_file_path: Dict[str, str],
+                 file_path: str = DEFAULT_FILE_PATH, interval_secs: float = DEFAULT_INTERVAL_SECS):
+        self.application = application
+        self.sender_comp_id_per_message_log_file_path = sender_comp_id_per_message_log_file_path
+        self.file_path = file_path
+        self.interval_secs = interval_secs
+        # The log positions seen at the previous save. See save() for why those are the ones saved
+        self.previous_log_positions: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def from_settings(application: ServerApplication, settings: fix.SessionSettings,
+                      config_file: str) -> 'ServerCheckpoint':
+        defaults = settings.get()
+        file_path = defaults.getString(ServerCheckpoint.SETTING_FILE_PATH) \
+            if defaults.has(ServerCheckpoint.SETTING_FILE_PATH) else ServerCheckpoint.DEFAULT_FILE_PATH
+        interval_secs = defaults.getDouble(ServerCheckpoint.SETTING_INTERVAL_SECS) \
+            if defaults.has(ServerCheckpoint.SETTING_INTERVAL_SECS) else ServerCheckpoint.DEFAULT_INTERVAL_SECS
+
+        return ServerCheckpoint(application, get_sender_comp_id_per_message_log_file_path(config_file), file_path,
+                                interval_secs)
+
+    def get_log_positions(self) -> Dict[str, Dict[str, int]]:
+        log_positions: Dict[str, Dict[str, int]] = {}
+        for file_path in self.sender_comp_id_per_message_log_file_path:
+            if os.path.exists(file_path):
+                stat = os.stat(file_path)
+                log_positions[file_path] = {'inode': stat.st_ino, 'offset': stat.st_size}
+
+        return log_positions
+
+    def capture_state(self) -> Dict[str, Any]:
+        # (copies, the state keeps changing while it's written)
+        ledger = self.application.execution_ledger
+        with ledger.lock:
+            fills_per_clordid = {clordid: [fills.oms_order_id, fills.cum_qty, list(fills.exec_ids)]
+                                 for clordid, fills in ledger.fills_per_clordid.items()}
+
+        return {
+            'version': ServerCheckpoint.VERSION,
+            'saved_at': time.time(),
+            'uuids_of_interest': sorted(ServerApplication.uuids_of_interest),
+            'oms_order_id_per_accepted_reserve_clordid':
+                dict(ServerApplication.oms_order_id_per_accepted_reserve_clordid),
+            'latest_clordid_per_oms_order_id': dict(FIXApplication.latest_clordid_per_oms_order_id),
+            'latest_fix_message_per_oms_order_id': {order_id: message.to_dict() for order_id, message in
+                                                    FIXApplication.latest_fix_message_per_oms_order_id.items()},
+            'fills_per_clordid': fills_per_clordid,
+        }
+
+    def capture(self) -> Dict[str, Any] | None:
+        # The state to save, None when nothing has changed since the last save.
+        # Messages logged by quickfix may still be waiting to be processed on the event loop when the state is
+        # captured, so the checkpoint points at the log positions seen at the previous save. By then, they've all
+        # been processed. Replaying a few messages twice is harmless since the replay is idempotent.
+        log_positions = self.get_log_positions()
+        if log_positions == self.previous_log_positions and os.path.exists(self.file_path):
+            # No traffic since the last save
+            return None
+
+        state = self.capture_state()
+        # (empty for the very first checkpoint which means replaying the logs from the start)
+        state['log_positions'] = self.previous_log_positions
+        self.previous_log_positions = log_positions
+
+        return state
+
+    def save(self) -> None:
+        # (all on the calling thread, e.g. at exit)
+        state = self.capture()
+        if state:
+            self.write(state)
+
+    async def run(self) -> None:
+        # Saves every interval_secs, until cancelled. Only the capture happens on the event loop
+        while True:
+            state = self.capture()
+            if state:
+                await asyncio.to_thread(self.write, state)
+            await asyncio.sleep(self.interval_secs)
+
+    def write(self, state: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file_path = self.file_path + '.tmp'
+        with open(tmp_file_path, 'w') as fp:
+            json.dump(state, fp, separators=(',', ':'))
+        os.replace(tmp_file_path, self.file_path)
+
+    def restore(self) -> bool:
+        start_time = time.perf_counter()
+        state = self.load()
+        if state:
+            self.restore_state(state)
+        else:
+            log("CHECKPOINT", f"No usable checkpoint in:{self.file_path}. Rebuilding the state from the message log(s)")
+
+        replayed_count = self.replay_message_logs(state.get('log_positions', {}) if state else {})
+        self.previous_log_positions = self.get_log_positions()
+        log("CHECKPOINT", f"Restored state and replayed {replayed_count} message(s) "
+                          f"in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+        return state is not None
+
+    def load(self) -> Dict[str, Any] | None:
+        if not os.path.exists(self.file_path):
+            return None
+
+        with open(self.file_path) as fp:
+            state = json.load(fp)
+        if state.get('version') != ServerCheckpoint.VERSION:
+            log("CHECKPOINT", f"Ignoring checkpoint with unsupported version:{state.get('version')}")
+            return None
+
+        return state
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        ServerApplication.uuids_of_interest.update(state['uuids_of_interest'])
+        ServerApplication.oms_order_id_per_accepted_reserve_clordid.update(
+            state['oms_order_id_per_accepted_reserve_clordid'])
+        FIXApplication.latest_clordid_per_oms_order_id.update(state['latest_clordid_per_oms_order_id'])
+        for order_id, message_dict in state['latest_fix_message_per_oms_order_id'].items():
+            FIXApplication.set_latest_fix_message_per_oms_order_id(order_id, message_dict)
+        ledger = self.application.execution_ledger
+        for clordid, (oms_order_id, cum_qty, exec_ids) in state['fills_per_clordid'].items():
+            ledger.fills_per_clordid[clordid] = ClOrdIDFills(oms_order_id, cum_qty, dict.fromkeys(exec_ids))
+
+    def replay_message_logs(self, log_positions: Dict[str, Dict[str, int]]) -> int:
+        replayed_count = 0
+        for file_path, own_comp_id in self.sender_comp_id_per_message_log_file_path.items():
+            if not os.path.exists(file_path):
+                continue
+            start_offset = 0
+            log_position = log_positions.get(file_path, None)
+            if log_position:
+                stat = os.stat(file_path)
+                # Start from scratch if the log has been rotated/truncated since the checkpoint
+                if stat.st_ino == log_position['inode'] and stat.st_size >= log_position['offset']:
+                    start_offset = log_position['offset']
+            for _, _, fields in iter_log_messages(file_path, start_offset):
+                self.replay_message(FIXMessage(fields), own_comp_id)
+                replayed_count += 1
+
+        # The share changes of the replayed fills are already in the oms_orders.csv file
+        self.application.execution_ledger.drain()
+
+        return replayed_count
+
+    def replay_message(self, message: FIXMessage, own_comp_id: str) -> None:
+        msg_type = message.get(fix.MsgType())
+        is_outgoing = message.get(fix.SenderCompID()) == own_comp_id
+        oms_order_id = message.get(fix.OrderID())
+        if is_outgoing:
+            if msg_type == fix.MsgType_NewOrderSingle:
+                if message.get(fix.OrdStatus()) == fix.OrdStatus_NEW and message.get(fix.ClientID()):
+                    # reserve accept
+                    ServerApplication.oms_order_id_per_accepted_reserve_clordid[message.get(fix.ClOrdID())] = \
+                        oms_order_id
+                else:
+                    FIXApplication.set_latest_clordid_per_oms_order_id(oms_order_id, message.get(fix.ClOrdID()))
+                    FIXApplication.set_latest_fix_message_per_oms_order_id(oms_order_id, message)
+            elif msg_type in (fix.MsgType_OrderCancelReplaceRequest, fix.MsgType_OrderCancelRequest):
+                FIXApplication.set_latest_fix_message_per_oms_order_id(oms_order_id, message)
+        else:
+            if msg_type == fix.MsgType_IOI:
+                ServerApplication.uuids_of_interest.add(message.get(fix.SenderSubID()))
+            elif msg_type == fix.MsgType_ExecutionReport:
+                clordid = message.get(fix.ClOrdID())
+                accepted_oms_order_id = ServerApplication.oms_order_id_per_accepted_reserve_clordid.get(clordid, None)
+                if accepted_oms_order_id:
+                    self.application.execution_ledger.record(accepted_oms_order_id, message)
+
@@ -1,11 +1,17 @@
+import asyncio
 import queue
+import time
+from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Union
+from typing import Dict, Union, List, Callable
 
 import quickfix as fix
 
+from async_runtime import LoopBridge
 from fix_application import FIXApplication, FIXMessage, string_to_message, get_utc_transactime, log, \
     LOG_MSGTYPE_RCVD_APP
+from instrumentation import Instrumentation, get_public_method_names
+from outbound_throttle import OutboundThrottle, ThrottleConfig
 
 
 class ExecutionReportType(Enum):
@@ -14,17 +20,50 @@ class ExecutionReportType(Enum):
     DFD = fix.OrdStatus_DONE_FOR_DAY
 
 
-class ClientApplication(fix.Application):
-    session_id = None
-    reserve_request_sent = False
-    reserve_request_accepted = False
-    dfd_sent = False
-    accepted_reserve_clordid_per_oms_order_id: Dict[str, str] = dict()
+# Price of the fills when neither the caller nor the order (limit price) gives one
+DEFAULT_FILL_PRICE = '11.22'
+
+
+@dataclass
+class ReserveFills:
+    # What has been filled so far on an accepted reserve (for the CumQty/AvgPx/LeavesQty of the next report)
+    order_qty: int
+    cum_qty: int = 0
+    notional: float = 0.0
 
-    def __init__(self):
+    def get_avg_px(self) -> float:
+        return self.notional / self.cum_qty if self.cum_qty else 0.0
+
+
+class ClientApplication(fix.Application):
+    def __init__(self, throttle_config: ThrottleConfig | None = None, send_function: Callable | None = None):
+        # send_function(message, session_id) replaces quickfix's sendToTarget, e.g. for an in-process transport
         super().__init__()
+        self.session_id = None
+        self.reserve_request_sent = False
+        self.reserve_request_accepted = False
+        self.dfd_sent = False
+        self.accepted_reserve_clordid_per_oms_order_id: Dict[str, str] = dict()
+        self.fills_per_accepted_clordid: Dict[str, ReserveFills] = dict()
+        self.outbound_throttle = OutboundThrottle(throttle_config, send_function or fix.Session.sendToTarget)
         self.from_app_queue = queue.Queue()
         self.from_app_received_msgs = []
+        self.loop_bridge = LoopBridge()
+        # Signalled, on the event loop, each time an application message has been handled
+        self.app_message_condition: asyncio.Condition | None = None
+        self.app_message_count = 0
+        self.app_message_waiter_count = 0
+        self.is_queueing_app_messages = True
+        self.message_listeners: List[Callable[[FIXMessage, int], None]] = []
+
+    def enable_instrumentation(self, instrumentation: Instrumentation) -> None:
+        # Times the quickfix application callbacks and the message handlers
+        instrumentation.instrument(self, 'ClientApplication', ['fromApp', 'toApp', 'handle_app_message'] +
+                                   get_public_method_names(self, 'process_'))
+
+    def attach_loop(self) -> None:
+        self.loop_bridge.attach_loop()
+        self.app_message_condition = asyncio.Condition()
 
     def onCreate(self, session_id):
         # method mandated by parent class
@@ -57,10 +96,41 @@ class ClientApplication(fix.Application):
         log('Sent APP', message)
 
     def fromApp(self, message, session_id):
+        received_ns = time.perf_counter_ns()
         message = FIXMessage(message)
         log(LOG_MSGTYPE_RCVD_APP, message)
-        self.from_app_queue.put(message)
+        self.loop_bridge.call_in_loop(self.handle_app_message, message, received_ns)
+
+    def add_message_listener(self, listener: Callable[[FIXMessage, int], None]) -> None:
+        # listener(message, received_ns) is called, on the event loop, for each application message received
+        self.message_listeners.append(listener)
+
+    def handle_app_message(self, message: FIXMessage, received_ns: int = 0) -> None:
+        if self.is_queueing_app_messages:
+            self.from_app_queue.put(message)
         self.process_message(message)
+        for listener in self.message_listeners:
+            listener(message, received_ns)
+        self.app_message_count += 1
+        if self.app_message_waiter_count:
+            asyncio.ensure_future(self.notify_app_message_waiters())
+
+    async def notify_app_message_waiters(self) -> None:
+        async with self.app_message_condition:
+            self.app_message_condition.notify_all()
+
+    async def wait_for_app_message(self, seen_count: int, timeout_secs: float) -> bool:
+        # Wait until more than seen_count application messages have been handled. False if it timed out
+        self.app_message_waiter_count += 1
+        try:
+            async with self.app_message_condition:
+                await asyncio.wait_for(
+                    self.app_message_condition.wait_for(lambda: self.app_message_count > seen_count), timeout_secs)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.app_message_waiter_count -= 1
 
     def process_message(self, message: FIXMessage) -> None:
         msg_type = message.get(fix.MsgType())
@@ -72,6 +142,8 @@ class ClientApplication(fix.Application):
                 clordid = message.get(fix.ClOrdID())
                 log(LOG_MSGTYPE_RCVD_APP, f'Reserve request, ACCEPTED (on clordid:{clordid})')
                 self.accepted_reserve_clordid_per_oms_order_id[oms_order_id] = clordid
+                # (each accept has its own ClOrdID from the server, the fills of a new accept start from scratch)
+                self.fills_per_accepted_clordid[clordid] = ReserveFills(int(float(message.get(fix.OrderQty()) or 0)))
             FIXApplication.set_latest_fix_message_per_oms_order_id(oms_order_id, message)
 
         elif message.get(fix.OrdStatus()) == fix.OrdStatus_REJECTED:
@@ -94,12 +166,15 @@ class ClientApplication(fix.Application):
     def is_logged_on(self):
         return self.session_id is not None
 
+    def send_message(self, message: fix.Message):
+        self.outbound_throttle.send(message, self.session_id)
+
     def send_ioi_query(self, client_id: str):
         message = string_to_message(fix.MsgType_IOI, '|'.join([
             f"28={fix.IOITransType_NEW}",
             f"50={client_id}"
         ]))
-        fix.Session.sendToTarget(message, self.session_id)
+        self.send_message(message)
 
     def send_reserve_request(self, uuid: str, oms_order_id: str, reserve_shares: str):
         latest_message = FIXApplication.get_latest_fix_message_per_oms_order_id(oms_order_id)
@@ -124,50 +199,57 @@ class ClientApplication(fix.Application):
             ]))
 
             log("Snd RESERVE", message)
-            fix.Session.sendToTarget(message, self.session_id)
+            self.send_message(message)
 
             self.reserve_request_sent = True
 
     def send_execution_report(self, uuid: str, oms_order_id: str, fill_shares: str | None = None,
-                              execution_type: ExecutionReportType = ExecutionReportType.NewAck):
-
+                              execution_type: ExecutionReportType = ExecutionReportType.NewAck,
+                              price: str | None = None) -> bool:
+        # False if nothing was sent
         latest_message = FIXApplication.get_latest_fix_message_per_oms_order_id(oms_order_id)
         if latest_message:
-            order_qty = int(latest_message.get(fix.OrderQty()))
             oms_order_id = latest_message.get(fix.OrderID())
             clordid = self.accepted_reserve_clordid_per_oms_order_id[oms_order_id]
+            fills = self.fills_per_accepted_clordid.get(clordid, None)
+            if fills is None or not fills.order_qty:
+                fills = ReserveFills(int(latest_message.get(fix.OrderQty())))
+                self.fills_per_accepted_clordid[clordid] = fills
+            order_qty = fills.order_qty
             expire_time = get_utc_transactime(5 * 60)  # expire 5 mins from now
-            price = '11.22'
-            cum_qty = fill_shares
             if execution_type == ExecutionReportType.NewAck:
-                price = '0'
-                cum_qty = '0'
                 last_px = '0'
                 last_shares = '0'
                 order_status = fix.OrdStatus_NEW
                 exec_type = fix.ExecType_NEW
                 log_msg_type = 'Snd ACK'
-                leaves_qty = order_qty
             elif execution_type == ExecutionReportType.DFD:
                 last_px = '0'
                 last_shares = '0'
                 order_status = fix.OrdStatus_DONE_FOR_DAY
                 exec_type = fix.ExecType_DONE_FOR_DAY
                 log_msg_type = 'Snd DFD'
-                leaves_qty = 0
             else:
+                leaves_qty = order_qty - fills.cum_qty
                 if fill_shares is None:
-                    fill_shares = order_qty
+                    fill_shares = leaves_qty
                 else:
                     fill_shares = int(fill_shares)
                 if fill_shares == 0:
                     # nothing to fill. skip this report
-                    return
-                assert order_qty >= fill_shares, f"fill_shares:{fill_shares} > order's qty:{order_qty}"
+                    return False
+                assert leaves_qty >= fill_shares, f"fill_shares:{fill_shares} > order's leaves qty:{leaves_qty}"
 
+                if price is None:
+                    # the limit price of the order, if it has one
+                    price = latest_message.get(fix.Price())
+                    if not price or float(price) == 0:
+                        price = DEFAULT_FILL_PRICE
                 last_px = price
                 last_shares = fill_shares
-                if order_qty == fill_shares:
+                fills.cum_qty += fill_shares
+                fills.notional += fill_shares * float(price)
+                if fills.cum_qty == order_qty:
                     exec_type = fix.ExecType_FILL
                     order_status = fix.OrdStatus_FILLED
                     log_msg_type = 'Snd Fill'
@@ -175,18 +257,21 @@ class ClientApplication(fix.Application):
                     exec_type = fix.ExecType_PARTIAL_FILL
                     order_status = fix.OrdStatus_PARTIALLY_FILLED
                     log_msg_type = 'Snd Partial'
-                leaves_qty = int(order_qty) - fill_shares
+            cum_qty = fills.cum_qty
+            avg_px = f"{fills.get_avg_px():.4f}".rstrip('0').rstrip('.')
+            leaves_qty = order_qty - cum_qty if order_status in (fix.OrdStatus_NEW, fix.OrdStatus_PARTIALLY_FILLED) \
+                else 0
 
             tif = latest_message.get(fix.TimeInForce())
             if tif is None:
                 tif = fix.TimeInForce_DAY
 
             message = string_to_message(fix.MsgType_ExecutionReport, '|'.join([
-                f"6={price}",
+                f"6={avg_px}",
                 f"11={clordid}",
                 f"14={cum_qty}",
                 f"15={FIXApplication.CURRENCY}",
-                f"17={oms_order_id}-gate",
+                f"17={oms_order_id}-gate-{FIXApplication.get_next_clordid()}",
                 f"20={fix.ExecTransType_NEW}",
                 f"29={fix.LastCapacity_AGENT}",
                 f"30={FIXApplication.LAST_MARKET}",
@@ -210,7 +295,11 @@ class ClientApplication(fix.Application):
             ]))
 
             log(log_msg_type, message)
-            fix.Session.sendToTarget(message, self.session_id)
+            self.send_message(message)
 
             if execution_type == ExecutionReportType.DFD:
                 self.dfd_sent = True
+
+            return True
+
+        return False
@@ -0,0 +1,343 @@
+import asyncio
+import http.client
+import json
+import time
+import urllib.parse
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Dict, Any, List, Iterator, Tuple, Set
+
+import quickfix as fix
+
+from fix_application import FIXMessage, log
+from models import str_to_bool
+from server_application import ServerApplication
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9878
+# A subscriber that falls that many events behind loses the next ones (it's told how many with a 'dropped' event)
+MAX_QUEUED_EVENTS = 10000
+# An SSE comment is sent when there's been no event for that long, a way to notice the dead connections
+KEEPALIVE_SECS = 15.0
+MAX_REQUEST_BODY_BYTES = 1024 * 1024
+# The tags of the message events
+EVENT_MESSAGE_TAGS = [str(tag) for tag in [fix.MsgType().getField(), fix.ClOrdID().getField(),
+                                           fix.OrderID().getField(), fix.SenderSubID().getField(),
+                                           fix.Symbol().getField(), fix.OrderQty().getField(),
+                                           fix.OrdStatus().getField(), fix.LastShares().getField(),
+                                           fix.ExecID().getField()]]
+EVENT_ORDERS = 'orders'
+EVENT_MESSAGE = 'message'
+EVENT_DROPPED = 'dropped'
+
+
+class ControlAPIError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass(eq=False)
+class EventSubscriber:
+    queue: asyncio.Queue
+    dropped_count: int = 0
+
+
+class EventHub:
+    # Fans the events out to the subscribers of the event stream. Only used on the event loop
+    def __init__(self, max_queued_events: int = MAX_QUEUED_EVENTS):
+        self.max_queued_events = max_queued_events
+        self.subscribers: Set[EventSubscriber] = set()
+
+    def subscribe(self) -> EventSubscriber:
+        subscriber = EventSubscriber(asyncio.Queue(self.max_queued_events))
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: EventSubscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> None:
+        for subscriber in self.subscribers:
+            try:
+                subscriber.queue.put_nowait((event_type, data))
+            except asyncio.QueueFull:
+                subscriber.dropped_count += 1
+
+
+class ControlAPI:
+    # Local HTTP API of the running server (it only listens on localhost), served from the server's event loop:
+    #   GET  /session          session and server state
+    #   GET  /orders           the order book, filtered by the uuid, symbol and is_active query parameters
+    #   GET  /orders/<id>      one order
+    #   POST /order_changes    the same instructions as in oms_order_changes.json (so with the orders file already
+    #                          updated), applied right away. The response is the ack
+    #   GET  /events           Server-Sent Events stream of the order changes and of the application messages
+    #   GET  /metrics          rolling throughput/latency metrics (see ServerMetrics)
+    SETTING_HOST = 'ControlApiHost'
+    SETTING_PORT = 'ControlApiPort'
+
+    def __init__(self, application: ServerApplication, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.event_hub = EventHub()
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    @staticmethod
+    def from_settings(application: ServerApplication, settings: fix.SessionSettings) -> 'ControlAPI | None':
+        # Disabled when the port isn't set (or is 0)
+        defaults = settings.get()
+        port = defaults.getInt(ControlAPI.SETTING_PORT) if defaults.has(ControlAPI.SETTING_PORT) else 0
+        if not port:
+            return None
+        host = defaults.getString(ControlAPI.SETTING_HOST) if defaults.has(ControlAPI.SETTING_HOST) else DEFAULT_HOST
+
+        return ControlAPI(application, host, port)
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        try:
+            server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        except OSError as e:
+            log("ERROR", f"Can't start the control API on {self.host}:{self.port}, running without it:{e}")
+            return
+        # (the message metrics are only needed for /metrics)
+        self.application.message_listeners.extend([self.application.metrics.on_message, self.on_message])
+        self.application.order_store.order_change_listeners.append(self.on_order_change)
+        log("CONTROL API", f"Listening on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.application.message_listeners.remove(self.application.metrics.on_message)
+            self.application.message_listeners.remove(self.on_message)
+            self.application.order_store.order_change_listeners.remove(self.on_order_change)
+
+    def on_message(self, direction: str, message: FIXMessage) -> None:
+        # (called on quickfix's threads for the sent messages)
+        if self.event_hub.subscribers:
+            data = {tag: message.message_dict[tag] for tag in EVENT_MESSAGE_TAGS if tag in message.message_dict}
+            data['direction'] = direction
+            self.loop.call_soon_threadsafe(self.event_hub.publish, EVENT_MESSAGE, data)
+
+    def on_order_change(self, order_ids: List[str]) -> None:
+        if self.event_hub.subscribers:
+            orders = [self.application.order_store.order_per_order_id[order_id].to_dict() for order_id in order_ids
+                      if order_id in self.application.order_store.order_per_order_id]
+            self.loop.call_soon_threadsafe(self.event_hub.publish, EVENT_ORDERS, {EVENT_ORDERS: orders})
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, path, query, body = await ControlAPI.read_request(reader)
+            requested_at = time.time()
+            if method == 'GET' and path == '/events':
+                await self.stream_events(writer)
+                return
+            try:
+                status, payload = HTTPStatus.OK, self.route(method, path, query, body, requested_at)
+            except ControlAPIError as e:
+                status, payload = e.status, {'error': str(e)}
+            ControlAPI.write_json_response(writer, status, payload)
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            ControlAPI.write_json_response(writer, HTTPStatus.BAD_REQUEST, {'error': "Malformed request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        content_length = int(headers.get('content-length', 0))
+        if content_length > MAX_REQUEST_BODY_BYTES:
+            raise ValueError(f"Request body too large:{content_length}")
+        body = await reader.readexactly(content_length) if content_length else b''
+        url = urllib.parse.urlsplit(target)
+
+        return method.upper(), url.path.rstrip('/') or '/', dict(urllib.parse.parse_qsl(url.query)), body
+
+    @staticmethod
+    def write_json_response(writer: asyncio.StreamWriter, status: HTTPStatus, payload: Any) -> None:
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+
+    def route(self, method: str, path: str, query: Dict[str, str], body: bytes, requested_at: float) -> Any:
+        if path == '/session':
+            ControlAPI.check_method(method, 'GET')
+            return self.get_session()
+        elif path == '/metrics':
+            ControlAPI.check_method(method, 'GET')
+            return self.application.metrics.snapshot()
+        elif path == '/orders':
+            ControlAPI.check_method(method, 'GET')
+            return {EVENT_ORDERS: self.get_orders(query)}
+        elif path.startswith('/orders/'):
+            ControlAPI.check_method(method, 'GET')
+            return self.get_order(path[len('/orders/'):])
+        elif path == '/order_changes':
+            ControlAPI.check_method(method, 'POST')
+            return self.apply_order_changes(body, requested_at)
+        else:
+            raise ControlAPIError(HTTPStatus.NOT_FOUND, f"Unknown path:{path}")
+
+    @staticmethod
+    def check_method(method: str, expected_method: str) -> None:
+        if method != expected_method:
+            raise ControlAPIError(HTTPStatus.METHOD_NOT_ALLOWED, f"Expected a {expected_method} request")
+
+    def get_session(self) -> Dict[str, Any]:
+        order_store = self.application.order_store
+        return {
+            'session_id': str(ServerApplication.session_id) if ServerApplication.session_id else None,
+            'is_logged_on': ServerApplication.is_logged_on,
+            'uuids_of_interest': sorted(ServerApplication.uuids_of_interest),
+            'accepted_reserve_count': len(ServerApplication.oms_order_id_per_accepted_reserve_clordid),
+            'order_count': len(order_store.orders),
+            'applied_order_changes_seq': order_store.applied_order_changes_seq,
+            'outbound_throttle': ServerApplication.outbound_throttle.stats(),
+            'event_subscriber_count': len(self.event_hub.subscribers),
+        }
+
+    def get_orders(self, query: Dict[str, str]) -> List[Dict[str, Any]]:
+        order_store = self.application.order_store
+        order_store.read_orders_from_file_if_changed()
+        if 'uuid' in query:
+            orders = [order_store.order_per_order_id[order_id]
+                      for order_id in order_store.order_ids_per_uuid.get(query['uuid'], [])]
+        else:
+            orders = order_store.orders
+        if 'symbol' in query:
+            orders = [order for order in orders if order.symbol == query['symbol']]
+        if 'is_active' in query:
+            is_active = str_to_bool(query['is_active'])
+            orders = [order for order in orders if order.is_active == is_active]
+
+        return [order.to_dict() for order in orders]
+
+    def get_order(self, order_id: str) -> Dict[str, Any]:
+        order_store = self.application.order_store
+        order_store.read_orders_from_file_if_changed()
+        order = order_store.order_per_order_id.get(order_id, None)
+        if order is None:
+            raise ControlAPIError(HTTPStatus.NOT_FOUND, f"Unknown order_id:{order_id}")
+
+        return order.to_dict()
+
+    def apply_order_changes(self, body: bytes, requested_at: float) -> Dict[str, Any]:
+        try:
+            order_changes = json.loads(body)
+        except ValueError as e:
+            raise ControlAPIError(HTTPStatus.BAD_REQUEST, f"Invalid JSON:{e}")
+        if not isinstance(order_changes, dict):
+            raise ControlAPIError(HTTPStatus.BAD_REQUEST, "Expected a JSON object")
+        try:
+            order_ids = self.application.order_store.apply_order_changes(order_changes, requested_at)
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            raise ControlAPIError(HTTPStatus.BAD_REQUEST, f"Can't apply the order changes:{e!r}")
+
+        return {'applied_seq': order_changes.get(self.application.order_store.ORDER_CHANGES_SEQ_KEY, None),
+                'order_ids': order_ids}
+
+    async def stream_events(self, writer: asyncio.StreamWriter) -> None:
+        subscriber = self.event_hub.subscribe()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    events = [await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECS)]
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                    await writer.drain()
+                    continue
+                # write whatever else is already queued in one go
+                while not subscriber.queue.empty():
+                    events.append(subscriber.queue.get_nowait())
+                if subscriber.dropped_count:
+                    events.append((EVENT_DROPPED, {'count': subscriber.dropped_count}))
+                    subscriber.dropped_count = 0
+                writer.write(b"".join(f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode()
+                                      for event_type, data in events))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.event_hub.unsubscribe(subscriber)
+
+
+class ControlAPIClient:
+    # Blocking client of the ControlAPI, for the UIs
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout_secs: float = 5.0):
+        self.host = host
+        self.port = port
+        self.timeout_secs = timeout_secs
+
+    @staticmethod
+    def connect_if_running(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> 'ControlAPIClient | None':
+        # None when there's no server listening, the UIs then fall back on the files
+        client = ControlAPIClient(host, port)
+        try:
+            client.get_session()
+        except (OSError, ControlAPIError):
+            return None
+
+        return client
+
+    def request(self, method: str, path: str, payload: Any = None) -> Any:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_secs)
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            connection.request(method, path, body, {'Content-Type': 'application/json'} if body else {})
+            response = connection.getresponse()
+            response_payload = json.loads(response.read() or b'null')
+        finally:
+            connection.close()
+        if response.status != HTTPStatus.OK:
+            raise ControlAPIError(HTTPStatus(response.status),
+                                  response_payload.get('error', '') if isinstance(response_payload, dict) else '')
+
+        return response_payload
+
+    def get_session(self) -> Dict[str, Any]:
+        return self.request('GET', '/session')
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return self.request('GET', '/metrics')
+
+    def get_orders(self, **filters: Any) -> List[Dict[str, Any]]:
+        query = urllib.parse.urlencode({name: value for name, value in filters.items() if value is not None})
+        return self.request('GET', f"/orders?{query}" if query else '/orders')[EVENT_ORDERS]
+
+    def get_order(self, order_id: str) -> Dict[str, Any]:
+        return self.request('GET', f"/orders/{urllib.parse.quote(str(order_id))}")
+
+    def submit_order_changes(self, order_changes: Dict[str, Any]) -> Dict[str, Any]:
+        return self.request('POST', '/order_changes', order_changes)
+
+    def iter_events(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # (event type, data) until the server goes away
+        connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            connection.request('GET', '/events')
+            response = connection.getresponse()
+            event_type = None
+            for line in response:
+                line = line.decode().rstrip('\r\n')
+                if line.startswith('event:'):
+                    event_type = line[len('event:'):].strip()
+                elif line.startswith('data:') and event_type:
+                    yield event_type, json.loads(line[len('data:'):])
+                    event_type = None
+        finally:
+            connection.close()
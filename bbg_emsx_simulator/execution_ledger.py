@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Set, Tuple
+
+import quickfix as fix
+
+from fix_application import FIXMessage, log
+
+TERMINAL_ORD_STATUSES: Set[str] = {fix.OrdStatus_FILLED, fix.OrdStatus_DONE_FOR_DAY, fix.OrdStatus_CANCELED}
+# The ClOrdIDs in a terminal status are kept (as tombstones) that long, and up to that many of them, with their
+# most recent ExecIDs, so that late resends are still caught
+CLOSED_CLORDID_TTL_SECS = 15 * 60
+MAX_CLOSED_CLORDIDS = 100_000
+MAX_CLOSED_CLORDID_EXEC_IDS = 100
+
+
+@dataclass
+class ClOrdIDFills:
+    oms_order_id: str
+    cum_qty: int = 0
+    # (a dict as an ordered set, the oldest first)
+    exec_ids: Dict[str, None] = field(default_factory=dict)
+    closed_at: float | None = None
+
+
+class ExecutionLedger:
+    # Keeps track, per (reserve accept) ClOrdID, of the fills that have already been applied to the OMS orders so
+    # that each execution is applied exactly once. The resulting share changes are accumulated until drained so
+    # that a burst of fills results in a single order store update and a single 35=G per order.
+    # A ClOrdID leaves fills_per_clordid when it reaches a terminal status, for the bounded closed_fills_per_clordid.
+    def __init__(self):
+        self.fills_per_clordid: Dict[str, ClOrdIDFills] = {}
+        # oldest first
+        self.closed_fills_per_clordid: OrderedDict[str, ClOrdIDFills] = OrderedDict()
+        self.pending_shares_increment_per_oms_order_id: Dict[str, int] = {}
+        self.pending_correction_oms_order_ids: Set[str] = set()
+        self.duplicate_count = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_int(message: FIXMessage, fix_field_obj) -> int | None:
+        value = message.get(fix_field_obj)
+        if value is None or value == '':
+            return None
+        return int(float(value))
+
+    def record(self, oms_order_id: str, message: FIXMessage) -> bool:
+        clordid = message.get(fix.ClOrdID())
+        exec_id = message.get(fix.ExecID())
+        ord_status = message.get(fix.OrdStatus())
+        last_shares = ExecutionLedger.get_int(message, fix.LastShares())
+        cum_qty = ExecutionLedger.get_int(message, fix.CumQty())
+
+        with self.lock:
+            fills = self.fills_per_clordid.get(clordid, None) or self.closed_fills_per_clordid.get(clordid, None)
+            if fills is None:
+                fills = ClOrdIDFills(oms_order_id)
+                self.fills_per_clordid[clordid] = fills
+
+            if exec_id is not None:
+                if exec_id in fills.exec_ids:
+                    self.duplicate_count += 1
+                    log("LEDGER", f"Ignoring duplicate ExecID:{exec_id} for clordid:{clordid}")
+                    return False
+                fills.exec_ids[exec_id] = None
+
+            if last_shares is None:
+                # No LastShares, derive the delta from what's been applied so far
+                shares_delta = max((cum_qty or 0) - fills.cum_qty, 0)
+            else:
+                shares_delta = last_shares
+                if cum_qty is not None and cum_qty != fills.cum_qty + shares_delta:
+                    log("LEDGER", f"WARNING: CumQty:{cum_qty} != applied:{fills.cum_qty} + LastShares:{last_shares} "
+                                  f"for clordid:{clordid}. Applying LastShares")
+            fills.cum_qty += shares_delta
+            if ord_status in TERMINAL_ORD_STATUSES and fills.closed_at is None:
+                self.close(clordid, fills)
+
+            if shares_delta:
+                self.pending_shares_increment_per_oms_order_id[oms_order_id] = \
+                    self.pending_shares_increment_per_oms_order_id.get(oms_order_id, 0) - shares_delta
+            if shares_delta or ord_status in TERMINAL_ORD_STATUSES:
+                self.pending_correction_oms_order_ids.add(oms_order_id)
+                return True
+            else:
+                return False
+
+    def close(self, clordid: str, fills: ClOrdIDFills) -> None:
+        # (under the lock)
+        del self.fills_per_clordid[clordid]
+        fills.closed_at = time.monotonic()
+        if len(fills.exec_ids) > MAX_CLOSED_CLORDID_EXEC_IDS:
+            fills.exec_ids = dict.fromkeys(list(fills.exec_ids)[-MAX_CLOSED_CLORDID_EXEC_IDS:])
+        self.closed_fills_per_clordid[clordid] = fills
+        expired_at = fills.closed_at - CLOSED_CLORDID_TTL_SECS
+        while len(self.closed_fills_per_clordid) > MAX_CLOSED_CLORDIDS or \
+                next(iter(self.closed_fills_per_clordid.values())).closed_at < expired_at:
+            self.closed_fills_per_clordid.popitem(last=False)
+
+    def has_pending(self) -> bool:
+        with self.lock:
+            return bool(self.pending_correction_oms_order_ids)
+
+    def drain(self) -> Tuple[Dict[str, int], Set[str]]:
+        with self.lock:
+            shares_increment_per_oms_order_id = self.pending_shares_increment_per_oms_order_id
+            correction_oms_order_ids = self.pending_correction_oms_order_ids
+            self.pending_shares_increment_per_oms_order_id = {}
+            self.pending_correction_oms_order_ids = set()
+
+            return shares_increment_per_oms_order_id, correction_oms_order_ids
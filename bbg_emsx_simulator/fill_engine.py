@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Dict, List
+
+import quickfix as fix
+
+from client_application import ClientApplication, ExecutionReportType, DEFAULT_FILL_PRICE
+from fix_application import FIXApplication, FIXMessage, log
+
+# Extra weight of the first and last slices of a VWAP schedule (intraday volume is U-shaped)
+VWAP_CURVE_DEPTH = 2.0
+# Smallest share of the order a RANDOM slice gets, relative to the biggest one
+RANDOM_MIN_SLICE_WEIGHT = .2
+
+
+class FillStrategy(Enum):
+    TWAP = 'twap'
+    VWAP = 'vwap'
+    RANDOM = 'random'
+
+
+@dataclass
+class FillProfile:
+    strategy: FillStrategy = FillStrategy.TWAP
+    slice_count: int = 10
+    interval_secs: float = 1.0
+    # +/- that fraction of interval_secs, at random (RANDOM uses exponential intervals instead)
+    interval_jitter: float = 0.0
+    # Fraction of the reserved shares that gets filled, the rest is DFD'd
+    fill_ratio: float = 1.0
+    # Price of the first fill, the limit price of the order (or DEFAULT_FILL_PRICE) if None
+    price: float | None = None
+    # Standard deviation of the price move between 2 fills, in basis points
+    price_volatility_bps: float = 0.0
+    send_ack: bool = True
+
+
+@dataclass
+class ScheduledFill:
+    delay_secs: float
+    shares: int
+    price: float
+
+
+@dataclass
+class OrderFillSchedule:
+    uuid: str
+    oms_order_id: str
+    order_qty: int
+    fills: List[ScheduledFill]
+    next_index: int = 0
+    done: asyncio.Future | None = None
+
+
+def split_shares(total_shares: int, weights: List[float]) -> List[int]:
+    # Proportional to the weights, the rounding leftovers going to the biggest remainders
+    total_weight = sum(weights)
+    exact_shares = [total_shares * weight / total_weight for weight in weights]
+    shares = [int(exact) for exact in exact_shares]
+    leftover = total_shares - sum(shares)
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact_shares[i] - shares[i], reverse=True)
+    for i in by_remainder[:leftover]:
+        shares[i] += 1
+
+    return shares
+
+
+def build_fill_schedule(order_qty: int, start_price: float, profile: FillProfile,
+                        rng: random.Random) -> List[ScheduledFill]:
+    fill_qty = int(order_qty * profile.fill_ratio)
+    slice_count = max(min(profile.slice_count, fill_qty), 1)
+    if profile.strategy == FillStrategy.VWAP:
+        weights = [1 + VWAP_CURVE_DEPTH * (2 * (i + .5) / slice_count - 1) ** 2 for i in range(slice_count)]
+    elif profile.strategy == FillStrategy.RANDOM:
+        weights = [rng.uniform(RANDOM_MIN_SLICE_WEIGHT, 1.0) for _ in range(slice_count)]
+    else:
+        weights = [1.0] * slice_count
+
+    fills: List[ScheduledFill] = []
+    price = start_price
+    for i, shares in enumerate(split_shares(fill_qty, weights)):
+        if profile.strategy == FillStrategy.RANDOM:
+            delay_secs = rng.expovariate(1 / profile.interval_secs) if profile.interval_secs else 0.0
+        else:
+            delay_secs = profile.interval_secs * (1 + rng.uniform(-profile.interval_jitter, profile.interval_jitter))
+        if i and profile.price_volatility_bps:
+            price = max(price * (1 + rng.gauss(0, profile.price_volatility_bps / 10000)), .0001)
+        if shares:
+            fills.append(ScheduledFill(delay_secs, shares, round(price, 4)))
+
+    return fills
+
+
+class TimerWheel:
+    # Hashed timing wheel: the timers go in slot_count buckets of tick_secs each, and a single task advances one
+    # bucket per tick, so thousands of pending timers cost the same as one. Timers further than a full turn away
+    # wait for their remaining turns. Callbacks run on the event loop, within about a tick of their due time.
+    def __init__(self, tick_secs: float = .01, slot_count: int = 512):
+        self.tick_secs = tick_secs
+        self.slots: List[List[List]] = [[] for _ in range(slot_count)]
+        self.current_tick = 0
+        self.pending_count = 0
+        self.task: asyncio.Task | None = None
+
+    def schedule(self, delay_secs: float, callback: Callable[[], None]) -> None:
+        ticks = max(int(delay_secs / self.tick_secs + .5), 1)
+        slot_count = len(self.slots)
+        # [turns left, callback]
+        self.slots[(self.current_tick + ticks) % slot_count].append([(ticks - 1) // slot_count, callback])
+        self.pending_count += 1
+
+    def start(self) -> None:
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        while True:
+            # catch up on the ticks missed while the loop was busy
+            due_tick = int((loop.time() - start_time) / self.tick_secs)
+            while self.current_tick < due_tick:
+                self.current_tick += 1
+                self.expire_slot(self.slots[self.current_tick % len(self.slots)])
+            await asyncio.sleep(max(start_time + (self.current_tick + 1) * self.tick_secs - loop.time(), 0))
+
+    def expire_slot(self, slot: List[List]) -> None:
+        if not slot:
+            return
+        due_callbacks = []
+        still_pending = []
+        for timer in slot:
+            if timer[0]:
+                timer[0] -= 1
+                still_pending.append(timer)
+            else:
+                due_callbacks.append(timer[1])
+        slot[:] = still_pending
+        self.pending_count -= len(due_callbacks)
+        for callback in due_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log("ERROR", f"Timer callback failed:{e}")
+
+
+class FillEngine:
+    # Acks each reserve it's given and then fills it, slice by slice, following a FillProfile. All the orders
+    # share a single TimerWheel. With is_auto, every reserve accepted by the server is filled that way.
+    def __init__(self, application: ClientApplication, profile: FillProfile, is_auto: bool = False,
+                 seed: int | None = None, timer_wheel: TimerWheel | None = None):
+        self.application = application
+        self.profile = profile
+        self.is_auto = is_auto
+        self.rng = random.Random(seed)
+        self.timer_wheel = timer_wheel or TimerWheel()
+        self.schedule_per_oms_order_id: Dict[str, OrderFillSchedule] = {}
+        self.counters: Dict[str, int] = {}
+
+    def count(self, name: str, increment: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + increment
+
+    def start(self) -> None:
+        self.timer_wheel.start()
+        if self.is_auto:
+            self.application.add_message_listener(self.on_message)
+
+    async def stop(self) -> None:
+        if self.is_auto:
+            self.application.message_listeners.remove(self.on_message)
+        await self.timer_wheel.stop()
+        for schedule in self.schedule_per_oms_order_id.values():
+            if not schedule.done.done():
+                schedule.done.cancel()
+        self.schedule_per_oms_order_id.clear()
+
+    def on_message(self, message: FIXMessage, _: int) -> None:
+        if message.get(fix.MsgType()) == fix.MsgType_NewOrderSingle and \
+                message.get(fix.OrdStatus()) == fix.OrdStatus_NEW:
+            self.start_order(message.get(fix.SenderSubID()), message.get(fix.OrderID()),
+                             int(float(message.get(fix.OrderQty()))))
+
+    def get_start_price(self, oms_order_id: str) -> float:
+        if self.profile.price is not None:
+            return self.profile.price
+        latest_message = FIXApplication.get_latest_fix_message_per_oms_order_id(oms_order_id)
+        price = latest_message.get(fix.Price()) if latest_message else None
+        return float(price) if price and float(price) else float(DEFAULT_FILL_PRICE)
+
+    def start_order(self, uuid: str, oms_order_id: str, order_qty: int) -> asyncio.Future:
+        # The returned future is done once the last fill (or the DFD) has been sent
+        previous_schedule = self.schedule_per_oms_order_id.get(oms_order_id, None)
+        if previous_schedule and not previous_schedule.done.done():
+            # a new reserve replaces the previous one, stop filling it
+            previous_schedule.done.set_result(False)
+            self.count('replaced_orders')
+        fills = build_fill_schedule(order_qty, self.get_start_price(oms_order_id), self.profile, self.rng)
+        schedule = OrderFillSchedule(uuid, oms_order_id, order_qty, fills,
+                                     done=asyncio.get_running_loop().create_future())
+        self.schedule_per_oms_order_id[oms_order_id] = schedule
+        self.count('started_orders')
+        if self.profile.send_ack:
+            self.application.send_execution_report(uuid, oms_order_id, str(order_qty), ExecutionReportType.NewAck)
+        self.schedule_next(schedule)
+
+        return schedule.done
+
+    def schedule_next(self, schedule: OrderFillSchedule) -> None:
+        if schedule.next_index < len(schedule.fills):
+            self.timer_wheel.schedule(schedule.fills[schedule.next_index].delay_secs,
+                                      lambda: self.send_next_fill(schedule))
+        else:
+            self.complete(schedule)
+
+    def send_next_fill(self, schedule: OrderFillSchedule) -> None:
+        if schedule.done.done():
+            # replaced or stopped
+            return
+        fill = schedule.fills[schedule.next_index]
+        schedule.next_index += 1
+        if self.application.send_execution_report(schedule.uuid, schedule.oms_order_id, str(fill.shares),
+                                                  ExecutionReportType.Filled, f"{fill.price:g}"):
+            self.count('sent_fills')
+        self.schedule_next(schedule)
+
+    def complete(self, schedule: OrderFillSchedule) -> None:
+        if sum(fill.shares for fill in schedule.fills) < schedule.order_qty:
+            if self.application.send_execution_report(schedule.uuid, schedule.oms_order_id, None,
+                                                      ExecutionReportType.DFD):
+                self.count('sent_dfds')
+        self.count('completed_orders')
+        if self.schedule_per_oms_order_id.get(schedule.oms_order_id, None) is schedule:
+            del self.schedule_per_oms_order_id[schedule.oms_order_id]
+        schedule.done.set_result(True)
+
+
+def add_fill_arguments(ap: argparse.ArgumentParser) -> None:
+    defaults = FillProfile()
+    group = ap.add_argument_group('fill engine')
+    group.add_argument('--auto_fill', action='store_true',
+                       help="Ack and fill every accepted reserve following the fill profile below")
+    group.add_argument('--fill_strategy', type=str, default=defaults.strategy.value,
+                       choices=[strategy.value for strategy in FillStrategy], help="How the reserves are sliced")
+    group.add_argument('--fill_slices', type=int, default=defaults.slice_count, help="Fills per reserve")
+    group.add_argument('--fill_interval', type=float, default=defaults.interval_secs,
+                       help="Seconds between 2 fills (the mean for the random strategy)")
+    group.add_argument('--fill_jitter', type=float, default=defaults.interval_jitter,
+                       help="Random +/- fraction of the interval (twap, vwap)")
+    group.add_argument('--fill_ratio', type=float, default=defaults.fill_ratio,
+                       help="Fraction of the reserved shares filled, the rest is DFD'd")
+    group.add_argument('--fill_price', type=float, default=defaults.price,
+                       help=f"Price of the first fill (default: the order's limit price or {DEFAULT_FILL_PRICE})")
+    group.add_argument('--fill_volatility_bps', type=float, default=defaults.price_volatility_bps,
+                       help="Standard deviation of the price move between 2 fills, in basis points")
+
+
+def fill_profile_from_args(cli_args: argparse.Namespace) -> FillProfile:
+    return FillProfile(strategy=FillStrategy(cli_args.fill_strategy),
+                       slice_count=cli_args.fill_slices,
+                       interval_secs=cli_args.fill_interval,
+                       interval_jitter=cli_args.fill_jitter,
+                       fill_ratio=cli_args.fill_ratio,
+                       price=cli_args.fill_price,
+                       price_volatility_bps=cli_args.fill_volatility_bps)
@@ -123,6 +123,7 @@ class FIXApplication(fix.Application):
 
     @staticmethod
     def set_latest_clordid_per_oms_order_id(order_id: str, clordid: Union[str, None]) -> None:
+        order_id = str(order_id)
         if clordid:
             FIXApplication.latest_clordid_per_oms_order_id[order_id] = clordid
         else:
@@ -132,7 +133,7 @@ class FIXApplication(fix.Application):
 
     @staticmethod
     def get_latest_clordid_per_oms_order_id(order_id: str) -> Union[str, None]:
-        return FIXApplication.latest_clordid_per_oms_order_id.get(order_id, None)
+        return FIXApplication.latest_clordid_per_oms_order_id.get(str(order_id), None)
 
     @staticmethod
     def set_latest_fix_message_per_oms_order_id(order_id: str,
@@ -214,9 +215,19 @@ def get_utc_transactime(offset_in_secs: int = 0) -> str:
 
 
 LOG_MSGTYPE_RCVD_APP = 'Rcvd APP'
+is_logging_enabled = True
+
+
+def set_logging_enabled(enabled: bool) -> None:
+    # Printing every message dominates the cost when generating load
+    global is_logging_enabled
+    is_logging_enabled = enabled
+
 
 def log(msg_type: str, message: str | Dict[str, str] | fix.Message | FIXMessage | None = None,
         pre_timestamp: str = '') -> None:
+    if not is_logging_enabled:
+        return
     if message == None:
         message = ''
     elif isinstance(message, dict) or isinstance(message, fix.Message):
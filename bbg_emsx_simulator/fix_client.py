@@ -1,150 +1,142 @@
 import argparse
-import time
-from typing import List, Dict
+import asyncio
+from typing import List
 
-import pandas as pd
 import quickfix as fix
 
-from bbg_emsx_simulator.client_application import ClientApplication, ExecutionReportType
-from bbg_emsx_simulator.fix_application import FIXMessage, log
-from bbg_emsx_simulator.order_manager import OrderManager
-from bbg_emsx_simulator.scenario import Scenario, ActionLine, Action
-from settings import get_settings
+from client_application import ClientApplication
+from fill_engine import FillEngine, FillProfile, add_fill_arguments, fill_profile_from_args
+from fix_application import log
+from instrumentation import Instrumentation
+from load_generator import LoadProfile, add_load_arguments, generate_order_book, load_profile_from_args, run_load
+from message_inbox import MessageInbox
+from order_store import OrderStore
+from outbound_throttle import ThrottleConfig
+from log_replay import add_replay_speed_argument
+from scenario_runner import ScenarioRunner, create_scenarios
+from settings import get_settings, get_session_settings_dicts
 
-FIX_CLIENTID_TAG50 = str(fix.SenderSubID().getField())
-FIX_ORDERID_TAG37 = str(fix.OrderID().getField())
-FIX_ORDERQTY_TAG38 = str(fix.OrderQty().getField())
-
-received_app_messages: List[Dict[str, str]] = []
+SCENARIO_IDLE_CHECK_INTERVAL_SECS = 1
 
 
 # def main(config_file: str, send_reserve_order_id: str = None, send_fill_order_id: str = None,
 #          reserve_shares: int = None, fill_shares: int = None) -> None:
-def main(config_file: str, scenario: Scenario) -> None:
+def main(config_file: str, scenario_file_paths: List[str] | None, load_profile: LoadProfile | None = None,
+         inbox_max_messages: int = MessageInbox.DEFAULT_MAX_MESSAGES,
+         inbox_max_age_secs: float = MessageInbox.DEFAULT_MAX_AGE_SECS, results_file_path: str | None = None,
+         replay_log_file_paths: List[str] | None = None, replay_speed: float = 1.0,
+         auto_fill_profile: FillProfile | None = None) -> None:
     initiator = None
+    application = None
+    instrumentation = None
     try:
         settings = get_settings(config_file)
-        application = ClientApplication()
+        application = ClientApplication(ThrottleConfig.from_settings(settings))
+        instrumentation = Instrumentation.from_settings(settings, 'client')
+        if instrumentation:
+            application.enable_instrumentation(instrumentation)
+        scenario_runner = None
+        if scenario_file_paths or replay_log_file_paths:
+            client_comp_id = get_session_settings_dicts(config_file)[0]['SenderCompID']
+            scenarios = create_scenarios(scenario_file_paths, replay_log_file_paths, client_comp_id, replay_speed)
+            scenario_runner = ScenarioRunner(application, scenarios, inbox_max_messages, inbox_max_age_secs,
+                                             results_file_path)
+            scenario_runner.instrumentation = instrumentation
         store_factory = fix.FileStoreFactory(settings)
         log_factory = fix.FileLogFactory(settings)
         initiator = fix.SocketInitiator(application, store_factory, settings, log_factory)
         initiator.start()
         print("FIX Client started.")
-        while True:
-            time.sleep(1)
-            if application.is_logged_on():
-                dequeue_all_and_store(application)
-                if scenario:
-                    run_scenario(scenario, application)
-            else:
-                log("INFO", "Session has NOT logged on yet...")
+        if load_profile:
+            asyncio.run(run_load_client(application, load_profile, results_file_path, instrumentation))
+        else:
+            asyncio.run(run_client(application, scenario_runner, auto_fill_profile, instrumentation))
 
     except (fix.ConfigError, Exception) as e:
         print(f"\nCAUGHT EXCEPTION:{e}\n")
     finally:
         if initiator:
             initiator.stop()
+            # release it while the application is still alive, quickfix crashes when it's garbage collected after
+            del initiator
+        if application:
+            # (its drain threads)
+            application.outbound_throttle.stop()
+        if instrumentation:
+            instrumentation.dump()
+
+
+async def run_client(application: ClientApplication, scenario_runner: ScenarioRunner | None,
+                     auto_fill_profile: FillProfile | None = None,
+                     instrumentation: Instrumentation | None = None) -> None:
+    # From now on, the messages received by quickfix are processed on this event loop
+    application.attach_loop()
+    instrumentation_task = asyncio.create_task(instrumentation.run()) if instrumentation else None
+    if auto_fill_profile:
+        FillEngine(application, auto_fill_profile, is_auto=True).start()
+    try:
+        while not application.is_logged_on():
+            log("INFO", "Session has NOT logged on yet...")
+            await asyncio.sleep(SCENARIO_IDLE_CHECK_INTERVAL_SECS)
+        if scenario_runner:
+            await scenario_runner.run()
+        while True:
+            await asyncio.sleep(SCENARIO_IDLE_CHECK_INTERVAL_SECS)
+            application.outbound_throttle.log_stats_if_changed()
+            # nobody is reading them anymore
+            while application.dequeue():
+                pass
+    finally:
+        if instrumentation_task:
+            instrumentation_task.cancel()
+        application.loop_bridge.detach_loop()
 
 
-def dequeue_all_and_store(application: ClientApplication):
-    while True:
-        message: FIXMessage = application.dequeue()
-        if message:
-            #            log("DEQUEUED", message)
-            received_app_messages.append(message)
-        else:
-            return
-
-
-def has_message_been_received(message_kvs: Dict[str, str]) -> bool:
-    for message in list(received_app_messages):
-        if message_kvs.items() <= message.message_dict.items():
-            log("FOUND", pretty_kvs(message_kvs))
-            received_app_messages.remove(message)
-            return True
-
-    log("NOT FOUND!!", f"searched:{pretty_kvs(message_kvs)} in {len(received_app_messages)} received messages(s)")
-    return False
-
-
-def pretty_kvs(kvs: Dict[str, str]) -> str:
-    return ' | '.join([f"{k}={v}" for k, v in kvs.items()])
-
-
-def run_scenario(scenario: Scenario, application: ClientApplication):
-    while True:
-        action_line = scenario.get_current_action_line()
-        if not action_line.has_been__processed():
-            processed = process_action_line(application, action_line)
-            if processed:
-                is_ready = scenario.ready_next_action_line()
-                if not is_ready:
-                    return
-            else:
-                return
-
-
-def process_action_line(application: ClientApplication, action_line: ActionLine) -> bool:
-    action = action_line.action
-    if action == Action.CONTINUE and action_line.has_been__processed():
-        return False
-
-    log("ACTION PRC", f"Process action_line:{action_line}")
-
-    # commonly used below
-    client_id = action_line.get(FIX_CLIENTID_TAG50)
-    order_id = action_line.get(FIX_ORDERID_TAG37)
-    order_qty = action_line.get(FIX_ORDERQTY_TAG38)
-
-    if action == Action.REQUEST_IOI:
-        application.send_ioi_query(client_id)
-    elif action == Action.WAIT:
-        return has_message_been_received(action_line.key_values)
-    elif action == Action.RESERVE:
-        application.send_reserve_request(client_id, order_id, order_qty)
-    elif action == Action.ACK:
-        application.send_execution_report(client_id, order_id, order_qty, ExecutionReportType.NewAck)
-    elif action == Action.FILL:
-        application.send_execution_report(client_id, order_id, order_qty, ExecutionReportType.Filled)
-    elif action == Action.DFD:
-        application.send_execution_report(client_id, order_id, order_qty, ExecutionReportType.DFD)
-    elif action == Action.CONTINUE:
-        log("ACTION", "Continue until killed")
-    elif action == Action.END:
-        log("ACTION", "End of scenario has been requested")
-        exit(0)
-
-    # OMS Order actions
-    elif action == Action.UPDATE_ORDER:
-        row = pd.Series(action_line.key_values)
-        order_manager.update_or_add_row(-1, row, True)
-        sleep_secs = 2
-        time.sleep(sleep_secs)
-
-    else:
-        log("ERROR", f"action:{action} is not supported in action_line:{action_line}")
-        return False
-
-    action_line.mark_as_processed()
-
-    return True
+async def run_load_client(application: ClientApplication, load_profile: LoadProfile,
+                          load_results_file_path: str | None, instrumentation: Instrumentation | None = None) -> None:
+    application.attach_loop()
+    instrumentation_task = asyncio.create_task(instrumentation.run()) if instrumentation else None
+    try:
+        await run_load(application, load_profile, load_results_file_path)
+    finally:
+        if instrumentation_task:
+            instrumentation_task.cancel()
+        application.loop_bridge.detach_loop()
 
 
 def parse_args():
     ap = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    ap.add_argument('-s', '--scenario_file', type=str, nargs='?',
-                    help="Scenario file path")
+    ap.add_argument('-s', '--scenario_file', type=str, action='append',
+                    help="Scenario file path. Repeat it to run several scenarios concurrently")
+    ap.add_argument('--replay', type=str, action='append',
+                    help="Replay the messages sent by this client in a quickfix message log (as a scenario). "
+                         "Can be repeated and combined with --scenario_file")
+    add_replay_speed_argument(ap)
 
     ap.add_argument('config_file', nargs='?')
+    ap.add_argument('--inbox_max_messages', type=int, default=MessageInbox.DEFAULT_MAX_MESSAGES,
+                    help="Max number of received messages kept for the scenario WAIT steps (0 = no limit)")
+    ap.add_argument('--inbox_max_age_secs', type=float, default=MessageInbox.DEFAULT_MAX_AGE_SECS,
+                    help="Received messages not matched by a WAIT step within this delay are dropped (0 = no limit)")
+    add_load_arguments(ap)
+    add_fill_arguments(ap)
 
     return ap.parse_args()
 
 
 if __name__ == "__main__":
-    order_manager = OrderManager()
     cli_args = parse_args()
-    if cli_args.scenario_file:
-        scenario = Scenario(cli_args.scenario_file)
+    if cli_args.generate_orders:
+        order_count = generate_order_book(load_profile_from_args(cli_args),
+                                          background_order_count=cli_args.background_orders)
+        print(f"Generated {order_count} order(s) in {OrderStore.ORDERS_FILE_PATH}")
+        exit(0)
+
+    if cli_args.load:
+        main(cli_args.config_file, None, load_profile_from_args(cli_args, fill_profile_from_args(cli_args)),
+             results_file_path=cli_args.results_json)
     else:
-        scenario = None
-    main(cli_args.config_file, scenario)
+        main(cli_args.config_file, cli_args.scenario_file, inbox_max_messages=cli_args.inbox_max_messages,
+             inbox_max_age_secs=cli_args.inbox_max_age_secs, results_file_path=cli_args.results_json,
+             replay_log_file_paths=cli_args.replay, replay_speed=cli_args.replay_speed,
+             auto_fill_profile=fill_profile_from_args(cli_args) if cli_args.auto_fill else None)
@@ -0,0 +1,149 @@
+import os
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Tuple, List, Deque
+
+import quickfix as fix
+
+from settings import get_session_settings_dicts
+
+FIX_SEPARATOR = '\x01'
+LOG_TIMESTAMP_SEPARATOR = ' : '
+HEARTBEAT_MARKER = f"{FIX_SEPARATOR}35={fix.MsgType_Heartbeat}{FIX_SEPARATOR}"
+# How far from the end of the log the tailer starts looking for its first lines (x4 until it finds enough)
+INITIAL_TAIL_BYTES = 64 * 1024
+
+# A quickfix FileLog message line looks like (with FileIncludeMilliseconds=Y):
+# 20240118-21:36:50.123 : 8=FIX.4.2^A9=...^A35=D^A...^A10=123^A
+
+
+def parse_fix_string(fix_string: str, separator: str = FIX_SEPARATOR) -> Dict[str, str]:
+    fields: Dict[str, str] = {}
+    for kv_pair in fix_string.split(separator):
+        key, sep, value = kv_pair.partition('=')
+        if sep:
+            fields[key] = value
+
+    return fields
+
+
+def parse_log_line(line: str) -> Tuple[str | None, Dict[str, str]]:
+    timestamp, sep, fix_string = line.rstrip('\r\n').partition(LOG_TIMESTAMP_SEPARATOR)
+    if not sep:
+        # no timestamp
+        return None, parse_fix_string(timestamp)
+
+    return timestamp, parse_fix_string(fix_string)
+
+
+def parse_log_timestamp(timestamp: str) -> float:
+    # '20240118-21:36:50.123' (or more digits) -> seconds since the epoch
+    seconds_str, _, fraction_str = timestamp.partition('.')
+    seconds = datetime.strptime(seconds_str, '%Y%m%d-%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    return seconds + (float('0.' + fraction_str) if fraction_str else 0.0)
+
+
+def iter_log_lines(file_path: str, start_offset: int = 0) -> Iterator[Tuple[int, str]]:
+    # Stream the file and yield (offset right after the line, line). Only complete lines are returned
+    with open(file_path, 'rb') as fp:
+        fp.seek(start_offset)
+        offset = start_offset
+        for raw_line in fp:
+            if not raw_line.endswith(b'\n'):
+                # partially written line, it will be read the next time around
+                return
+            offset += len(raw_line)
+            yield offset, raw_line.decode('utf-8', errors='replace')
+
+
+def iter_log_messages(file_path: str, start_offset: int = 0) -> Iterator[Tuple[int, str | None, Dict[str, str]]]:
+    for offset, line in iter_log_lines(file_path, start_offset):
+        timestamp, fields = parse_log_line(line)
+        if fields:
+            yield offset, timestamp, fields
+
+
+def get_sender_comp_id_per_message_log_file_path(config_file: str) -> Dict[str, str]:
+    # Mimic the way quickfix's FileLog names its files: <BeginString>-<SenderCompID>-<TargetCompID>.messages.current.log
+    sender_comp_id_per_file_path: Dict[str, str] = {}
+    for session_settings in get_session_settings_dicts(config_file):
+        if 'FileLogPath' in session_settings:
+            sender_comp_id = session_settings['SenderCompID']
+            prefix = '-'.join([session_settings['BeginString'], sender_comp_id, session_settings['TargetCompID']])
+            if session_settings.get('SessionQualifier', None):
+                prefix += f"-{session_settings['SessionQualifier']}"
+            file_path = os.path.join(session_settings['FileLogPath'], f"{prefix}.messages.current.log")
+            sender_comp_id_per_file_path[file_path] = sender_comp_id
+
+    return sender_comp_id_per_file_path
+
+
+def get_message_log_file_paths(config_file: str) -> List[str]:
+    return list(get_sender_comp_id_per_message_log_file_path(config_file))
+
+
+class LogTailer:
+    # Keeps the last max_lines lines of a growing log file as (offset right after the line, line). Each poll()
+    # only reads what has been appended since the previous one, so its cost doesn't depend on the size of the
+    # log. A rotated (new inode) or truncated log is read again from its start.
+    def __init__(self, file_path: str, max_lines: int = 100, skip_heartbeats: bool = True):
+        self.file_path = file_path
+        self.skip_heartbeats = skip_heartbeats
+        self.lines: Deque[Tuple[int, str]] = deque(maxlen=max_lines)
+        self.offset: int | None = None
+        self.inode: int | None = None
+
+    @property
+    def max_lines(self) -> int:
+        return self.lines.maxlen
+
+    def set_max_lines(self, max_lines: int) -> None:
+        if max_lines < self.max_lines:
+            self.lines = deque(self.lines, maxlen=max_lines)
+        elif max_lines > self.max_lines:
+            # the older lines have to be read again
+            self.lines = deque(maxlen=max_lines)
+            self.offset = None
+
+    def is_kept(self, line: str) -> bool:
+        return not self.skip_heartbeats or HEARTBEAT_MARKER not in line
+
+    def poll(self) -> int:
+        # Returns the number of new lines
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return 0
+        if stat.st_ino != self.inode or (self.offset is not None and stat.st_size < self.offset):
+            self.inode = stat.st_ino
+            self.offset = None
+            self.lines.clear()
+        if self.offset is None:
+            self.offset = self.find_tail_offset(stat.st_size)
+        if stat.st_size == self.offset:
+            return 0
+
+        new_line_count = 0
+        for offset, line in iter_log_lines(self.file_path, self.offset):
+            self.offset = offset
+            if self.is_kept(line):
+                self.lines.append((offset, line.rstrip('\r\n')))
+                new_line_count += 1
+
+        return new_line_count
+
+    def find_tail_offset(self, file_size: int) -> int:
+        # Offset of a line start close enough to the end of the file to still have max_lines lines after it
+        tail_bytes = INITIAL_TAIL_BYTES
+        with open(self.file_path, 'rb') as fp:
+            while tail_bytes < file_size:
+                fp.seek(file_size - tail_bytes)
+                chunk = fp.read(tail_bytes)
+                first_line_start = chunk.find(b'\n') + 1
+                kept_line_count = sum(1 for line in chunk[first_line_start:].split(b'\n')
+                                      if line and self.is_kept(line.decode('utf-8', errors='replace')))
+                if first_line_start and kept_line_count > self.max_lines:
+                    return file_size - tail_bytes + first_line_start
+                tail_bytes *= 4
+
+        return 0
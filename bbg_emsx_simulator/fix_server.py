@@ -1,28 +1,71 @@
+import asyncio
+
 import quickfix as fix
-import sys, time
+import sys
+from async_runtime import run_periodically
+from checkpoint import ServerCheckpoint
+from control_api import ControlAPI
+from instrumentation import Instrumentation
+from outbound_throttle import ThrottleConfig
 from server_application import ServerApplication
+from server_metrics import METRICS_SAMPLE_INTERVAL_SECS
 from settings import get_settings
 
+# (a stat of the instructions file, the scenarios wait for the changes to be acknowledged)
+ORDER_CHANGES_CHECK_INTERVAL_SECS = .05
+THROTTLE_STATS_LOG_INTERVAL_SECS = 10
+
 
 def main(config_file):
+    acceptor = None
+    checkpoint = None
+    instrumentation = None
     try:
         settings = get_settings(config_file)
-        application = ServerApplication()
+        application = ServerApplication(ThrottleConfig.from_settings(settings))
+        instrumentation = Instrumentation.from_settings(settings, 'server')
+        if instrumentation:
+            application.enable_instrumentation(instrumentation)
+        # Restore the state from before a restart before accepting any new message
+        checkpoint = ServerCheckpoint.from_settings(application, settings, config_file)
+        checkpoint.restore()
         storeFactory = fix.FileStoreFactory(settings)
         logFactory = fix.FileLogFactory(settings)
         acceptor = fix.SocketAcceptor(application, storeFactory, settings, logFactory)
         acceptor.start()
         print("FIX Server started.")
-        while True:
-            time.sleep(.5)
-            application.check_for_order_changes()
-            if application.from_app_queue.not_empty:
-                application.process_message_from_app_queue()
+        asyncio.run(serve(application, checkpoint, ControlAPI.from_settings(application, settings), instrumentation))
 
     except (fix.ConfigError, Exception) as e:
         print(e)
     finally:
-        acceptor.stop()
+        if acceptor:
+            acceptor.stop()
+            # release it while the application is still alive, quickfix crashes when it's garbage collected after
+            del acceptor
+        # (its drain threads)
+        ServerApplication.outbound_throttle.stop()
+        if checkpoint:
+            checkpoint.save()
+        if instrumentation:
+            instrumentation.dump()
+
+
+async def serve(application: ServerApplication, checkpoint: ServerCheckpoint,
+                control_api: ControlAPI | None = None, instrumentation: Instrumentation | None = None) -> None:
+    # From now on, the messages received by quickfix are processed on this event loop
+    application.loop_bridge.attach_loop()
+    try:
+        await asyncio.gather(
+            run_periodically(application.check_for_order_changes, ORDER_CHANGES_CHECK_INTERVAL_SECS),
+            run_periodically(application.outbound_throttle.log_stats_if_changed, THROTTLE_STATS_LOG_INTERVAL_SECS),
+            checkpoint.run(),
+            run_periodically(application.sample_metrics, METRICS_SAMPLE_INTERVAL_SECS),
+            *([control_api.serve()] if control_api else []),
+            *([instrumentation.run()] if instrumentation else []),
+        )
+    finally:
+        application.loop_bridge.detach_loop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+import asyncio
+import inspect
+import os
+import signal
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, List
+
+import quickfix as fix
+
+from async_runtime import run_periodically
+from latency_histogram import LatencyHistogram
+
+METRIC_NAME = 'bbg_emsx_simulator_call_duration_seconds'
+# (recorded in nanoseconds, up to a minute)
+HIGHEST_TRACKABLE_DURATION_NS = 60_000_000_000
+QUANTILES: List[float] = [.5, .9, .99, .999]
+# The stats are dumped on that signal (and at exit), and every interval when it's set
+DUMP_SIGNAL = getattr(signal, 'SIGUSR1', None)
+
+
+class Instrumentation:
+    # Opt-in timers around the hot methods of the applications: instrument() replaces methods of an object by
+    # timed versions of themselves (as attributes of that object, the classes and the other objects are left
+    # untouched), so that nothing is paid unless it's enabled. Each call's duration goes into a LatencyHistogram per
+    # <component>.<method>, they're dumped in Prometheus' text format.
+    SETTING_STATS_FILE_PATH = 'InstrumentationStatsFilePath'
+    SETTING_DUMP_INTERVAL_SECS = 'InstrumentationDumpIntervalSecs'
+
+    def __init__(self, stats_file_path: str, app_name: str, dump_interval_secs: float = 0.0):
+        self.stats_file_path = stats_file_path
+        self.app_name = app_name
+        self.dump_interval_secs = dump_interval_secs
+        # (the quickfix callbacks are timed on quickfix's threads, the handlers on the event loop)
+        self.lock = threading.Lock()
+        self.histogram_per_call: Dict[str, LatencyHistogram] = {}
+
+    @staticmethod
+    def from_settings(settings: fix.SessionSettings, app_name: str) -> 'Instrumentation | None':
+        # Disabled when no stats file is set
+        defaults = settings.get()
+        stats_file_path = defaults.getString(Instrumentation.SETTING_STATS_FILE_PATH) \
+            if defaults.has(Instrumentation.SETTING_STATS_FILE_PATH) else ''
+        if not stats_file_path:
+            return None
+        dump_interval_secs = defaults.getDouble(Instrumentation.SETTING_DUMP_INTERVAL_SECS) \
+            if defaults.has(Instrumentation.SETTING_DUMP_INTERVAL_SECS) else 0.0
+
+        return Instrumentation(stats_file_path, app_name, dump_interval_secs)
+
+    def instrument(self, target: object, component: str, method_names: List[str]) -> None:
+        for method_name in method_names:
+            setattr(target, method_name, self.timed(f"{component}.{method_name}", getattr(target, method_name)))
+
+    def timed(self, call_name: str, function: Callable) -> Callable:
+        with self.lock:
+            histogram = self.histogram_per_call.setdefault(
+                call_name, LatencyHistogram(highest_trackable_value=HIGHEST_TRACKABLE_DURATION_NS))
+        lock = self.lock
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            start_ns = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration_ns = time.perf_counter_ns() - start_ns
+                with lock:
+                    histogram.record(duration_ns)
+
+        return timed_function
+
+    def to_prometheus_text(self) -> str:
+        lines = [f"# HELP {METRIC_NAME} Duration of the instrumented simulator calls",
+                 f"# TYPE {METRIC_NAME} summary"]
+        with self.lock:
+            for call_name, histogram in sorted(self.histogram_per_call.items()):
+                labels = f'app="{self.app_name}",call="{call_name}"'
+                for quantile in QUANTILES:
+                    value_ns = histogram.get_value_at_percentile(quantile * 100)
+                    lines.append(f'{METRIC_NAME}{{{labels},quantile="{quantile:g}"}} {value_ns / 1e9:.9f}')
+                lines.append(f"{METRIC_NAME}_sum{{{labels}}} {histogram.total_sum / 1e9:.9f}")
+                lines.append(f"{METRIC_NAME}_count{{{labels}}} {histogram.total_count}")
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        # (written next to it and then renamed, a scraper never reads a partial file)
+        tmp_file_path = f"{self.stats_file_path}.tmp"
+        try:
+            with open(tmp_file_path, 'w') as fp:
+                fp.write(self.to_prometheus_text())
+            os.replace(tmp_file_path, self.stats_file_path)
+        except OSError as e:
+            print(f"ERROR: can't write the instrumentation stats to:{self.stats_file_path}: {e}")
+
+    async def run(self) -> None:
+        # Dumps the stats on DUMP_SIGNAL and every dump_interval_secs (if set), until cancelled
+        loop = asyncio.get_running_loop()
+        if DUMP_SIGNAL is not None:
+            loop.add_signal_handler(DUMP_SIGNAL, self.dump)
+        try:
+            if self.dump_interval_secs > 0:
+                await run_periodically(self.dump, self.dump_interval_secs)
+            else:
+                await loop.create_future()
+        finally:
+            if DUMP_SIGNAL is not None:
+                loop.remove_signal_handler(DUMP_SIGNAL)
+
+
+def get_public_method_names(target: object, prefix: str = '') -> List[str]:
+    # (the static methods are left out, they're called through the class)
+    return [name for name in dir(type(target))
+            if name.startswith(prefix) and not name.startswith('_') and callable(getattr(target, name)) and
+            not isinstance(inspect.getattr_static(type(target), name), staticmethod)]
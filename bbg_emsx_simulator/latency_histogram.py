@@ -0,0 +1,120 @@
+import math
+from array import array
+from typing import Dict, List
+
+
+class LatencyHistogram:
+    # A simplified HdrHistogram: values are recorded in log-linear buckets so that the memory is fixed, recording is
+    # O(1) and every value is reported with the requested number of significant digits.
+    DEFAULT_PERCENTILES: List[float] = [50.0, 90.0, 99.0, 99.9]
+
+    def __init__(self, lowest_trackable_value: int = 1, highest_trackable_value: int = 3_600_000_000,
+                 significant_digits: int = 2):
+        self.lowest_trackable_value = lowest_trackable_value
+        self.highest_trackable_value = highest_trackable_value
+        self.significant_digits = significant_digits
+
+        largest_value_with_single_unit_resolution = 2 * 10 ** significant_digits
+        self.unit_magnitude = int(math.floor(math.log2(lowest_trackable_value)))
+        sub_bucket_count_magnitude = int(math.ceil(math.log2(largest_value_with_single_unit_resolution)))
+        self.sub_bucket_half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.sub_bucket_count = 1 << (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+
+        smallest_untrackable_value = self.sub_bucket_count << self.unit_magnitude
+        self.bucket_count = 1
+        while smallest_untrackable_value <= highest_trackable_value:
+            smallest_untrackable_value <<= 1
+            self.bucket_count += 1
+
+        self.counts = array('Q', [0] * ((self.bucket_count + 1) * self.sub_bucket_half_count))
+        self.total_count = 0
+        self.total_sum = 0
+        self.min_value = 0
+        self.max_value = 0
+        self.overflow_count = 0
+
+    def get_counts_index(self, value: int) -> int:
+        bucket_index = (value | self.sub_bucket_mask).bit_length() - self.unit_magnitude - \
+                       (self.sub_bucket_half_count_magnitude + 1)
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        return ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) + \
+            (sub_bucket_index - self.sub_bucket_half_count)
+
+    def get_value_from_index(self, index: int) -> int:
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << (bucket_index + self.unit_magnitude)
+
+    def get_highest_equivalent_value(self, index: int) -> int:
+        bucket_index = max((index >> self.sub_bucket_half_count_magnitude) - 1, 0)
+        return self.get_value_from_index(index) + (1 << (bucket_index + self.unit_magnitude)) - 1
+
+    def record(self, value: int, count: int = 1) -> None:
+        value = int(value)
+        if value < 0:
+            value = 0
+        if value > self.highest_trackable_value:
+            self.overflow_count += count
+            value = self.highest_trackable_value
+        self.counts[self.get_counts_index(value)] += count
+        if self.total_count == 0 or value < self.min_value:
+            self.min_value = value
+        if value > self.max_value:
+            self.max_value = value
+        self.total_count += count
+        self.total_sum += value * count
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        assert len(self.counts) == len(other.counts), "Can only merge histograms with the same settings"
+        if other.total_count == 0:
+            return
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.min_value = other.min_value if self.total_count == 0 else min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        self.total_count += other.total_count
+        self.total_sum += other.total_sum
+        self.overflow_count += other.overflow_count
+
+    def reset(self) -> None:
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.total_count = self.total_sum = self.min_value = self.max_value = self.overflow_count = 0
+
+    def get_value_at_percentile(self, percentile: float) -> int:
+        if self.total_count == 0:
+            return 0
+        count_at_percentile = max(int(math.ceil(percentile / 100.0 * self.total_count)), 1)
+        running_count = 0
+        for index, count in enumerate(self.counts):
+            running_count += count
+            if running_count >= count_at_percentile:
+                return min(self.get_highest_equivalent_value(index), self.max_value)
+
+        return self.max_value
+
+    def get_mean(self) -> float:
+        return self.total_sum / self.total_count if self.total_count else 0.0
+
+    def summary(self, percentiles: List[float] | None = None) -> Dict[str, float]:
+        summary: Dict[str, float] = {
+            'count': self.total_count,
+            'min': self.min_value,
+            'mean': round(self.get_mean(), 1),
+        }
+        for percentile in percentiles if percentiles else LatencyHistogram.DEFAULT_PERCENTILES:
+            summary[f"p{percentile:g}"] = self.get_value_at_percentile(percentile)
+        summary['max'] = self.max_value
+
+        return summary
+
+
+def format_summary(name: str, summary: Dict[str, float], unit: str = 'us') -> str:
+    values = '  '.join(f"{k}:{v}" if k == 'count' else f"{k}:{v}{unit}" for k, v in summary.items())
+    return f"{name:<22} {values}"
@@ -0,0 +1,440 @@
+import argparse
+import asyncio
+import csv
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Deque, Set
+
+import quickfix as fix
+
+from client_application import ClientApplication, ExecutionReportType
+from fill_engine import FillEngine, FillProfile
+from fix_application import FIXApplication, FIXMessage, set_logging_enabled
+from latency_histogram import LatencyHistogram, format_summary
+from models import Order, SIDES
+from order_store import OrderStore
+
+FLOW_IOI = 'ioi'
+FLOW_RESERVE = 'reserve'
+FLOW_FILL = 'fill'
+FLOW_PARTIAL_DFD = 'partial_dfd'
+# Filled by the fill engine, following LoadProfile.fill_profile
+FLOW_SCHEDULED_FILLS = 'scheduled_fills'
+FLOW_TYPES = [FLOW_IOI, FLOW_RESERVE, FLOW_FILL, FLOW_PARTIAL_DFD, FLOW_SCHEDULED_FILLS]
+
+LATENCY_IOI_TO_ORDER = 'ioi->35=D'
+LATENCY_RESERVE_TO_ACCEPT = 'reserve->accept'
+LATENCY_FILL_TO_CORRECTION = 'fill->35=G'
+LATENCY_DFD_TO_CORRECTION = 'dfd->35=G'
+LATENCY_NAMES = [LATENCY_IOI_TO_ORDER, LATENCY_RESERVE_TO_ACCEPT, LATENCY_FILL_TO_CORRECTION, LATENCY_DFD_TO_CORRECTION]
+
+# A None value means that the tag must NOT be in the message
+MessagePattern = Dict[str, str | None]
+
+
+@dataclass
+class LoadProfile:
+    uuid_count: int = 10
+    orders_per_uuid: int = 10
+    first_uuid: int = 100_000
+    first_order_id: int = 1_000_000
+    order_shares: int = 10_000_000
+    reserve_shares: int = 100
+    # 0 = closed loop: each order starts its next flow as soon as the previous one is done
+    flows_per_sec: float = 50.0
+    duration_secs: float = 30.0
+    # Stop after starting that many flows (0 = only the duration counts)
+    flow_count: int = 0
+    timeout_secs: float = 10.0
+    flow_mix: Dict[str, float] = field(default_factory=lambda: {FLOW_RESERVE: 2, FLOW_FILL: 6, FLOW_PARTIAL_DFD: 2})
+    fill_profile: FillProfile = field(default_factory=FillProfile)
+
+    def get_uuids(self) -> List[str]:
+        return [str(self.first_uuid + i) for i in range(self.uuid_count)]
+
+    def get_order_ids_per_uuid(self) -> Dict[str, List[str]]:
+        order_ids_per_uuid: Dict[str, List[str]] = {}
+        order_id = self.first_order_id
+        for uuid in self.get_uuids():
+            order_ids_per_uuid[uuid] = [str(order_id + i) for i in range(self.orders_per_uuid)]
+            order_id += self.orders_per_uuid
+
+        return order_ids_per_uuid
+
+    @staticmethod
+    def parse_flow_mix(flow_mix_str: str) -> Dict[str, float]:
+        # Format: fill=6,reserve=2,partial_dfd=2,ioi=0
+        flow_mix: Dict[str, float] = {}
+        for flow_weight in flow_mix_str.split(','):
+            flow_type, weight = flow_weight.split('=')
+            if flow_type not in FLOW_TYPES:
+                raise ValueError(f"Unknown flow type:{flow_type}. Valid ones: {', '.join(FLOW_TYPES)}")
+            flow_mix[flow_type] = float(weight)
+
+        return flow_mix
+
+
+def generate_order_book(profile: LoadProfile, file_path: str = OrderStore.ORDERS_FILE_PATH,
+                        background_order_count: int = 0) -> int:
+    # The background orders belong to other uuids than the profile's, no flow touches them but the server still
+    # holds them, as it would with a real book.
+    # Symbols starting with Z are always rejected by the server so they're left out
+    symbols = [symbol for symbol in FIXApplication.KNOWN_SYMBOLS_BY_TICKER if not symbol.startswith('Z')]
+    sides = list(SIDES)
+    order_count = 0
+    with open(file_path, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(Order.CSV_COLUMNS)
+        for uuid, order_ids in profile.get_order_ids_per_uuid().items():
+            for order_id in order_ids:
+                order = Order(True, int(order_id), int(uuid), random.choice(symbols), random.choice(sides),
+                              profile.order_shares, round(random.uniform(1, 100), 2))
+                writer.writerow(order.to_csv_row())
+                order_count += 1
+        first_background_uuid = profile.first_uuid + profile.uuid_count
+        first_background_order_id = profile.first_order_id + order_count
+        for i in range(background_order_count):
+            order = Order(True, first_background_order_id + i, first_background_uuid + i // profile.orders_per_uuid,
+                          random.choice(symbols), random.choice(sides), profile.order_shares,
+                          round(random.uniform(1, 100), 2))
+            writer.writerow(order.to_csv_row())
+            order_count += 1
+
+    return order_count
+
+
+class MessageWaiters:
+    # Futures waiting for a message matching one of their patterns, indexed by a key tag value (e.g. 37=<order_id>)
+    def __init__(self):
+        self.waiters_per_key: Dict[Tuple[str, str], List[Tuple[List[MessagePattern], asyncio.Future]]] = {}
+
+    @staticmethod
+    def matches(message: FIXMessage, pattern: MessagePattern) -> bool:
+        for tag, value in pattern.items():
+            if message.message_dict.get(tag, None) != value:
+                return False
+        return True
+
+    async def wait_for(self, key: Tuple[str, str], patterns: List[MessagePattern],
+                       timeout_secs: float) -> Tuple[int, FIXMessage, int]:
+        future = asyncio.get_running_loop().create_future()
+        waiters = self.waiters_per_key.setdefault(key, [])
+        waiter = (patterns, future)
+        waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout_secs)
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self.waiters_per_key.pop(key, None)
+
+    def on_message(self, message: FIXMessage, received_ns: int) -> None:
+        for tag in [str(fix.OrderID().getField()), str(fix.SenderSubID().getField())]:
+            value = message.message_dict.get(tag, None)
+            waiters = self.waiters_per_key.get((tag, value), None) if value is not None else None
+            if not waiters:
+                continue
+            for patterns, future in list(waiters):
+                for pattern_index, pattern in enumerate(patterns):
+                    if not future.done() and MessageWaiters.matches(message, pattern):
+                        future.set_result((pattern_index, message, received_ns))
+                        waiters.remove((patterns, future))
+                        break
+
+
+class LoadGenerator:
+    def __init__(self, application: ClientApplication, profile: LoadProfile):
+        self.application = application
+        self.profile = profile
+        self.waiters = MessageWaiters()
+        self.latency_per_name: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in LATENCY_NAMES}
+        self.counters: Dict[str, int] = {}
+        self.order_ids_per_uuid = profile.get_order_ids_per_uuid()
+        self.uuid_per_order_id = {order_id: uuid for uuid, order_ids in self.order_ids_per_uuid.items()
+                                  for order_id in order_ids}
+        self.idle_order_ids: Deque[str] = deque()
+        self.busy_ioi_uuids: Set[str] = set()
+        self.started_flow_count = 0
+        self.elapsed_secs = 0.0
+        self.fill_engine = FillEngine(application, profile.fill_profile) \
+            if profile.flow_mix.get(FLOW_SCHEDULED_FILLS, 0) > 0 else None
+
+    def count(self, name: str, increment: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + increment
+
+    def record_latency(self, name: str, sent_ns: int, received_ns: int) -> None:
+        # in microseconds
+        self.latency_per_name[name].record((received_ns - sent_ns) // 1000)
+
+    async def expect(self, key_tag: str, key_value: str, patterns: List[MessagePattern]) -> Tuple[int, int] | None:
+        try:
+            pattern_index, _, received_ns = await self.waiters.wait_for((key_tag, key_value), patterns,
+                                                                        self.profile.timeout_secs)
+            return pattern_index, received_ns
+        except asyncio.TimeoutError:
+            self.count('timeouts')
+            return None
+
+    async def run(self) -> Dict:
+        self.application.is_queueing_app_messages = False
+        self.application.add_message_listener(self.waiters.on_message)
+        while not self.application.is_logged_on():
+            await asyncio.sleep(.1)
+
+        print(f"Subscribing to {self.profile.uuid_count} uuid(s) with {self.profile.orders_per_uuid} order(s) each...")
+        await asyncio.gather(*[self.subscribe_uuid(uuid) for uuid in self.order_ids_per_uuid])
+        order_ids = list(self.uuid_per_order_id)
+        random.shuffle(order_ids)
+        self.idle_order_ids.extend(order_ids)
+
+        rate = f"{self.profile.flows_per_sec} flow(s)/sec" if self.profile.flows_per_sec > 0 else \
+            f"back to back flows on {len(order_ids)} order(s)"
+        flow_count = f" (at most {self.profile.flow_count} flows)" if self.profile.flow_count else ''
+        print(f"Generating {rate} for {self.profile.duration_secs}s{flow_count} with mix:{self.profile.flow_mix}...")
+        if self.fill_engine:
+            self.fill_engine.start()
+        try:
+            await self.generate_flows()
+        finally:
+            if self.fill_engine:
+                await self.fill_engine.stop()
+
+        return self.get_results()
+
+    async def subscribe_uuid(self, uuid: str) -> None:
+        # The IOI query makes the server send a 35=D per active order, which the orders flows need first
+        expected_order_ids = set(self.order_ids_per_uuid[uuid])
+        received_order_ids: Set[str] = set()
+
+        def on_order(message: FIXMessage, _: int) -> None:
+            if message.get(fix.SenderSubID()) == uuid and message.get(fix.MsgType()) == fix.MsgType_NewOrderSingle:
+                received_order_ids.add(message.get(fix.OrderID()))
+
+        self.application.add_message_listener(on_order)
+        try:
+            self.application.send_ioi_query(uuid)
+            deadline = time.monotonic() + self.profile.timeout_secs
+            while not expected_order_ids <= received_order_ids and time.monotonic() < deadline:
+                await asyncio.sleep(.05)
+        finally:
+            self.application.message_listeners.remove(on_order)
+        missing_count = len(expected_order_ids - received_order_ids)
+        if missing_count:
+            self.count('orders_missing_after_ioi', missing_count)
+
+    async def generate_flows(self) -> None:
+        loop = asyncio.get_running_loop()
+        flow_types = [flow_type for flow_type, weight in self.profile.flow_mix.items() if weight > 0]
+        weights = [self.profile.flow_mix[flow_type] for flow_type in flow_types]
+        tasks: Set[asyncio.Task] = set()
+
+        start_time = loop.time()
+        next_flow_time = start_time
+        end_time = start_time + self.profile.duration_secs
+        if self.profile.flows_per_sec <= 0:
+            # Closed loop: as many flows in flight as there are orders
+            await asyncio.gather(*[self.run_flows_back_to_back(flow_types, weights, end_time)
+                                   for _ in self.uuid_per_order_id])
+            self.elapsed_secs = loop.time() - start_time
+            return
+
+        interval_secs = 1.0 / self.profile.flows_per_sec
+        while loop.time() < end_time and not self.is_flow_count_reached():
+            flow_type = random.choices(flow_types, weights)[0]
+            task = self.start_flow(flow_type)
+            if task:
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # Keep an absolute schedule so that the target rate is kept even when the loop is late
+            next_flow_time += interval_secs
+            await asyncio.sleep(max(next_flow_time - loop.time(), 0))
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        self.elapsed_secs = loop.time() - start_time
+
+    async def run_flows_back_to_back(self, flow_types: List[str], weights: List[float], end_time: float) -> None:
+        loop = asyncio.get_running_loop()
+        while loop.time() < end_time and not self.is_flow_count_reached():
+            task = self.start_flow(random.choices(flow_types, weights)[0])
+            if task:
+                await task
+            else:
+                # (all the uuids are busy with an IOI flow)
+                await asyncio.sleep(.001)
+
+    def is_flow_count_reached(self) -> bool:
+        return 0 < self.profile.flow_count <= self.started_flow_count
+
+    def start_flow(self, flow_type: str) -> asyncio.Task | None:
+        if flow_type == FLOW_IOI:
+            idle_uuids = [uuid for uuid in self.order_ids_per_uuid if uuid not in self.busy_ioi_uuids]
+            if not idle_uuids:
+                self.count('skipped_flows')
+                return None
+            uuid = random.choice(idle_uuids)
+            self.busy_ioi_uuids.add(uuid)
+            self.started_flow_count += 1
+            return asyncio.create_task(self.run_ioi_flow(uuid))
+
+        if not self.idle_order_ids:
+            # All the orders are busy with a flow: the server isn't keeping up with the target rate
+            self.count('skipped_flows')
+            return None
+        order_id = self.idle_order_ids.popleft()
+        self.started_flow_count += 1
+        return asyncio.create_task(self.run_order_flow(flow_type, self.uuid_per_order_id[order_id], order_id))
+
+    async def run_ioi_flow(self, uuid: str) -> None:
+        self.count(f'started_{FLOW_IOI}')
+        try:
+            outcome = await self.send_and_expect(lambda: self.application.send_ioi_query(uuid),
+                                                 '50', uuid, [{'35': fix.MsgType_NewOrderSingle, '39': None}])
+            if outcome:
+                self.record_latency(LATENCY_IOI_TO_ORDER, outcome[1], outcome[2])
+                self.count(f'completed_{FLOW_IOI}')
+        finally:
+            self.busy_ioi_uuids.discard(uuid)
+
+    async def send_and_expect(self, send, key_tag: str, key_value: str,
+                              patterns: List[MessagePattern]) -> Tuple[int, int, int] | None:
+        # Register the expectation before sending so that a fast response can't be missed
+        task = asyncio.ensure_future(self.expect(key_tag, key_value, patterns))
+        await asyncio.sleep(0)
+        sent_ns = time.perf_counter_ns()
+        send()
+        outcome = await task
+        if outcome:
+            return outcome[0], sent_ns, outcome[1]
+        return None
+
+    async def run_order_flow(self, flow_type: str, uuid: str, order_id: str) -> None:
+        self.count(f'started_{flow_type}')
+        reserve_shares = self.profile.reserve_shares
+        try:
+            accept = {'35': fix.MsgType_NewOrderSingle, '39': fix.OrdStatus_NEW}
+            reject = {'35': fix.MsgType_ExecutionReport, '39': fix.OrdStatus_REJECTED}
+            outcome = await self.send_and_expect(
+                lambda: self.application.send_reserve_request(uuid, order_id, str(reserve_shares)),
+                '37', order_id, [accept, reject])
+            if outcome is None:
+                return
+            pattern_index, sent_ns, received_ns = outcome
+            self.record_latency(LATENCY_RESERVE_TO_ACCEPT, sent_ns, received_ns)
+            if pattern_index == 1:
+                self.count('rejected_reserves')
+                return
+            if flow_type != FLOW_SCHEDULED_FILLS:
+                # (the fill engine sends its own)
+                self.application.send_execution_report(uuid, order_id, str(reserve_shares),
+                                                       ExecutionReportType.NewAck)
+
+            correction = {'35': fix.MsgType_OrderCancelReplaceRequest}
+            if flow_type == FLOW_FILL:
+                outcome = await self.send_and_expect(
+                    lambda: self.application.send_execution_report(uuid, order_id, str(reserve_shares),
+                                                                   ExecutionReportType.Filled),
+                    '37', order_id, [correction])
+                if outcome is None:
+                    return
+                self.record_latency(LATENCY_FILL_TO_CORRECTION, outcome[1], outcome[2])
+
+            elif flow_type == FLOW_PARTIAL_DFD:
+                partial_shares = str(max(reserve_shares // 2, 1))
+                outcome = await self.send_and_expect(
+                    lambda: self.application.send_execution_report(uuid, order_id, partial_shares,
+                                                                   ExecutionReportType.Filled),
+                    '37', order_id, [correction])
+                if outcome is None:
+                    return
+                self.record_latency(LATENCY_FILL_TO_CORRECTION, outcome[1], outcome[2])
+                outcome = await self.send_and_expect(
+                    lambda: self.application.send_execution_report(uuid, order_id, partial_shares,
+                                                                   ExecutionReportType.DFD),
+                    '37', order_id, [correction])
+                if outcome is None:
+                    return
+                self.record_latency(LATENCY_DFD_TO_CORRECTION, outcome[1], outcome[2])
+
+            elif flow_type == FLOW_SCHEDULED_FILLS:
+                if not await self.fill_engine.start_order(uuid, order_id, reserve_shares):
+                    return
+
+            self.count(f'completed_{flow_type}')
+        finally:
+            self.idle_order_ids.append(order_id)
+
+    def get_results(self) -> Dict:
+        completed_count = sum(v for k, v in self.counters.items() if k.startswith('completed_'))
+        return {
+            'profile': dict(self.profile.__dict__, fill_profile=dict(self.profile.fill_profile.__dict__,
+                                                                      strategy=self.profile.fill_profile.strategy.value)),
+            'elapsed_secs': round(self.elapsed_secs, 3),
+            'completed_flows_per_sec': round(completed_count / self.elapsed_secs, 1) if self.elapsed_secs else 0,
+            'counters': dict(sorted(self.counters.items())),
+            'fill_engine_counters': dict(sorted(self.fill_engine.counters.items())) if self.fill_engine else {},
+            'latency_us': {name: histogram.summary() for name, histogram in self.latency_per_name.items()
+                           if histogram.total_count},
+        }
+
+
+def print_results(results: Dict) -> None:
+    print(f"\nElapsed: {results['elapsed_secs']}s  completed flows/sec: {results['completed_flows_per_sec']}")
+    print('Counters: ' + '  '.join(f"{k}:{v}" for k, v in results['counters'].items()))
+    if results['fill_engine_counters']:
+        print('Fill engine: ' + '  '.join(f"{k}:{v}" for k, v in results['fill_engine_counters'].items()))
+    print('Latencies:')
+    for name, summary in results['latency_us'].items():
+        print('  ' + format_summary(name, summary))
+
+
+async def run_load(application: ClientApplication, profile: LoadProfile, results_file_path: str | None = None) -> Dict:
+    set_logging_enabled(False)
+    try:
+        results = await LoadGenerator(application, profile).run()
+    finally:
+        set_logging_enabled(True)
+    print_results(results)
+    if results_file_path:
+        with open(results_file_path, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    return results
+
+
+def add_load_arguments(ap: argparse.ArgumentParser) -> None:
+    defaults = LoadProfile()
+    group = ap.add_argument_group('load generation')
+    group.add_argument('--load', action='store_true', help="Run in load generation mode instead of a scenario")
+    group.add_argument('--generate_orders', action='store_true',
+                       help=f"Write the order book matching the load profile to {OrderStore.ORDERS_FILE_PATH} and exit")
+    group.add_argument('--uuids', type=int, default=defaults.uuid_count, help="Number of simulated uuids")
+    group.add_argument('--orders_per_uuid', type=int, default=defaults.orders_per_uuid, help="Orders per uuid")
+    group.add_argument('--rate', type=float, default=defaults.flows_per_sec,
+                       help="Target flows per second. 0 = back to back flows on every order (closed loop)")
+    group.add_argument('--duration', type=float, default=defaults.duration_secs, help="Duration in seconds")
+    group.add_argument('--flows', type=int, default=defaults.flow_count,
+                       help="Stop after starting that many flows (0 = run for the whole duration)")
+    group.add_argument('--background_orders', type=int, default=0,
+                       help="With --generate_orders: extra orders of other uuids, which no flow touches")
+    group.add_argument('--mix', type=str, default=','.join(f"{k}={v:g}" for k, v in defaults.flow_mix.items()),
+                       help=f"Flow mix weights. Flow types: {', '.join(FLOW_TYPES)}")
+    group.add_argument('--reserve_shares', type=int, default=defaults.reserve_shares, help="Shares per reserve")
+    group.add_argument('--timeout', type=float, default=defaults.timeout_secs, help="Per response timeout in seconds")
+    group.add_argument('--results_json', type=str, help="Optional JSON file to save the results (of the load or the scenarios) to")
+
+
+def load_profile_from_args(cli_args: argparse.Namespace, fill_profile: FillProfile | None = None) -> LoadProfile:
+    return LoadProfile(uuid_count=cli_args.uuids,
+                       orders_per_uuid=cli_args.orders_per_uuid,
+                       flows_per_sec=cli_args.rate,
+                       duration_secs=cli_args.duration,
+                       flow_count=cli_args.flows,
+                       flow_mix=LoadProfile.parse_flow_mix(cli_args.mix),
+                       reserve_shares=cli_args.reserve_shares,
+                       timeout_secs=cli_args.timeout,
+                       fill_profile=fill_profile or FillProfile())
@@ -0,0 +1,43 @@
+import html
+import re
+from typing import Dict, Iterable, List, Set
+
+from fix_log import FIX_SEPARATOR
+
+DEFAULT_HIGHLIGHTED_TAGS: Set[str] = {'35', '37', '50', '55'}
+DISPLAYED_SEPARATOR = '|'
+# A log line is split on the FIX separator, or on '|' if it has already been replaced
+FIELD_SEPARATOR_REGEX = re.compile(f"[{FIX_SEPARATOR}{re.escape(DISPLAYED_SEPARATOR)}]")
+
+
+class FIXLogHighlighter:
+    # Renders FIX log lines as HTML, the fields of the highlighted tags wrapped in <span class="color_<tag>">. Each
+    # line is split into its fields once and everything is HTML escaped. The rendered lines are cached, so that a
+    # refresh only renders the lines it hasn't seen yet (the cache only keeps the lines of the last render).
+    def __init__(self, highlighted_tags: Iterable[str | int] = DEFAULT_HIGHLIGHTED_TAGS):
+        self.highlighted_tags: Set[str] = {str(tag) for tag in highlighted_tags}
+        self.html_per_line: Dict[str, str] = {}
+        self.rendered_count = 0
+
+    def render_line(self, line: str) -> str:
+        html_fields: List[str] = []
+        for field in FIELD_SEPARATOR_REGEX.split(line):
+            tag, sep, _ = field.partition('=')
+            html_field = html.escape(field, quote=False)
+            if sep and tag in self.highlighted_tags:
+                html_field = f'<span class="color_{tag}">{html_field}</span>'
+            html_fields.append(html_field)
+        self.rendered_count += 1
+
+        return DISPLAYED_SEPARATOR.join(html_fields)
+
+    def render_lines(self, lines: Iterable[str]) -> str:
+        lines = list(lines)
+        html_per_line: Dict[str, str] = {}
+        for line in lines:
+            if line not in html_per_line:
+                line_html = self.html_per_line.get(line, None)
+                html_per_line[line] = line_html if line_html is not None else self.render_line(line)
+        self.html_per_line = html_per_line
+
+        return "".join(html_per_line[line] + "\n" for line in lines)
@@ -0,0 +1,245 @@
+import argparse
+import glob
+import mmap
+import os
+import re
+import time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, List
+
+import quickfix as fix
+
+from fix_log import FIX_SEPARATOR
+
+INDEXED_TAGS = [str(tag) for tag in [fix.MsgType().getField(), fix.OrderID().getField(), fix.ClOrdID().getField(),
+                                     fix.SenderSubID().getField()]]
+# One of the indexed fields of a line: \x01<tag>=<value>, <tag>=<value> being the key
+FIELD_REGEX = re.compile(re.escape(FIX_SEPARATOR.encode()) +
+                         b'((?:' + b'|'.join(tag.encode() for tag in INDEXED_TAGS) + b')=[^\x01\n]*)')
+HEARTBEAT_KEY = f"{fix.MsgType().getField()}={fix.MsgType_Heartbeat}".encode()
+CURRENT_LOG_SUFFIX = '.current.log'
+# The tag of a search term without one, e.g. "456"
+DEFAULT_SEARCH_TAG = str(fix.OrderID().getField())
+DEFAULT_MAX_HITS = 500
+# The lines are split and parsed that many bytes at a time (a lot faster than going through the matches one by one)
+INDEX_CHUNK_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class LogSearchHit:
+    file_path: str
+    offset: int
+    line: str
+
+
+class LogFileIndex:
+    # Offsets of the message lines of one log file and, for each indexed tag=value, the (ascending) numbers of the
+    # lines that have it. The file is read through mmap and only what has been appended since the last update()
+    # gets indexed. The heartbeats are left out.
+    def __init__(self, file_path: str, inode: int):
+        self.file_path = file_path
+        self.inode = inode
+        self.indexed_offset = 0
+        self.line_offsets = array('Q')
+        self.line_numbers_per_key: Dict[bytes, array] = {}
+
+    def update(self, file_size: int, max_bytes: int | None = None) -> int:
+        # Returns the number of new lines. Only indexes (the complete lines of) about max_bytes when it's set
+        if file_size <= self.indexed_offset:
+            return 0
+        line_count = len(self.line_offsets)
+        with open(self.file_path, 'rb') as fp, mmap.mmap(fp.fileno(), file_size, access=mmap.ACCESS_READ) as mm:
+            # (only complete lines, the last one may still be being written)
+            end_offset = file_size if max_bytes is None else min(file_size, self.indexed_offset + max_bytes)
+            end_offset = mm.rfind(b'\n', self.indexed_offset, end_offset) + 1 or \
+                mm.find(b'\n', end_offset, file_size) + 1
+            if end_offset:
+                self.index_lines(mm, self.indexed_offset, end_offset)
+                self.indexed_offset = end_offset
+
+        return len(self.line_offsets) - line_count
+
+    def index_lines(self, mm: mmap.mmap, start_offset: int, end_offset: int) -> None:
+        line_offsets = self.line_offsets
+        line_numbers_per_key = self.line_numbers_per_key
+        chunk_start = start_offset
+        while chunk_start < end_offset:
+            chunk_end = mm.rfind(b'\n', chunk_start, chunk_start + INDEX_CHUNK_BYTES) + 1 \
+                if end_offset - chunk_start > INDEX_CHUNK_BYTES else end_offset
+            if not chunk_end:
+                # a line longer than a chunk
+                chunk_end = mm.find(b'\n', chunk_start + INDEX_CHUNK_BYTES, end_offset) + 1
+            line_start = chunk_start
+            # (the chunk ends with a \n, hence the empty last line)
+            for line in mm[chunk_start:chunk_end].split(b'\n')[:-1]:
+                keys = FIELD_REGEX.findall(line)
+                if keys and HEARTBEAT_KEY not in keys:
+                    line_number = len(line_offsets)
+                    line_offsets.append(line_start)
+                    for key in keys:
+                        line_numbers = line_numbers_per_key.get(key, None)
+                        if line_numbers is None:
+                            line_numbers_per_key[key] = line_numbers = array('I')
+                        line_numbers.append(line_number)
+                line_start += len(line) + 1
+            chunk_start = chunk_end
+
+    def find_line_numbers(self, keys: List[bytes], max_count: int | None = None) -> List[int]:
+        # The (last max_count) lines with all the keys: the shortest list is walked backwards, the others are binary
+        # searched
+        line_numbers_per_key = [self.line_numbers_per_key.get(key, None) for key in keys]
+        if not keys or None in line_numbers_per_key or max_count == 0:
+            return []
+        line_numbers_per_key.sort(key=len)
+        matching_line_numbers = []
+        for line_number in reversed(line_numbers_per_key[0]):
+            for line_numbers in line_numbers_per_key[1:]:
+                i = bisect_left(line_numbers, line_number)
+                if i == len(line_numbers) or line_numbers[i] != line_number:
+                    break
+            else:
+                matching_line_numbers.append(line_number)
+                if len(matching_line_numbers) == max_count:
+                    break
+        matching_line_numbers.reverse()
+
+        return matching_line_numbers
+
+    def read_lines(self, line_numbers: List[int]) -> List[LogSearchHit]:
+        hits: List[LogSearchHit] = []
+        if not line_numbers:
+            return hits
+        with open(self.file_path, 'rb') as fp, \
+                mmap.mmap(fp.fileno(), self.indexed_offset, access=mmap.ACCESS_READ) as mm:
+            for line_number in line_numbers:
+                offset = self.line_offsets[line_number]
+                line = mm[offset:mm.find(b'\n', offset)].decode('utf-8', errors='replace').rstrip('\r')
+                hits.append(LogSearchHit(self.file_path, offset, line))
+
+        return hits
+
+    def memory_bytes(self) -> int:
+        # (roughly: the arrays and their keys)
+        return self.line_offsets.itemsize * len(self.line_offsets) + \
+            sum(len(key) + line_numbers.itemsize * len(line_numbers)
+                for key, line_numbers in self.line_numbers_per_key.items())
+
+
+class LogIndex:
+    # Searchable index of a quickfix message log: <prefix>.messages.current.log and its rotated/backed up
+    # versions in the same directory. update() picks up the new lines, the new files and the rotations (a file
+    # keeps its index when it's renamed, they're tracked by inode) and forgets the deleted files.
+    # The index can be searched between two updates: update(max_bytes) only indexes that much, and is_up_to_date
+    # tells whether there's more to index.
+    def __init__(self, current_log_file_path: str):
+        self.current_log_file_path = current_log_file_path
+        prefix = current_log_file_path[:-len(CURRENT_LOG_SUFFIX)] \
+            if current_log_file_path.endswith(CURRENT_LOG_SUFFIX) else current_log_file_path
+        self.file_path_pattern = f"{glob.escape(prefix)}*.log"
+        self.file_index_per_inode: Dict[int, LogFileIndex] = {}
+        # oldest first
+        self.file_indexes: List[LogFileIndex] = []
+        self.is_up_to_date = False
+
+    def update(self, max_bytes: int | None = None) -> int:
+        # Returns the number of new lines indexed
+        new_line_count = 0
+        remaining_bytes = max_bytes
+        is_up_to_date = True
+        file_index_per_inode: Dict[int, LogFileIndex] = {}
+        mtime_per_inode: Dict[int, float] = {}
+        for file_path in glob.glob(self.file_path_pattern):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            file_index = self.file_index_per_inode.get(stat.st_ino, None)
+            if file_index is None or stat.st_size < file_index.indexed_offset:
+                # new, or truncated
+                file_index = LogFileIndex(file_path, stat.st_ino)
+            file_index.file_path = file_path
+            if remaining_bytes is None:
+                new_line_count += file_index.update(stat.st_size)
+            elif stat.st_size > file_index.indexed_offset:
+                if remaining_bytes == 0:
+                    # (waits for the next update)
+                    is_up_to_date = False
+                else:
+                    indexed_offset = file_index.indexed_offset
+                    new_line_count += file_index.update(stat.st_size, remaining_bytes)
+                    indexed_bytes = file_index.indexed_offset - indexed_offset
+                    # (a line still being written doesn't count, nothing more can be indexed until it's complete)
+                    if indexed_bytes and stat.st_size - indexed_offset > remaining_bytes:
+                        is_up_to_date = False
+                    remaining_bytes = max(remaining_bytes - indexed_bytes, 0)
+            file_index_per_inode[stat.st_ino] = file_index
+            mtime_per_inode[stat.st_ino] = stat.st_mtime
+        self.file_index_per_inode = file_index_per_inode
+        self.file_indexes = sorted(file_index_per_inode.values(),
+                                   key=lambda index: (index.file_path == self.current_log_file_path,
+                                                      mtime_per_inode[index.inode]))
+        self.is_up_to_date = is_up_to_date
+
+        return new_line_count
+
+    def search(self, criteria: Dict[str, str], max_hits: int | None = DEFAULT_MAX_HITS) -> List[LogSearchHit]:
+        # The (most recent max_hits) lines having all the tag=value of criteria, oldest first
+        keys = [f"{tag}={value}".encode() for tag, value in criteria.items()]
+        hits: List[LogSearchHit] = []
+        for file_index in reversed(self.file_indexes):
+            line_numbers = file_index.find_line_numbers(keys, None if max_hits is None else max_hits - len(hits))
+            hits[:0] = file_index.read_lines(line_numbers)
+            if max_hits is not None and len(hits) >= max_hits:
+                break
+
+        return hits
+
+    def line_count(self) -> int:
+        return sum(len(file_index.line_offsets) for file_index in self.file_indexes)
+
+    def memory_bytes(self) -> int:
+        return sum(file_index.memory_bytes() for file_index in self.file_indexes)
+
+
+def parse_search_query(query: str) -> Dict[str, str]:
+    # "37=456 35=D" -> {'37': '456', '35': 'D'}. A term without a tag is an order id
+    criteria: Dict[str, str] = {}
+    for term in query.split():
+        tag, sep, value = term.partition('=')
+        if sep:
+            if tag not in INDEXED_TAGS:
+                raise ValueError(f"Only tags {', '.join(INDEXED_TAGS)} are indexed, not:{tag}")
+            criteria[tag] = value
+        else:
+            criteria[DEFAULT_SEARCH_TAG] = term
+
+    return criteria
+
+
+def parse_args(args: List[str] | None = None):
+    ap = argparse.ArgumentParser(description="Search the messages of a quickfix message log (and its rotated logs)",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ap.add_argument('log_file', help="e.g. log/FIX.4.2-FIXSERVER-FIXCLIENT.messages.current.log")
+    ap.add_argument('query', nargs='+', help=f"tag=value terms, all of them must match (tags: "
+                                             f"{', '.join(INDEXED_TAGS)}). A bare value is an order id (37)")
+    ap.add_argument('--max_hits', type=int, default=DEFAULT_MAX_HITS, help="Only show the most recent ones")
+
+    return ap.parse_args(args)
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    search_criteria = parse_search_query(' '.join(cli_args.query))
+    log_index = LogIndex(cli_args.log_file)
+    start_time = time.perf_counter()
+    log_index.update()
+    index_secs = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    search_hits = log_index.search(search_criteria, cli_args.max_hits)
+    search_secs = time.perf_counter() - start_time
+    for hit in search_hits:
+        print(hit.line.replace(FIX_SEPARATOR, '|'))
+    print(f"{len(search_hits)} hit(s) in {search_secs * 1000:.1f}ms. Indexed {log_index.line_count()} line(s) of "
+          f"{len(log_index.file_indexes)} file(s) in {index_secs:.2f}s ({log_index.memory_bytes() / 1e6:.1f}MB)")
@@ -0,0 +1,158 @@
+import argparse
+import sys
+from typing import Dict, Iterator, List, Union
+
+import quickfix as fix
+
+from fix_log import iter_log_messages, parse_log_timestamp
+from scenario import Scenario, ActionLine, Action
+
+# A replay speed of 0 means as fast as possible (no sleep between the sends)
+REPLAY_SPEED_MAX = 0.0
+# Shorter pauses aren't worth a sleep step
+MIN_SLEEP_SECS = .001
+# The tags a replayed message from the server is expected to have
+WAIT_TAGS = [str(fix.MsgType().getField()), str(fix.SenderSubID().getField()), str(fix.OrderID().getField()),
+             str(fix.OrderQty().getField()), str(fix.OrdStatus().getField())]
+ADMIN_MSG_TYPES = {fix.MsgType_Heartbeat, fix.MsgType_TestRequest, fix.MsgType_ResendRequest, fix.MsgType_Reject,
+                   fix.MsgType_SequenceReset, fix.MsgType_Logout, fix.MsgType_Logon}
+# Remember that many ClOrdIDs of accepted reserve requests (to find the OMS order id of the execution reports)
+MAX_TRACKED_CLORDIDS = 100000
+
+
+class LogConverter:
+    # Turns the application messages of a quickfix message log into scenario action lines. The messages sent by
+    # the client are replayed (request_ioi, reserve, ack, fill, dfd) and the ones sent by the server are waited for.
+    # Sleep steps keep the original pacing of the sends, accelerated by `speed`. The server is expected to start
+    # with the same order book as when the log was captured, and to see the same oms_orders.csv changes if there
+    # were any (they aren't in the FIX log).
+    def __init__(self, client_comp_id: str, speed: float = 1.0, with_waits: bool = True):
+        self.client_comp_id = client_comp_id
+        self.speed = speed
+        self.with_waits = with_waits
+        self.oms_order_id_per_clordid: Dict[str, str] = {}
+
+    def iter_action_lines(self, log_file_path: str) -> Iterator[ActionLine]:
+        first_sent_at = None
+        line_number = 0
+        for _, timestamp, fields in iter_log_messages(log_file_path):
+            line_number += 1
+            msg_type = fields.get('35', None)
+            if msg_type is None or msg_type in ADMIN_MSG_TYPES:
+                continue
+            if fields.get('49', None) != self.client_comp_id:
+                if msg_type == fix.MsgType_NewOrderSingle and fields.get('39', None) == fix.OrdStatus_NEW:
+                    self.track_accepted_reserve(fields)
+                if self.with_waits:
+                    yield ActionLine(Action.WAIT.value, {tag: fields[tag] for tag in WAIT_TAGS if tag in fields},
+                                     line_number, None)
+                continue
+
+            action_line = self.convert_sent_message(fields, line_number)
+            if action_line is None:
+                continue
+            if self.speed != REPLAY_SPEED_MAX and timestamp:
+                sent_at = parse_log_timestamp(timestamp)
+                if first_sent_at is None:
+                    first_sent_at = sent_at
+                until_secs = (sent_at - first_sent_at) / self.speed
+                if until_secs >= MIN_SLEEP_SECS:
+                    yield ActionLine(Action.SLEEP.value, {'until': f"{until_secs:.3f}"}, line_number, None)
+            yield action_line
+
+    def track_accepted_reserve(self, fields: Dict[str, str]) -> None:
+        if len(self.oms_order_id_per_clordid) >= MAX_TRACKED_CLORDIDS:
+            # forget the oldest one
+            del self.oms_order_id_per_clordid[next(iter(self.oms_order_id_per_clordid))]
+        self.oms_order_id_per_clordid[fields.get('11', '')] = fields.get('37', '')
+
+    def get_oms_order_id(self, fields: Dict[str, str]) -> str:
+        oms_order_id = self.oms_order_id_per_clordid.get(fields.get('11', ''), None)
+        if oms_order_id is None:
+            # 37=<oms order id>-caprona
+            oms_order_id = fields.get('37', '').split('-')[0]
+        return oms_order_id
+
+    def convert_sent_message(self, fields: Dict[str, str], line_number: int) -> Union[ActionLine, None]:
+        msg_type = fields['35']
+        uuid = fields.get('50', '')
+        if msg_type == fix.MsgType_IOI:
+            return ActionLine(Action.REQUEST_IOI.value, {'50': uuid}, line_number, None)
+        elif msg_type == fix.MsgType_NewOrderSingle:
+            return ActionLine(Action.RESERVE.value, {'50': uuid, '37': fields.get('37', ''), '38': fields.get('38', '')},
+                              line_number, None)
+        elif msg_type == fix.MsgType_ExecutionReport:
+            key_values = {'50': uuid, '37': self.get_oms_order_id(fields)}
+            ord_status = fields.get('39', None)
+            if ord_status == fix.OrdStatus_NEW:
+                return ActionLine(Action.ACK.value, dict(key_values, **{'38': fields.get('38', '')}), line_number, None)
+            elif ord_status in (fix.OrdStatus_PARTIALLY_FILLED, fix.OrdStatus_FILLED):
+                return ActionLine(Action.FILL.value, dict(key_values, **{'38': fields.get('32', '')}), line_number,
+                                  None)
+            elif ord_status == fix.OrdStatus_DONE_FOR_DAY:
+                return ActionLine(Action.DFD.value, dict(key_values, **{'38': fields.get('38', '')}), line_number,
+                                  None)
+
+        print(f"WARNING: can't replay the message at line:{line_number} (35={msg_type}), skipping it")
+        return None
+
+
+class LogScenario(Scenario):
+    # A scenario streamed out of a message log instead of being compiled from a scenario file
+    def __init__(self, log_file_path: str, converter: LogConverter, namespace_offset: int = 0,
+                 namespace_size: int | None = None):
+        self.scenario_file_path = log_file_path
+        self.namespace_offset = namespace_offset
+        self.namespace_size = namespace_size
+        self.converter = converter
+        self.action_line_iterator = self.iter_action_lines()
+        self.current_action_line = next(self.action_line_iterator, None)
+        if self.current_action_line is None:
+            print(f"ERROR: the message log:{log_file_path} doesn't have any message to replay. Exiting.")
+            exit(1)
+
+    def iter_action_lines(self) -> Iterator[ActionLine]:
+        for action_line in self.converter.iter_action_lines(self.scenario_file_path):
+            yield self.apply_namespace_offset(action_line) if self.namespace_offset or self.namespace_size \
+                else action_line
+
+
+def write_scenario(log_file_path: str, converter: LogConverter, output_file_path: str | None = None) -> int:
+    line_count = 0
+    fp = open(output_file_path, 'w') if output_file_path else sys.stdout
+    try:
+        fp.write(f"# Converted from:{log_file_path} (client:{converter.client_comp_id} speed:{converter.speed:g})\n")
+        for action_line in converter.iter_action_lines(log_file_path):
+            fp.write(action_line.to_scenario_line() + '\n')
+            line_count += 1
+    finally:
+        if output_file_path:
+            fp.close()
+
+    return line_count
+
+
+def add_replay_speed_argument(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument('--replay_speed', type=float, default=1.0,
+                    help="1 = original timing, N = N times faster, 0 = as fast as possible")
+
+
+def parse_args(args: List[str] | None = None):
+    ap = argparse.ArgumentParser(description="Convert a quickfix message log into a scenario file",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ap.add_argument('log_file', help="e.g. log/FIX.4.2-FIXSERVER-FIXCLIENT.messages.current.log")
+    ap.add_argument('-o', '--output', type=str, help="Scenario file to write (stdout if not set)")
+    ap.add_argument('--client_comp_id', type=str, default='FIXCLIENT',
+                    help="SenderCompID of the messages to replay, the other ones are waited for")
+    ap.add_argument('--no_waits', action='store_true', help="Only replay the sends (no wait step)")
+    add_replay_speed_argument(ap)
+
+    return ap.parse_args(args)
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    count = write_scenario(cli_args.log_file,
+                           LogConverter(cli_args.client_comp_id, cli_args.replay_speed, not cli_args.no_waits),
+                           cli_args.output)
+    print(f"Wrote {count} action line(s)", file=sys.stderr)
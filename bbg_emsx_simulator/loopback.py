@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import contextlib
+import difflib
+import os
+import selectors
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Iterator, Tuple
+
+import quickfix as fix
+
+from client_application import ClientApplication
+from fix_application import FIXApplication, set_logging_enabled, log
+from fix_server import ORDER_CHANGES_CHECK_INTERVAL_SECS
+from order_store import OrderStore
+from scenario_runner import ScenarioRunner, create_scenarios
+from server_application import ServerApplication
+
+SERVER_COMP_ID = 'FIXSERVER'
+CLIENT_COMP_ID = 'FIXCLIENT'
+SERVER_TO_CLIENT = 'S>C'
+CLIENT_TO_SERVER = 'C>S'
+# Tags left out of the recorded flow, their values change from one run to the next
+VOLATILE_TAGS = {str(tag) for tag in [fix.BodyLength().getField(), fix.CheckSum().getField(),
+                                      fix.SendingTime().getField(), fix.TransactTime().getField(),
+                                      fix.ExpireTime().getField()]}
+# The generated ClOrdIDs/ExecIDs start with the time the app was started, they're recorded as ID<counter>
+GENERATED_ID_PREFIX = 'ID'
+# FIXApplication's state is class level: the client and the server each need their own copy in a single process
+FIX_APPLICATION_STATE_NAMES = ['latest_clordid_per_oms_order_id', 'latest_fix_message_per_oms_order_id',
+                               'current_clordid']
+
+
+class VirtualClockSelector(selectors.DefaultSelector):
+    # Never blocks while a timer is pending: the loop's clock jumps to the timer instead
+    def __init__(self):
+        super().__init__()
+        self.loop: 'VirtualClockEventLoop | None' = None
+
+    def select(self, timeout: float | None = None):
+        if timeout is None:
+            # nothing scheduled, only another thread can wake the loop up
+            return super().select(None)
+        events = super().select(0)
+        if not events and timeout > 0:
+            self.loop.virtual_time += timeout
+        return events
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    # asyncio.sleep(), wait_for() timeouts and call_later() complete as soon as there's nothing else to run
+    def __init__(self):
+        selector = VirtualClockSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.virtual_time = 0.0
+
+    def time(self) -> float:
+        return self.virtual_time
+
+
+class LoopbackTransport:
+    # Stands in for the quickfix sessions and sockets between a ServerApplication and a ClientApplication in the
+    # same process: a sent message gets its header (comp ids, seq num, sending time), goes through the sender's
+    # toApp and a FIX string round trip, and is handed to the receiver's fromApp. The server processes what it
+    # receives right away, with its own copy of the FIXApplication state. The application messages are recorded,
+    # without their volatile tags, for the golden file comparisons.
+    def __init__(self):
+        self.server_session_id = fix.SessionID(fix.BeginString_FIX42, SERVER_COMP_ID, CLIENT_COMP_ID)
+        self.client_session_id = fix.SessionID(fix.BeginString_FIX42, CLIENT_COMP_ID, SERVER_COMP_ID)
+        self.next_seq_num_per_direction: Dict[str, int] = {SERVER_TO_CLIENT: 1, CLIENT_TO_SERVER: 1}
+        self.server: ServerApplication | None = None
+        self.client: ClientApplication | None = None
+        # The client's state is the one in place, the server's is swapped in while the server runs
+        self.server_state: Dict[str, Any] = {'latest_clordid_per_oms_order_id': {},
+                                             'latest_fix_message_per_oms_order_id': {}, 'current_clordid': 0}
+        self.is_server_side = False
+        self.flow: List[str] = []
+
+    def connect(self, server: ServerApplication, client: ClientApplication) -> None:
+        self.server = server
+        self.client = client
+        with self.server_side():
+            server.onCreate(self.server_session_id)
+            server.onLogon(self.server_session_id)
+        client.onCreate(self.client_session_id)
+        client.onLogon(self.client_session_id)
+
+    def disconnect(self) -> None:
+        self.client.onLogout(self.client_session_id)
+        with self.server_side():
+            self.server.onLogout(self.server_session_id)
+
+    @contextlib.contextmanager
+    def server_side(self) -> Iterator[None]:
+        if self.is_server_side:
+            yield
+            return
+        client_state = {name: getattr(FIXApplication, name) for name in FIX_APPLICATION_STATE_NAMES}
+        for name, value in self.server_state.items():
+            setattr(FIXApplication, name, value)
+        self.is_server_side = True
+        try:
+            yield
+        finally:
+            self.is_server_side = False
+            self.server_state = {name: getattr(FIXApplication, name) for name in FIX_APPLICATION_STATE_NAMES}
+            for name, value in client_state.items():
+                setattr(FIXApplication, name, value)
+
+    def send_to_client(self, message: fix.Message, _: Any = None) -> bool:
+        received_message = self.transmit(message, SERVER_TO_CLIENT, self.server, self.server_session_id)
+        self.client.fromApp(received_message, self.client_session_id)
+        return True
+
+    def send_to_server(self, message: fix.Message, _: Any = None) -> bool:
+        received_message = self.transmit(message, CLIENT_TO_SERVER, self.client, self.client_session_id)
+        with self.server_side():
+            self.server.fromApp(received_message, self.server_session_id)
+        return True
+
+    def transmit(self, message: fix.Message, direction: str, sender: fix.Application,
+                 sender_session_id: fix.SessionID) -> fix.Message:
+        header = message.getHeader()
+        header.setField(fix.SenderCompID(sender_session_id.getSenderCompID().getValue()))
+        header.setField(fix.TargetCompID(sender_session_id.getTargetCompID().getValue()))
+        header.setField(fix.MsgSeqNum(self.next_seq_num_per_direction[direction]))
+        header.setField(fix.SendingTime())
+        self.next_seq_num_per_direction[direction] += 1
+        sender.toApp(message, sender_session_id)
+        fix_string = message.toString()
+        self.flow.append(f"{direction} {normalize_fix_string(fix_string)}")
+
+        return fix.Message(fix_string, False)
+
+    async def check_for_order_changes(self) -> None:
+        while True:
+            with self.server_side():
+                self.server.check_for_order_changes()
+            await asyncio.sleep(ORDER_CHANGES_CHECK_INTERVAL_SECS)
+
+
+def normalize_fix_string(fix_string: str) -> str:
+    tag_values = []
+    for tag_value in fix_string.split('\x01'):
+        tag, _, value = tag_value.partition('=')
+        if tag and tag not in VOLATILE_TAGS:
+            tag_values.append(f"{tag}={value.replace(FIXApplication.base_clordid, GENERATED_ID_PREFIX)}")
+
+    return '|'.join(tag_values)
+
+
+async def run_scenarios(transport: LoopbackTransport, scenario_file_paths: List[str]) -> bool:
+    client = transport.client
+    client.attach_loop()
+    order_changes_task = asyncio.ensure_future(transport.check_for_order_changes())
+    try:
+        runner = ScenarioRunner(client, create_scenarios(scenario_file_paths))
+        runner.is_exit_on_end = False
+        return await runner.run()
+    finally:
+        order_changes_task.cancel()
+        client.loop_bridge.detach_loop()
+
+
+def run_loopback(scenario_file_paths: List[str], orders_file_path: str,
+                 work_dir: str | None = None) -> Tuple[bool, List[str]]:
+    # Runs the scenarios against an in-process server, in a work directory (a temporary one by default) seeded
+    # with the orders file. Returns whether they all passed and the message flow
+    scenario_file_paths = [os.path.abspath(file_path) for file_path in scenario_file_paths]
+    orders_file_path = os.path.abspath(orders_file_path)
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() if work_dir is None else contextlib.nullcontext(work_dir) as run_dir:
+        os.makedirs(run_dir, exist_ok=True)
+        shutil.copyfile(orders_file_path, os.path.join(run_dir, OrderStore.ORDERS_FILE_PATH))
+        os.chdir(run_dir)
+        client_state = {name: getattr(FIXApplication, name) for name in FIX_APPLICATION_STATE_NAMES}
+        try:
+            # Start from a clean slate, as 2 freshly started processes would
+            FIXApplication.latest_clordid_per_oms_order_id = {}
+            FIXApplication.latest_fix_message_per_oms_order_id = {}
+            FIXApplication.current_clordid = 0
+            ServerApplication.uuids_of_interest = set()
+            ServerApplication.oms_order_id_per_accepted_reserve_clordid = dict()
+
+            transport = LoopbackTransport()
+            with transport.server_side():
+                server = ServerApplication(send_function=transport.send_to_client)
+            client = ClientApplication(send_function=transport.send_to_server)
+            transport.connect(server, client)
+            loop = VirtualClockEventLoop()
+            try:
+                is_passed = loop.run_until_complete(run_scenarios(transport, scenario_file_paths))
+            finally:
+                loop.close()
+            transport.disconnect()
+        finally:
+            for name, value in client_state.items():
+                setattr(FIXApplication, name, value)
+            os.chdir(previous_cwd)
+
+    return is_passed, transport.flow
+
+
+def compare_with_golden(flow: List[str], golden_file_path: str) -> bool:
+    with open(golden_file_path) as fp:
+        golden_flow = fp.read().splitlines()
+    if flow == golden_flow:
+        return True
+
+    sys.stdout.writelines(line + '\n' for line in
+                          difflib.unified_diff(golden_flow, flow, golden_file_path, 'this run', lineterm=''))
+    return False
+
+
+def parse_args(args: List[str] | None = None):
+    ap = argparse.ArgumentParser(description="Run scenarios against an in-process server, without sockets and "
+                                             "with a virtual clock",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ap.add_argument('-s', '--scenario_file', type=str, action='append', required=True,
+                    help="Scenario file path. Repeat it to run several scenarios concurrently")
+    ap.add_argument('--orders', type=str, default=OrderStore.ORDERS_FILE_PATH, help="Initial orders file")
+    ap.add_argument('--golden', type=str, help="Compare the message flow with this file")
+    ap.add_argument('--update_golden', action='store_true', help="(Re)write the --golden file with this flow")
+    ap.add_argument('--work_dir', type=str, help="Keep the orders files in this directory (temporary if not set)")
+    ap.add_argument('-v', '--verbose', action='store_true', help="Log the messages and the scenario steps")
+
+    return ap.parse_args(args)
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    set_logging_enabled(cli_args.verbose)
+    start_time = time.perf_counter()
+    passed, message_flow = run_loopback(cli_args.scenario_file, cli_args.orders, cli_args.work_dir)
+    set_logging_enabled(True)
+    log("LOOPBACK", f"{'PASSED' if passed else 'FAILED'}: {len(message_flow)} message(s) "
+                    f"in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+    if cli_args.golden:
+        if cli_args.update_golden:
+            with open(cli_args.golden, 'w') as fp:
+                fp.writelines(line + '\n' for line in message_flow)
+            log("LOOPBACK", f"Wrote {cli_args.golden}")
+        elif compare_with_golden(message_flow, cli_args.golden):
+            log("LOOPBACK", f"Same message flow as {cli_args.golden}")
+        else:
+            passed = False
+    exit(0 if passed else 1)
@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple, List, Iterable
+
+import quickfix as fix
+
+from fix_application import FIXMessage
+
+# Tags most WAIT steps match on, from the most to the least selective when several buckets have the same size
+INDEXED_TAGS: List[str] = [str(fix.ClOrdID().getField()), str(fix.OrderID().getField()),
+                           str(fix.SenderSubID().getField()), str(fix.MsgType().getField())]
+
+
+class MessageInbox:
+    # Received messages waiting to be matched by a scenario, indexed by the values of the INDEXED_TAGS so that a
+    # match only looks at the messages that share the most selective of those values. Unmatched messages are
+    # dropped once there are more than max_messages or once they're older than max_age_secs (0 = no limit).
+    DEFAULT_MAX_MESSAGES = 10000
+    DEFAULT_MAX_AGE_SECS = 300.0
+
+    def __init__(self, max_messages: int = DEFAULT_MAX_MESSAGES, max_age_secs: float = DEFAULT_MAX_AGE_SECS):
+        self.max_messages = max_messages
+        self.max_age_secs = max_age_secs
+        # arrival sequence number -> (time received in perf_counter_ns, message), oldest first
+        self.entries: OrderedDict[int, Tuple[int, FIXMessage]] = OrderedDict()
+        # (tag, value) -> arrival sequence numbers of the messages with that value, oldest first
+        self.seqs_per_tag_value: Dict[Tuple[str, str], Dict[int, None]] = {}
+        self.next_seq = 0
+        self.evicted_count = 0
+        self.expired_count = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, message: FIXMessage, received_ns: int | None = None) -> None:
+        received_ns = time.perf_counter_ns() if received_ns is None else received_ns
+        seq = self.next_seq
+        self.next_seq += 1
+        self.entries[seq] = (received_ns, message)
+        for tag in INDEXED_TAGS:
+            value = message.message_dict.get(tag, None)
+            if value is not None:
+                self.seqs_per_tag_value.setdefault((tag, value), {})[seq] = None
+
+        if self.max_messages:
+            while len(self.entries) > self.max_messages:
+                self.remove(next(iter(self.entries)))
+                self.evicted_count += 1
+
+    def remove(self, seq: int) -> FIXMessage:
+        _, message = self.entries.pop(seq)
+        for tag in INDEXED_TAGS:
+            value = message.message_dict.get(tag, None)
+            if value is None:
+                continue
+            seqs = self.seqs_per_tag_value.get((tag, value), None)
+            if seqs is not None:
+                seqs.pop(seq, None)
+                if not seqs:
+                    del self.seqs_per_tag_value[(tag, value)]
+
+        return message
+
+    def expire(self, now_ns: int | None = None) -> int:
+        if not self.max_age_secs:
+            return 0
+        oldest_received_ns = (time.perf_counter_ns() if now_ns is None else now_ns) - int(self.max_age_secs * 1e9)
+        expired_count = 0
+        while self.entries:
+            seq, (received_ns, _) = next(iter(self.entries.items()))
+            if received_ns >= oldest_received_ns:
+                break
+            self.remove(seq)
+            expired_count += 1
+        self.expired_count += expired_count
+
+        return expired_count
+
+    def get_candidate_seqs(self, message_kvs: Dict[str, str]) -> Iterable[int]:
+        candidate_seqs = None
+        for tag in INDEXED_TAGS:
+            value = message_kvs.get(tag, None)
+            if value is None:
+                continue
+            seqs = self.seqs_per_tag_value.get((tag, value), None)
+            if not seqs:
+                # no message has this value, nothing can match
+                return []
+            if candidate_seqs is None or len(seqs) < len(candidate_seqs):
+                candidate_seqs = seqs
+
+        # no indexed tag to narrow the search, look at everything
+        return self.entries if candidate_seqs is None else candidate_seqs
+
+    def pop_match(self, message_kvs: Dict[str, str]) -> Tuple[FIXMessage, int] | None:
+        # Remove and return the oldest message containing all the message_kvs, with the time it was received
+        self.expire()
+        for seq in self.get_candidate_seqs(message_kvs):
+            received_ns, message = self.entries[seq]
+            if all(message.message_dict.get(tag, None) == value for tag, value in message_kvs.items()):
+                self.remove(seq)
+                return message, received_ns
+
+        return None
@@ -1,12 +1,57 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from typing import Dict, Any, List
+
+SIDES = {'Buy': 1, 'Sell': 2, 'Short': 5}
+
 
 @dataclass
 class Order:
     is_active: bool
     order_id: int
-    uuid: str
+    uuid: int
     symbol: str
     side: str
     shares: int
     price: float
 
+    # the columns in the order they appear in the oms_orders.csv file
+    CSV_COLUMNS = ['order_id', 'is_active', 'uuid', 'symbol', 'side', 'shares', 'price']
+
+    def __getitem__(self, column: str) -> Any:
+        # allows an Order to be used interchangeably with a pandas Series row
+        return getattr(self, column)
+
+    def __setitem__(self, column: str, value: Any) -> None:
+        setattr(self, column, value)
+
+    def __contains__(self, column: str) -> bool:
+        return column in Order.column_names()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {column: getattr(self, column) for column in Order.CSV_COLUMNS}
+
+    def to_csv_row(self) -> List[str]:
+        return [str(getattr(self, column)) for column in Order.CSV_COLUMNS]
+
+    @staticmethod
+    def column_names() -> List[str]:
+        return [f.name for f in fields(Order)]
+
+    @staticmethod
+    def from_dict(row: Dict[str, Any]) -> 'Order':
+        return Order(
+            is_active=str_to_bool(row['is_active']),
+            order_id=int(float(row['order_id'])),
+            uuid=int(float(row['uuid'])),
+            symbol=str(row['symbol']),
+            side=str(row['side']),
+            shares=int(float(row['shares'])),
+            price=float(row['price']),
+        )
+
+
+def str_to_bool(s: Any) -> bool:
+    if isinstance(s, str):
+        return s.lower() in ['true', '1', 'yes', 'y', 't']
+    else:
+        return bool(s)
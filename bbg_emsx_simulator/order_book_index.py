@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+from typing import Dict, Tuple, Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+DEFAULT_PAGE_SIZE = 50
+PAGE_SIZES = [25, 50, 100, 500]
+
+
+@dataclass
+class OrderQuery:
+    # None = no filter
+    uuid: int | None = None
+    symbol: str | None = None
+    is_active: bool | None = None
+    # None = the order of the orders file
+    sort_by: str | None = None
+    ascending: bool = True
+    # 0 based
+    page: int = 0
+    page_size: int = DEFAULT_PAGE_SIZE
+
+
+class OrderBookIndex:
+    # Row positions of an orders DataFrame per uuid and per symbol, the is_active mask and, built when first
+    # needed, the row order for each sort column. A query only goes through the positions of the rows it selects,
+    # and only the rows of the requested page are copied out of the DataFrame.
+    def __init__(self, orders_df: DataFrame):
+        self.orders_df = orders_df
+        self.positions_per_uuid: Dict[Any, np.ndarray] = OrderBookIndex.get_positions_per_value(orders_df['uuid'])
+        self.positions_per_symbol: Dict[Any, np.ndarray] = OrderBookIndex.get_positions_per_value(orders_df['symbol'])
+        self.is_active = orders_df['is_active'].to_numpy(dtype=bool)
+        self.sorted_positions_per_column: Dict[str, np.ndarray] = {}
+
+    @staticmethod
+    def get_positions_per_value(column: pd.Series) -> Dict[Any, np.ndarray]:
+        codes, values = pd.factorize(column)
+        positions = np.argsort(codes, kind='stable')
+        boundaries = np.searchsorted(codes[positions], np.arange(len(values) + 1))
+        return {value: positions[boundaries[i]:boundaries[i + 1]] for i, value in enumerate(values)}
+
+    def get_sorted_positions(self, column_name: str) -> np.ndarray:
+        sorted_positions = self.sorted_positions_per_column.get(column_name, None)
+        if sorted_positions is None:
+            column = self.orders_df[column_name]
+            if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+                keys = column.to_numpy()
+            else:
+                # (sorting the codes of the sorted unique values is a lot faster than sorting the strings)
+                keys, _ = pd.factorize(column, sort=True)
+            sorted_positions = self.sorted_positions_per_column[column_name] = np.argsort(keys, kind='stable')
+        return sorted_positions
+
+    def select_positions(self, query: OrderQuery) -> np.ndarray:
+        # The positions of the rows matching the filters, in the order of the orders DataFrame
+        positions = None
+        if query.uuid is not None:
+            positions = self.positions_per_uuid.get(query.uuid, np.empty(0, dtype=np.intp))
+        if query.symbol is not None:
+            symbol_positions = self.positions_per_symbol.get(query.symbol, np.empty(0, dtype=np.intp))
+            positions = symbol_positions if positions is None else \
+                np.intersect1d(positions, symbol_positions, assume_unique=True)
+        if positions is None:
+            positions = np.arange(len(self.orders_df)) if query.is_active is None else \
+                np.flatnonzero(self.is_active == query.is_active)
+        elif query.is_active is not None:
+            positions = positions[self.is_active[positions] == query.is_active]
+
+        return positions
+
+    def query(self, query: OrderQuery) -> Tuple[DataFrame, int]:
+        # The requested page (indexed by the positions of its rows in the orders DataFrame) and the number of rows
+        # matching the filters
+        positions = self.select_positions(query)
+        if query.sort_by:
+            is_selected = np.zeros(len(self.orders_df), dtype=bool)
+            is_selected[positions] = True
+            sorted_positions = self.get_sorted_positions(query.sort_by)
+            if not query.ascending:
+                sorted_positions = sorted_positions[::-1]
+            positions = sorted_positions[is_selected[sorted_positions]]
+        else:
+            positions = np.sort(positions)
+        start = query.page * query.page_size
+        page_positions = positions[start:start + query.page_size]
+        page_df = self.orders_df.iloc[page_positions]
+        page_df.index = page_positions
+
+        return page_df, len(positions)
+
+
+def get_page_count(row_count: int, page_size: int) -> int:
+    return max((row_count + page_size - 1) // page_size, 1)
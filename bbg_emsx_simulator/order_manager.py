@@ -2,17 +2,22 @@ import json
 import os
 import pickle
 from datetime import datetime
-from typing import Dict, List, Union, Tuple
+from typing import Dict, List, Union, Tuple, Any
 
 import pandas as pd
 from numpy import int64
 import numpy as np
 from pandas import DataFrame, Series
 
+from control_api import ControlAPIClient, ControlAPIError
+from models import SIDES
+from order_book_index import OrderBookIndex, OrderQuery
+from order_store import OrderStore
+
 
 class OrderManager:
-    ORDERS_FILE_PATH = 'oms_orders.csv'
-    ORDER_CHANGES_FILE_PATH = 'oms_order_changes.json'
+    ORDERS_FILE_PATH = OrderStore.ORDERS_FILE_PATH
+    ORDER_CHANGES_FILE_PATH = OrderStore.ORDER_CHANGES_FILE_PATH
     ORDER_CHANGES_TMP_FILE_PATH = 'oms_order_changes.json.tmp'
     COLUMN_DTYPE_PER_NAME = {
         'order_id': 'Int64',
@@ -23,11 +28,15 @@ class OrderManager:
         'shares': 'Int64',
         'price': 'Float32',
     }
-    SIDES = {'Buy': 1, 'Sell': 2, 'Short': 5}
+    SIDES = SIDES
 
     def __init__(self):
         self.orders_df = None
-        self.last_order_changes_timestamp = datetime.now()
+        self.last_order_changes_seq = 0
+        # When set, the order changes go straight to the server instead of through the instructions file
+        self.control_api_client: ControlAPIClient | None = None
+        # Built for the current orders_df when first queried
+        self.order_book_index: OrderBookIndex | None = None
         self.read_orders_from_file()
 
     def read_orders_from_file(self) -> DataFrame:
@@ -40,6 +49,32 @@ class OrderManager:
     def save_orders(self):
         self.orders_df.to_csv(OrderManager.ORDERS_FILE_PATH, index=False)
 
+    def query_orders(self, query: OrderQuery) -> Tuple[DataFrame, int]:
+        # A page of the orders and the number of orders matching the filters, see OrderBookIndex
+        if self.order_book_index is None or self.order_book_index.orders_df is not self.orders_df:
+            self.order_book_index = OrderBookIndex(self.orders_df)
+        return self.order_book_index.query(query)
+
+    def save_page_changes(self, page_df: DataFrame, edited_page_df: DataFrame,
+                          page_changes: Dict[str, Any]) -> int:
+        # The changes made to a page of the orders (streamlit's data_editor changes, with row numbers within the page)
+        # are merged into the orders, which are saved, and then sent with the row numbers of the orders file
+        page_positions = page_df.index.to_numpy()
+        orders_df = self.orders_df.copy()
+        edited_rows_df = edited_page_df.iloc[:len(page_positions)]
+        for column in orders_df.columns:
+            orders_df.loc[page_positions, column] = edited_rows_df[column].to_numpy()
+        added_rows_df = edited_page_df.iloc[len(page_positions):]
+        if len(added_rows_df):
+            orders_df = pd.concat([orders_df, added_rows_df], ignore_index=True)
+        self.orders_df = orders_df
+        self.save_orders()
+
+        order_changes = dict(page_changes)
+        order_changes['edited_rows'] = {int(page_positions[int(row_number)]): changes
+                                        for row_number, changes in page_changes.get('edited_rows', {}).items()}
+        return self.save_order_change_instructions(order_changes)
+
     def get_row_index_for_order_id(self, order_id: str) -> Union[int,None]:
         self.read_orders_from_file()
         try:
@@ -89,11 +124,35 @@ class OrderManager:
 
         return orders
 
-    def save_order_change_instructions(self, order_changes: Dict[str, Dict[str, str]]):
+    def save_order_change_instructions(self, order_changes: Dict[str, Dict[str, str]]) -> int:
+        # The seq is acknowledged by the server once it has applied the changes (see OrderStore)
+        seq = OrderStore.get_next_order_changes_seq()
+        order_changes = dict(order_changes)
+        order_changes[OrderStore.ORDER_CHANGES_SEQ_KEY] = seq
+        if self.control_api_client:
+            try:
+                # (acknowledged once the response is back)
+                self.control_api_client.submit_order_changes(order_changes)
+                self.last_order_changes_seq = seq
+                return seq
+            except ControlAPIError as e:
+                print(f"ERROR: the server rejected the order changes with seq:{seq}:{e}")
+                return seq
+            except OSError as e:
+                print(f"ERROR: the control API is down, using the instructions file from now on:{e}")
+                self.control_api_client = None
         with open(OrderManager.ORDER_CHANGES_TMP_FILE_PATH, "w") as fp:
             json.dump(order_changes, fp, indent=4)
 
         os.rename(OrderManager.ORDER_CHANGES_TMP_FILE_PATH, OrderManager.ORDER_CHANGES_FILE_PATH)
+        self.last_order_changes_seq = seq
+
+        return seq
+
+    @staticmethod
+    def get_file_signature() -> Tuple[int, int] | None:
+        # Changes within the same second as the previous one are missed by the timestamp
+        return OrderStore.get_file_signature(OrderManager.ORDERS_FILE_PATH)
 
     def get_file_timestamp(self) -> str:
         last_modification_time = os.path.getmtime(OrderManager.ORDERS_FILE_PATH)
@@ -102,83 +161,6 @@ class OrderManager:
 
         return formatted_time
 
-    def check_and_process_order_change_instructions(self):
-        if os.path.exists(OrderManager.ORDER_CHANGES_FILE_PATH):
-            file_mod_time = os.path.getmtime(OrderManager.ORDER_CHANGES_FILE_PATH)
-            file_mod_datetime = datetime.fromtimestamp(file_mod_time)
-
-            if file_mod_datetime > self.last_order_changes_timestamp:
-                print("Detected order changes...")
-                self.last_order_changes_timestamp = file_mod_datetime
-                with open(OrderManager.ORDER_CHANGES_FILE_PATH, "r") as fp:
-                    order_changes = json.load(fp)
-                    self.process_order_changes(order_changes)
-
-    def process_order_changes(self, order_changes: Dict[str, Dict[str, str]]):
-        # the passed changes are tightly bound with streamlit's st.session_state after changing data in the data_editor
-        # Example:
-        # {
-        #   "edited_rows": {
-        #     "1": {
-        #       "is_active": false
-        #     },
-        #     "2": {
-        #       "symbol": "AAA"
-        #     }
-        #   },
-        #   "added_rows": [
-        #     {
-        #       "order_id": "111",
-        #       "is_active": true,
-        #       "uuid": 888,
-        #       "symbol": "DDDD",
-        #       "side": "Buy",
-        #       "shares": 1999,
-        #       "price": 99.99
-        #     }
-        #   ],
-        #   "deleted_rows": [
-        #     5
-        #   ]
-        # }
-
-        # It assumes that the changes have already been made and are already on the order file
-        order_df = self.read_orders_from_file()
-
-        edited_rows = order_changes.get("edited_rows", {})
-        for index, changes in edited_rows.items():
-            order_row = order_df.iloc[int(index)]
-            self.process_edited_added_row(order_row, changes, True)
-
-        added_rows = order_changes.get("added_rows", [])
-        for added_row in added_rows:
-            order_id = added_row['order_id']
-            order_rows_for_order_id = order_df[order_df['order_id'] == order_id]
-            if len(order_rows_for_order_id) >= 1:
-                order_row = order_rows_for_order_id.iloc[0]
-                self.process_edited_added_row(order_row, added_row, False)
-            else:
-                print(f"Can't find added row with order_id:{order_id}")
-
-    def process_edited_added_row(self, order_row: Series, changes: Dict[str, str], is_edited: bool):
-        # import here to avoid circular import dependencies
-        from server_application import ServerApplication, MessageAction
-
-        # TODO: be smart about handling change in UUID since the order with the old UUID s/b canceled first
-        uuid = order_row['uuid']
-        if ServerApplication.is_uuid_of_interest(uuid):
-            if is_edited:
-                if 'is_active' in changes:
-                    message_action = MessageAction.NewOrder if changes['is_active'] else MessageAction.CancelOrder
-                else:
-                    message_action = MessageAction.ChangeOrder
-            else:
-                message_action = MessageAction.NewOrder
-
-            ServerApplication.create_order_message(message_action, order_row, True)
-        else:
-            print(f"Changes requested for uuid:{uuid} but no interest there")
-
     def is_existing_order(self, saved_df: DataFrame, order_id: str) -> Tuple[bool, Union[int, None]]:
         matching_row_indeces = saved_df.index[saved_df['order_id'] == int(order_id)].tolist()
         if len(matching_row_indeces):
@@ -198,19 +180,20 @@ class OrderManager:
             row_diff = saved_df_row.compare(row, keep_equal=False)
             if len(row_diff):
                 # print(f"Row change #{row_index}:\n{row_diff}")
-                self.create_edited_added_row_instructions(dict({row_index: row_diff['other'].to_dict()}), False)
                 self.orders_df.loc[row_index] = row
+                self.save_orders()
+                self.create_edited_added_row_instructions(dict({row_index: row_diff['other'].to_dict()}), False)
                 outcome = f"Row:#{row_index} (order_id:{order_id}) has been modified."
             else:
                 outcome = f"Row:#{row_index} (order_id:{order_id}) hasn't changed. Nothing to do."
         else:
             # print(f"New row (#{row_index}):\n{row}")
-            self.create_edited_added_row_instructions(row.to_dict(), True)
             self.orders_df.loc[len(self.orders_df)] = row
+            self.save_orders()
+            # (the server reads the orders file when it gets the instructions, which can be right away)
+            self.create_edited_added_row_instructions(row.to_dict(), True)
             outcome = f"Row:#{row_index} (order_id:{order_id}) has been added."
 
-        self.save_orders()
-
         return outcome
 
     def populate_missing_values(self, master_row: Series, new_row: Series) -> Series:
@@ -235,6 +218,34 @@ class OrderManager:
 
         self.save_order_change_instructions(instructions)
 
+    @staticmethod
+    def diff_orders_dfs(displayed_df: DataFrame,
+                        new_df: DataFrame) -> Tuple[Dict[str, List[Tuple[Any, Any]]], DataFrame] | None:
+        # The changes turning displayed_df into new_df: {column: [(index, new value), ...]} for the changed cells
+        # and the rows appended at the end. None if it's not that simple (removed/reordered rows or columns)
+        displayed_row_count = len(displayed_df)
+        if list(displayed_df.columns) != list(new_df.columns) or len(new_df) < displayed_row_count or \
+                not displayed_df.index.equals(new_df.index[:displayed_row_count]) or \
+                not displayed_df['order_id'].equals(new_df['order_id'].iloc[:displayed_row_count]):
+            return None
+
+        changed_cells_per_column: Dict[str, List[Tuple[Any, Any]]] = {}
+        for column in displayed_df.columns:
+            displayed_column = displayed_df[column]
+            new_column = new_df[column].iloc[:displayed_row_count]
+            if pd.api.types.is_numeric_dtype(displayed_column):
+                is_changed = displayed_column.ne(new_column.values).to_numpy(dtype=bool, na_value=True)
+            else:
+                # (about twice as fast as the string dtype's own comparison)
+                is_changed = displayed_column.to_numpy(dtype=object) != new_column.to_numpy(dtype=object)
+            # (NaN != NaN)
+            is_changed = is_changed & ~(displayed_column.isna().to_numpy() & new_column.isna().to_numpy())
+            if is_changed.any():
+                changed_values = new_df[column].iloc[:displayed_row_count][is_changed]
+                changed_cells_per_column[column] = list(zip(changed_values.index.tolist(), changed_values.tolist()))
+
+        return changed_cells_per_column, new_df.iloc[displayed_row_count:].copy()
+
     def create_orders_df_copy(self) -> DataFrame:
         orders_df_copy = pickle.loads(pickle.dumps(self.orders_df))
 
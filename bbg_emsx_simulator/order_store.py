@@ -0,0 +1,263 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Union, Tuple, Any, Callable
+
+from models import Order
+
+
+class OrderStore:
+    # Lightweight, pure Python, view of the oms_orders.csv file used by the FIX server.
+    # pandas is only loaded when a DataFrame is explicitly requested (UI/bulk operations)
+    ORDERS_FILE_PATH = 'oms_orders.csv'
+    ORDERS_TMP_FILE_PATH = 'oms_orders.csv.tmp'
+    ORDER_CHANGES_FILE_PATH = 'oms_order_changes.json'
+    # Written by the server once it has applied the instructions with a given seq
+    ORDER_CHANGES_ACK_FILE_PATH = 'oms_order_changes.ack.json'
+    ORDER_CHANGES_ACK_TMP_FILE_PATH = 'oms_order_changes.ack.json.tmp'
+    ORDER_CHANGES_SEQ_KEY = 'seq'
+    APPLIED_SEQ_KEY = 'applied_seq'
+
+    def __init__(self):
+        self.orders: List[Order] = []
+        self.order_per_order_id: Dict[str, Order] = {}
+        self.order_ids_per_uuid: Dict[str, List[str]] = {}
+        self.file_signature: Tuple[int, int] | None = None
+        self.last_order_changes_timestamp = datetime.now()
+        self.applied_order_changes_seq = OrderStore.read_applied_order_changes_seq()
+        # listener(order_ids) is called once the server has changed these orders (fills, applied order changes)
+        self.order_change_listeners: List[Callable[[List[str]], None]] = []
+        # (a ServerMetrics, for the apply latency of the order changes)
+        self.metrics = None
+        self.read_orders_from_file()
+
+    @staticmethod
+    def get_file_signature(file_path: str) -> Tuple[int, int] | None:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def read_orders_from_file(self) -> List[Order]:
+        self.file_signature = OrderStore.get_file_signature(OrderStore.ORDERS_FILE_PATH)
+        with open(OrderStore.ORDERS_FILE_PATH, newline='') as fp:
+            self.set_orders([Order.from_dict(row) for row in csv.DictReader(fp)])
+
+        return self.orders
+
+    def read_orders_from_file_if_changed(self) -> bool:
+        # The UIs update the file behind our back, only re-read it when it has actually changed
+        if OrderStore.get_file_signature(OrderStore.ORDERS_FILE_PATH) != self.file_signature:
+            self.read_orders_from_file()
+            return True
+        else:
+            return False
+
+    def set_orders(self, orders: List[Order]) -> None:
+        self.orders = orders
+        self.order_per_order_id = {}
+        self.order_ids_per_uuid = {}
+        for order in orders:
+            order_id = str(order.order_id)
+            self.order_per_order_id[order_id] = order
+            self.order_ids_per_uuid.setdefault(str(order.uuid), []).append(order_id)
+
+    def save_orders(self) -> None:
+        with open(OrderStore.ORDERS_TMP_FILE_PATH, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(Order.CSV_COLUMNS)
+            writer.writerows(order.to_csv_row() for order in self.orders)
+
+        os.replace(OrderStore.ORDERS_TMP_FILE_PATH, OrderStore.ORDERS_FILE_PATH)
+        self.file_signature = OrderStore.get_file_signature(OrderStore.ORDERS_FILE_PATH)
+
+    def get_order(self, order_id: str) -> Union[Order, None]:
+        self.read_orders_from_file_if_changed()
+        order = self.order_per_order_id.get(str(order_id), None)
+        if order is None:
+            print(f"ERROR: can't find order with order_id:{order_id}")
+
+        return order
+
+    def get_order_shares(self, order_id: str) -> Union[int, None]:
+        order = self.get_order(order_id)
+        if order is not None:
+            return order.shares
+        else:
+            return None
+
+    def update_order_shares(self, order_id: str, new_shares_increment: int) -> Union[int, None]:
+        return self.update_orders_shares({order_id: new_shares_increment}).get(order_id, None)
+
+    def update_orders_shares(self, shares_increment_per_order_id: Dict[str, int]) -> Dict[str, int]:
+        # Apply all the increments and only then rewrite the file once
+        updated_shares_per_order_id: Dict[str, int] = {}
+        for order_id, new_shares_increment in shares_increment_per_order_id.items():
+            order = self.get_order(order_id)
+            if order is not None:
+                current_shares = order.shares
+                self.apply_shares_increment(order, new_shares_increment)
+                updated_shares_per_order_id[order_id] = order.shares
+                print(f"Updated order with order_id:{order_id} shares from {current_shares} to {order.shares}")
+
+        if updated_shares_per_order_id:
+            self.save_orders()
+            self.notify_order_change_listeners(list(updated_shares_per_order_id))
+
+        return updated_shares_per_order_id
+
+    def apply_shares_increment(self, order: Order, new_shares_increment: int) -> None:
+        order.shares += new_shares_increment
+        if order.shares == 0:
+            order.is_active = False
+            print(f"Updated order with order_id:{order.order_id} to be inactive")
+
+    def get_orders_for_uuid(self, uuid: str) -> List[Order]:
+        self.read_orders_from_file_if_changed()
+        orders: List[Order] = []
+        for order_id in self.order_ids_per_uuid.get(str(uuid), []):
+            order = self.order_per_order_id[order_id]
+            if order.is_active:
+                orders.append(order)
+
+        return orders
+
+    def to_dataframe(self):
+        # import here so that the server never pays the pandas import cost unless needed
+        import pandas as pd
+        from order_manager import OrderManager
+
+        orders_df = pd.DataFrame([order.to_dict() for order in self.orders], columns=Order.CSV_COLUMNS)
+        OrderManager.normalize_orders_col_types(orders_df)
+
+        return orders_df
+
+    def check_and_process_order_change_instructions(self):
+        if os.path.exists(OrderStore.ORDER_CHANGES_FILE_PATH):
+            file_mod_time = os.path.getmtime(OrderStore.ORDER_CHANGES_FILE_PATH)
+            file_mod_datetime = datetime.fromtimestamp(file_mod_time)
+
+            if file_mod_datetime > self.last_order_changes_timestamp:
+                print("Detected order changes...")
+                self.last_order_changes_timestamp = file_mod_datetime
+                with open(OrderStore.ORDER_CHANGES_FILE_PATH, "r") as fp:
+                    order_changes = json.load(fp)
+                self.apply_order_changes(order_changes, file_mod_time)
+
+    def apply_order_changes(self, order_changes: Dict[str, Any], requested_at: float | None = None) -> List[str]:
+        # From the instructions file or the control API. Returns the ids of the orders changed
+        order_ids = self.process_order_changes(order_changes)
+        if self.metrics and requested_at:
+            self.metrics.record_order_changes_applied(requested_at)
+        seq = order_changes.get(OrderStore.ORDER_CHANGES_SEQ_KEY, None)
+        if seq is not None:
+            if self.applied_order_changes_seq and seq > self.applied_order_changes_seq + 1:
+                print(f"ERROR: missed the order changes from seq:{self.applied_order_changes_seq + 1} "
+                      f"to seq:{seq - 1}, they were overwritten before being picked up")
+            self.applied_order_changes_seq = seq
+            OrderStore.save_order_changes_ack(seq)
+        self.notify_order_change_listeners(order_ids)
+
+        return order_ids
+
+    def notify_order_change_listeners(self, order_ids: List[str]) -> None:
+        if order_ids:
+            for listener in self.order_change_listeners:
+                listener(order_ids)
+
+    @staticmethod
+    def read_json_int(file_path: str, key: str) -> int:
+        try:
+            with open(file_path) as fp:
+                return int(json.load(fp).get(key, 0))
+        except (FileNotFoundError, ValueError, TypeError, AttributeError):
+            return 0
+
+    @staticmethod
+    def read_applied_order_changes_seq() -> int:
+        return OrderStore.read_json_int(OrderStore.ORDER_CHANGES_ACK_FILE_PATH, OrderStore.APPLIED_SEQ_KEY)
+
+    @staticmethod
+    def get_next_order_changes_seq() -> int:
+        # (the server may have been restarted with, or without, an older instructions file)
+        return max(OrderStore.read_json_int(OrderStore.ORDER_CHANGES_FILE_PATH, OrderStore.ORDER_CHANGES_SEQ_KEY),
+                   OrderStore.read_applied_order_changes_seq()) + 1
+
+    @staticmethod
+    def save_order_changes_ack(seq: int) -> None:
+        with open(OrderStore.ORDER_CHANGES_ACK_TMP_FILE_PATH, 'w') as fp:
+            json.dump({OrderStore.APPLIED_SEQ_KEY: seq, 'applied_at': time.time()}, fp)
+
+        os.replace(OrderStore.ORDER_CHANGES_ACK_TMP_FILE_PATH, OrderStore.ORDER_CHANGES_ACK_FILE_PATH)
+
+    def process_order_changes(self, order_changes: Dict[str, Any]) -> List[str]:
+        # the passed changes are tightly bound with streamlit's st.session_state after changing data in the data_editor
+        # Example:
+        # {
+        #   "edited_rows": {
+        #     "1": {
+        #       "is_active": false
+        #     },
+        #     "2": {
+        #       "symbol": "AAA"
+        #     }
+        #   },
+        #   "added_rows": [
+        #     {
+        #       "order_id": "111",
+        #       "is_active": true,
+        #       "uuid": 888,
+        #       "symbol": "DDDD",
+        #       "side": "Buy",
+        #       "shares": 1999,
+        #       "price": 99.99
+        #     }
+        #   ],
+        #   "deleted_rows": [
+        #     5
+        #   ]
+        # }
+
+        # It assumes that the changes have already been made and are already on the order file
+        orders = self.read_orders_from_file()
+        order_ids: List[str] = []
+
+        edited_rows = order_changes.get("edited_rows", {})
+        for index, changes in edited_rows.items():
+            order = orders[int(index)]
+            self.process_edited_added_row(order, changes, True)
+            order_ids.append(str(order.order_id))
+
+        added_rows = order_changes.get("added_rows", [])
+        for added_row in added_rows:
+            order_id = added_row['order_id']
+            order = self.order_per_order_id.get(str(order_id), None)
+            if order is not None:
+                self.process_edited_added_row(order, added_row, False)
+                order_ids.append(str(order_id))
+            else:
+                print(f"Can't find added row with order_id:{order_id}")
+
+        return order_ids
+
+    def process_edited_added_row(self, order: Order, changes: Dict[str, Any], is_edited: bool):
+        # import here to avoid circular import dependencies
+        from server_application import ServerApplication, MessageAction
+
+        # TODO: be smart about handling change in UUID since the order with the old UUID s/b canceled first
+        uuid = order['uuid']
+        if ServerApplication.is_uuid_of_interest(uuid):
+            if is_edited:
+                if 'is_active' in changes:
+                    message_action = MessageAction.NewOrder if changes['is_active'] else MessageAction.CancelOrder
+                else:
+                    message_action = MessageAction.ChangeOrder
+            else:
+                message_action = MessageAction.NewOrder
+
+            ServerApplication.create_order_message(message_action, order, True)
+        else:
+            print(f"Changes requested for uuid:{uuid} but no interest there")
@@ -0,0 +1,233 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, Callable, Deque, Tuple, Any
+
+import quickfix as fix
+
+from fix_application import get_header_field_value, log
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP = "drop"
+
+
+@dataclass
+class ThrottleConfig:
+    # 0 means unlimited
+    messages_per_second: float = 0.0
+    burst: float = 0.0
+    messages_per_second_per_msg_type: Dict[str, float] = field(default_factory=dict)
+    queue_size: int = 10_000
+    # BLOCK makes the sender wait for room in the queue. The server and the client send from their event loop thread,
+    # so a full queue stalls the whole loop (inbound messages included) until the queue drains
+    overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK
+
+    SETTING_MESSAGES_PER_SECOND = 'OutboundMessagesPerSecond'
+    SETTING_BURST = 'OutboundBurst'
+    SETTING_MESSAGES_PER_SECOND_PER_MSG_TYPE = 'OutboundMessagesPerSecondPerMsgType'
+    SETTING_QUEUE_SIZE = 'OutboundQueueSize'
+    SETTING_OVERFLOW_POLICY = 'OutboundOverflowPolicy'
+
+    def is_unlimited(self) -> bool:
+        return not self.messages_per_second and not self.messages_per_second_per_msg_type
+
+    @staticmethod
+    def from_settings(settings: fix.SessionSettings) -> 'ThrottleConfig':
+        # The throttle settings live in the [DEFAULT] section of the quickfix config file
+        defaults = settings.get()
+        config = ThrottleConfig()
+        if defaults.has(ThrottleConfig.SETTING_MESSAGES_PER_SECOND):
+            config.messages_per_second = defaults.getDouble(ThrottleConfig.SETTING_MESSAGES_PER_SECOND)
+        if defaults.has(ThrottleConfig.SETTING_BURST):
+            config.burst = defaults.getDouble(ThrottleConfig.SETTING_BURST)
+        if defaults.has(ThrottleConfig.SETTING_MESSAGES_PER_SECOND_PER_MSG_TYPE):
+            # Format: D:100,G:50
+            rates = defaults.getString(ThrottleConfig.SETTING_MESSAGES_PER_SECOND_PER_MSG_TYPE)
+            for msg_type_rate in rates.split(','):
+                if ':' in msg_type_rate:
+                    msg_type, rate = msg_type_rate.split(':')
+                    config.messages_per_second_per_msg_type[msg_type.strip()] = float(rate)
+        if defaults.has(ThrottleConfig.SETTING_QUEUE_SIZE):
+            config.queue_size = defaults.getInt(ThrottleConfig.SETTING_QUEUE_SIZE)
+        if defaults.has(ThrottleConfig.SETTING_OVERFLOW_POLICY):
+            config.overflow_policy = OverflowPolicy(defaults.getString(ThrottleConfig.SETTING_OVERFLOW_POLICY).lower())
+
+        return config
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = 0.0):
+        self.rate = rate
+        self.capacity = burst if burst > 0 else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.last_refill = now
+
+    def secs_until_available(self, now: float) -> float:
+        self.refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        else:
+            return (1.0 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1.0
+
+
+class SessionThrottle:
+    def __init__(self, session_id: Any, config: ThrottleConfig, send_function: Callable, stats: Dict[str, int]):
+        self.session_id = session_id
+        self.config = config
+        self.send_function = send_function
+        self.stats = stats
+        self.session_bucket = TokenBucket(config.messages_per_second, config.burst) \
+            if config.messages_per_second else None
+        self.bucket_per_msg_type: Dict[str, TokenBucket] = {
+            msg_type: TokenBucket(rate) for msg_type, rate in config.messages_per_second_per_msg_type.items() if rate
+        }
+        self.pending: Deque[Tuple[str, fix.Message]] = deque()
+        self.condition = threading.Condition(threading.RLock())
+        self.is_running = True
+        self.worker = threading.Thread(target=self.drain_pending, name=f"throttle-{session_id}", daemon=True)
+        self.worker.start()
+
+    def buckets_for(self, msg_type: str):
+        buckets = []
+        if self.session_bucket:
+            buckets.append(self.session_bucket)
+        msg_type_bucket = self.bucket_per_msg_type.get(msg_type, None)
+        if msg_type_bucket:
+            buckets.append(msg_type_bucket)
+        return buckets
+
+    def secs_until_sendable(self, msg_type: str) -> float:
+        now = time.monotonic()
+        return max([bucket.secs_until_available(now) for bucket in self.buckets_for(msg_type)], default=0.0)
+
+    def send_now(self, msg_type: str, message: fix.Message) -> bool:
+        for bucket in self.buckets_for(msg_type):
+            bucket.consume()
+        self.stats['sent'] += 1
+        return self.send_function(message, self.session_id)
+
+    def send(self, msg_type: str, message: fix.Message) -> bool:
+        with self.condition:
+            # Keep the FIFO order: only bypass the queue if nothing is already waiting
+            if not self.pending and self.secs_until_sendable(msg_type) == 0.0:
+                return self.send_now(msg_type, message)
+
+            if not self.is_running:
+                # (stopped, nothing would ever send it)
+                return False
+            self.stats['throttled'] += 1
+            self.stats[f'throttled_{msg_type}'] = self.stats.get(f'throttled_{msg_type}', 0) + 1
+            if len(self.pending) >= self.config.queue_size:
+                if self.config.overflow_policy == OverflowPolicy.DROP:
+                    self.stats['dropped'] += 1
+                    log("THROTTLE", f"Outbound queue full ({self.config.queue_size}) for session:{self.session_id}. "
+                                    f"Dropped 35={msg_type}")
+                    return False
+                self.stats['blocked'] += 1
+                while len(self.pending) >= self.config.queue_size and self.is_running:
+                    self.condition.wait()
+                if not self.is_running:
+                    self.stats['dropped'] += 1
+                    log("THROTTLE", f"Outbound throttle stopped for session:{self.session_id}. Dropped 35={msg_type}")
+                    return False
+
+            self.pending.append((msg_type, message))
+            self.stats['queued'] += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self.pending))
+            self.condition.notify_all()
+
+            return True
+
+    def drain_pending(self) -> None:
+        with self.condition:
+            while self.is_running:
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                msg_type, message = self.pending[0]
+                wait_secs = self.secs_until_sendable(msg_type)
+                if wait_secs > 0:
+                    self.condition.wait(wait_secs)
+                    continue
+                self.pending.popleft()
+                try:
+                    self.send_now(msg_type, message)
+                except Exception as e:
+                    log("ERROR", f"Can't send queued 35={msg_type} to session:{self.session_id} with exception:{e}")
+                self.condition.notify_all()
+
+    def queue_depth(self) -> int:
+        return len(self.pending)
+
+    def stop(self) -> None:
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+
+
+class OutboundThrottle:
+    STAT_NAMES = ['sent', 'throttled', 'queued', 'dropped', 'blocked', 'max_queue_depth']
+
+    def __init__(self, config: ThrottleConfig | None = None, send_function: Callable = fix.Session.sendToTarget):
+        self.config = config if config else ThrottleConfig()
+        self.send_function = send_function
+        self.throttle_per_session: Dict[str, SessionThrottle] = {}
+        self.lock = threading.Lock()
+        self.stats_per_session: Dict[str, Dict[str, int]] = {}
+        self.last_logged_stats: Dict[str, Tuple[int, int]] = {}
+
+    def get_session_throttle(self, session_id: Any) -> SessionThrottle:
+        session_key = str(session_id)
+        with self.lock:
+            session_throttle = self.throttle_per_session.get(session_key, None)
+            if session_throttle is None:
+                stats = self.stats_per_session.setdefault(session_key, {name: 0 for name in self.STAT_NAMES})
+                session_throttle = SessionThrottle(session_id, self.config, self.send_function, stats)
+                self.throttle_per_session[session_key] = session_throttle
+
+            return session_throttle
+
+    def send(self, message: fix.Message, session_id: Any) -> bool:
+        if self.config.is_unlimited():
+            return self.send_function(message, session_id)
+
+        msg_type = get_header_field_value(message, fix.MsgType())
+        return self.get_session_throttle(session_id).send(msg_type, message)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            stats = {}
+            for session_key, session_stats in self.stats_per_session.items():
+                stats[session_key] = dict(session_stats)
+                session_throttle = self.throttle_per_session.get(session_key, None)
+                stats[session_key]['queue_depth'] = session_throttle.queue_depth() if session_throttle else 0
+
+            return stats
+
+    def log_stats_if_changed(self) -> None:
+        # Only worth logging once something has actually been throttled
+        stats = self.stats()
+        throttled_stats = {session_key: (session_stats['throttled'], session_stats['dropped'])
+                           for session_key, session_stats in stats.items()}
+        if throttled_stats != self.last_logged_stats:
+            for session_key, session_stats in stats.items():
+                log("THROTTLE", f"session:{session_key} " + ' '.join(f"{k}={v}" for k, v in session_stats.items()))
+            self.last_logged_stats = throttled_stats
+
+    def stop(self) -> None:
+        with self.lock:
+            for session_throttle in self.throttle_per_session.values():
+                session_throttle.stop()
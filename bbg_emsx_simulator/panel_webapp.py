@@ -1,30 +1,45 @@
-import re
-import subprocess
+import threading
 import time
-from collections import deque
-from pathlib import Path
-from typing import List, Union, Any
+from typing import List, Union, Any, Dict, Tuple
 
 import panel as pn
+from bokeh.models import ColumnDataSource
+from bokeh.plotting import figure
 from bokeh.models.widgets.tables import NumberFormatter, BooleanFormatter, CheckboxEditor, NumberEditor, SelectEditor, \
     IntEditor
 from pandas import DataFrame
 from panel.models.tabulator import CellClickEvent
 
+from control_api import ControlAPIClient, ControlAPIError, EVENT_MESSAGE
 from fix_application import FIXApplication
+from fix_log import LogTailer
+from log_highlighter import FIXLogHighlighter
+from log_index import LogIndex, parse_search_query
+from order_book_index import OrderQuery, DEFAULT_PAGE_SIZE, PAGE_SIZES, get_page_count
 from order_manager import OrderManager
+from server_application import OUTBOUND_QUEUE_DEPTH_GAUGE
 
 FIX_SERVER_LOG_FILE_PATH = 'log/FIX.4.2-FIXSERVER-FIXCLIENT.messages.current.log'
 VALID_TICKERS: List[str] = list(FIXApplication.KNOWN_SYMBOLS_BY_TICKER.keys())
 VALID_SIDES: List[str] = list(OrderManager.SIDES)
 PUSH_BUTTON = 'push'
+# How often the grid and the log are refreshed, the files are only looked at after a server event if it has an API
+FILE_POLLING_PERIOD_MS = 1_000
+SERVER_EVENTS_PERIOD_MS = 250
+LOG_INDEX_UPDATE_INTERVAL_SECS = 1.0
+# (~50ms of indexing, about the longest a search waits for the index)
+LOG_INDEX_UPDATE_MAX_BYTES = 1024 * 1024
+METRICS_PERIOD_MS = 1_000
 
 # -- Init
 order_manager = OrderManager()
-order_grid_df = order_manager.create_orders_df_copy()
-last_tailed_log_line = ''
-last_order_file_timestamp = ''
-fix_server_log_file_path = Path(FIX_SERVER_LOG_FILE_PATH)
+# The grid only holds one page of the orders (filtered and sorted here, not in the browser)
+order_query = OrderQuery()
+order_grid_df = order_manager.query_orders(order_query)[0].reset_index(drop=True)
+last_order_file_signature = None
+# Set by the server event stream (see watch_server_events())
+orders_changed_event = threading.Event()
+message_event = threading.Event()
 
 
 # -- Callbacks
@@ -33,14 +48,156 @@ def refresh_callback(_):
 
 
 def refresh_from_order_file():
-    global last_order_file_timestamp
-    order_file_timestamp = order_manager.get_file_timestamp()
-    if last_order_file_timestamp < order_file_timestamp:
-        last_order_file_timestamp = order_file_timestamp
+    global last_order_file_signature
+    order_file_signature = order_manager.get_file_signature()
+    if order_file_signature != last_order_file_signature:
+        last_order_file_signature = order_file_signature
         order_manager.read_orders_from_file()
-        set_grid_order_df(order_manager.create_orders_df_copy())
+        new_order_grid_df = query_order_page()
+        delta = OrderManager.diff_orders_dfs(order_grid_df, new_order_grid_df)
+        if delta is None:
+            # rows removed or reordered, replace everything
+            set_grid_order_df(new_order_grid_df)
+            outcome = "refreshed"
+        else:
+            patch_grid_order_df(*delta)
+            changed_cells_per_column, added_rows_df = delta
+            if not changed_cells_per_column and not len(added_rows_df):
+                return
+            outcome = f"patched ({sum(len(cells) for cells in changed_cells_per_column.values())} cell(s), " \
+                      f"{len(added_rows_df)} new row(s))"
         #    log_to_pane(f"Refresh: id:{id(order_grid_df)}:\n {order_grid_df}")
-        log_to_pane(f"Order grid was refreshed from the file (last_update: {order_file_timestamp})")
+        log_to_pane(f"Order grid was {outcome} from the file (last_update: {order_manager.get_file_timestamp()})")
+
+
+def query_order_page() -> DataFrame:
+    page_df, row_count = order_manager.query_orders(order_query)
+    page_count = get_page_count(row_count, order_query.page_size)
+    if order_query.page >= page_count:
+        # (fewer orders than before)
+        order_query.page = page_count - 1
+        page_df, row_count = order_manager.query_orders(order_query)
+    page_info_pane.object = f"{row_count} order(s), page {order_query.page + 1}/{page_count}"
+
+    # (the grid rows are numbered from 0, the page's rows are somewhere in the orders file)
+    return page_df.reset_index(drop=True)
+
+
+def show_order_page():
+    set_grid_order_df(query_order_page())
+
+
+def apply_order_filters(_):
+    uuid = uuid_filter_input.value.strip()
+    if uuid and not uuid.isdigit():
+        log_to_pane(f"Invalid uuid:{uuid}")
+        return
+    order_query.uuid = int(uuid) if uuid else None
+    order_query.symbol = symbol_filter_input.value.strip() or None
+    order_query.is_active = is_active_filter_select.value
+    order_query.sort_by = sort_by_select.value
+    order_query.ascending = ascending_checkbox.value
+    order_query.page_size = page_size_select.value
+    order_query.page = 0
+    show_order_page()
+
+
+def change_order_page(page_increment: int):
+    order_query.page = max(order_query.page + page_increment, 0)
+    show_order_page()
+
+
+def refresh_on_server_events():
+    if order_manager.control_api_client is None or orders_changed_event.is_set():
+        orders_changed_event.clear()
+        refresh_from_order_file()
+    if order_manager.control_api_client is None or message_event.is_set():
+        message_event.clear()
+        tail_server_fix_log_in_html_pane()
+
+
+def watch_server_events(control_api_client: ControlAPIClient):
+    # On its own thread: only flags what has changed, the refresh happens in the periodic callback
+    try:
+        for event_type, _ in control_api_client.iter_events():
+            if event_type == EVENT_MESSAGE:
+                message_event.set()
+            else:
+                # (the orders, or the events dropped by the server because we were too slow)
+                orders_changed_event.set()
+                message_event.set()
+    except OSError as e:
+        print(f"Lost the server event stream:{e}")
+    # back to polling the files
+    order_manager.control_api_client = None
+
+
+def update_fix_log_index():
+    # On its own thread: the first update of a big log takes a while, the next ones only index the new lines. It's
+    # indexed a MB at a time, so that a search doesn't wait for the whole update (it sees what's indexed so far)
+    while True:
+        with fix_log_index_lock:
+            fix_log_index.update(LOG_INDEX_UPDATE_MAX_BYTES)
+        # (sleep(0) lets a waiting search take the lock in between)
+        time.sleep(LOG_INDEX_UPDATE_INTERVAL_SECS if fix_log_index.is_up_to_date else 0)
+
+
+def search_fix_logs(e):
+    try:
+        criteria = parse_search_query(e.new)
+    except ValueError as error:
+        search_pane.object = str(error)
+        return
+    if not criteria:
+        search_pane.object = ""
+        return
+    start_time = time.perf_counter()
+    with fix_log_index_lock:
+        hits = fix_log_index.search(criteria)
+    hightlighted_lines = fix_log_search_highlighter.render_lines(hit.line for hit in hits)
+    search_pane.object = f"""{html_panel_css()}<div>{len(hits)} message(s) in \
+{(time.perf_counter() - start_time) * 1000:.1f}ms\n{hightlighted_lines}</div>"""
+
+
+def refresh_metrics_pane():
+    # The server keeps the last minute of metrics, the charts show that window (no history builds up here)
+    if order_manager.control_api_client is None:
+        metrics_table_pane.object = "(the server's control API isn't available, no metrics)"
+        return
+    try:
+        metrics = order_manager.control_api_client.get_metrics()
+    except (OSError, ControlAPIError) as error:
+        metrics_table_pane.object = f"Can't get the metrics:{error}"
+        return
+    rates_per_key = metrics['messages_per_second']
+    no_values = [0] * metrics['window_secs']
+    metrics_source.data = {
+        'second': list(range(-metrics['window_secs'], 0)),
+        'in': [sum(values) for values in zip(no_values, *[rates for key, rates in rates_per_key.items()
+                                                         if key.startswith('in:')])],
+        'out': [sum(values) for values in zip(no_values, *[rates for key, rates in rates_per_key.items()
+                                                          if key.startswith('out:')])],
+        'queue_depth': metrics['gauges'].get(OUTBOUND_QUEUE_DEPTH_GAUGE, no_values),
+    }
+    rows = [f"<tr><td>{key}</td><td>{rates[-1]}</td><td>{sum(rates) / len(rates):.1f}</td><td>{max(rates)}</td></tr>"
+            for key, rates in sorted(rates_per_key.items())]
+    latency_rows = [f"<tr><td>{name}</td>{''.join(f'<td>{k}:{v}</td>' for k, v in metrics[key].items())}</tr>"
+                    for name, key in [('reserve -> accept', 'reserve_accept_latency_us'),
+                                      ('order changes apply', 'order_changes_apply_latency_us')]]
+    metrics_table_pane.object = f"""<table><tr><th>direction:35=</th><th>msgs/s (last)</th><th>avg</th><th>max</th></tr>
+{''.join(rows)}</table><table><tr><th>latency (us)</th></tr>{''.join(latency_rows)}</table>"""
+
+
+def create_metrics_figure():
+    metrics_figure = figure(height=220, width=700, title="Messages/s and outbound queue depth (last minute)",
+                            x_axis_label='seconds', toolbar_location=None)
+    metrics_figure.line('second', 'in', source=metrics_source, legend_label='in', color='steelblue')
+    metrics_figure.line('second', 'out', source=metrics_source, legend_label='out', color='darkorange')
+    metrics_figure.line('second', 'queue_depth', source=metrics_source, legend_label='queue depth', color='red',
+                        line_dash='dashed')
+    metrics_figure.legend.location = 'top_left'
+
+    return metrics_figure
 
 
 def add_row(_):
@@ -96,56 +253,20 @@ def html_panel_css() -> str:
     return html_panel_css
 
 
-def highlight_tags_in_html_lines(lines: List[str]) -> List[str]:
-    hightlighted_lines: List[str] = []
-    TAGS_TO_COLOR: set[int] = {35, 37, 50, 55}
-    for line in lines:
-        hightlighted_line = line
-        for tag in TAGS_TO_COLOR:
-            tag_span = f'<span class="color_{tag}">'
-            hightlighted_line = re.sub(f'\|({tag}=[^|]+)', lambda m: f"|{tag_span}{m.group(1)}</span>",
-                                       hightlighted_line)
-        hightlighted_lines.append(hightlighted_line + "\n")
-
-    return hightlighted_lines
-
-
 def tail_server_fix_log_in_html_pane():
-    global last_tailed_log_line, last_modified, last_log_line_count, current_modified
-
     log_line_count = log_line_count_slider.value
-    load_lines = last_log_line_count is None or (last_log_line_count != log_line_count)
-    if not load_lines:
-        current_modified = fix_server_log_file_path.stat().st_mtime
-        load_lines = current_modified != last_modified
-
-    if load_lines:
-        last_modified = current_modified
-        last_log_line_count = log_line_count
-
-        # TODO. Need a more efficient way to do this. Remember the last file position and reread from it?
-        command = f"grep -v '35=0' {FIX_SERVER_LOG_FILE_PATH} | tail -{log_line_count}"
-        tailed_lines = run_command(command)
-
-        tailed_lines = [line.replace('\001', '|') for line in tailed_lines if line]
-        hightlighted_lines = "".join(highlight_tags_in_html_lines(tailed_lines))
+    is_resized = log_line_count != fix_log_tailer.max_lines
+    if is_resized:
+        fix_log_tailer.set_max_lines(log_line_count)
+
+    # Only reads what has been appended to the log since the last refresh (heartbeats are skipped)
+    if fix_log_tailer.poll() or is_resized:
+        # (only the new lines get rendered)
+        hightlighted_lines = fix_log_highlighter.render_lines(line for _, line in fix_log_tailer.lines)
         html = f"""{html_panel_css()}<div>{hightlighted_lines}</div>"""
         html_pane.object = html
 
 
-def run_command(command):
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
-    output, error = process.communicate()
-    if error:
-        print(f"Error: {error}")
-    return output.decode().split('\n')
-
-
-def tail(filename, n=10):
-    with open(filename, 'r') as f:
-        return deque(f, n)
-
-
 def create_order_grid(order_grid_df):
     bokeh_formatters = {
         'uuid': NumberFormatter(format='0'),
@@ -178,6 +299,17 @@ def set_grid_order_df(_grid_order_df: DataFrame) -> None:
     order_grid.value = order_grid_df
 
 
+def patch_grid_order_df(changed_cells_per_column: Dict[str, List[Tuple[Any, Any]]], added_rows_df: DataFrame) -> None:
+    # Only the changed cells and the new rows are sent to the browser
+    global order_grid_df
+    if changed_cells_per_column:
+        order_grid.patch(changed_cells_per_column)
+    if len(added_rows_df):
+        order_grid.stream(added_rows_df, follow=False)
+    # (stream() replaces the value)
+    order_grid_df = order_grid.value
+
+
 # NOTE: The panel module seems to work best when everything is defined global
 # -- Main starts here
 pn.extension("tabulator",
@@ -191,6 +323,25 @@ order_grid = create_order_grid(order_grid_df)
 
 info_pane = pn.pane.HTML("Info.")
 
+uuid_filter_input = pn.widgets.TextInput(name='uuid', placeholder='all', width=100)
+symbol_filter_input = pn.widgets.TextInput(name='symbol', placeholder='all', width=100)
+is_active_filter_select = pn.widgets.Select(name='is_active', options={'all': None, 'active': True, 'inactive': False},
+                                            width=100)
+sort_by_select = pn.widgets.Select(name='sort by', options=dict({'file order': None},
+                                                                 **{column: column for column in order_grid_df.columns}),
+                                   width=120)
+ascending_checkbox = pn.widgets.Checkbox(name='ascending', value=True)
+page_size_select = pn.widgets.Select(name='rows per page', options=PAGE_SIZES, value=DEFAULT_PAGE_SIZE, width=100)
+for filter_widget in [uuid_filter_input, symbol_filter_input, is_active_filter_select, sort_by_select,
+                      ascending_checkbox, page_size_select]:
+    filter_widget.param.watch(apply_order_filters, 'value')
+previous_page_button = pn.widgets.Button(name='<', width=40)
+previous_page_button.on_click(lambda _: change_order_page(-1))
+next_page_button = pn.widgets.Button(name='>', width=40)
+next_page_button.on_click(lambda _: change_order_page(1))
+page_info_pane = pn.pane.Markdown("")
+show_order_page()
+
 add_row_button = pn.widgets.Button(name='Add row', button_type='primary')
 add_row_button.on_click(add_row)
 
@@ -208,10 +359,33 @@ html_pane_styles = {
 }
 html_pane = pn.pane.HTML("""(waiting for log...)""", styles=html_pane_styles)
 
+search_input = pn.widgets.TextInput(name='Search the server FIX logs (current and rotated)',
+                                    placeholder='456 (an order_id), 37=456 35=D, 11=<ClOrdID>, 50=<UUID>')
+search_input.param.watch(search_fix_logs, 'value')
+search_pane = pn.pane.HTML("", styles=html_pane_styles)
+
+metrics_title = pn.pane.Markdown("## Server Metrics")
+metrics_source = ColumnDataSource({'second': [], 'in': [], 'out': [], 'queue_depth': []})
+metrics_pane = pn.pane.Bokeh(create_metrics_figure())
+metrics_table_pane = pn.pane.HTML("(waiting for metrics...)")
+
 # Init global vars used in the call back
-last_tailed_log_line, last_order_file_timestamp, last_modified, last_log_line_count, current_modified = '', '', 0, 0, 0
-pn.state.add_periodic_callback(refresh_from_order_file, period=1_000)
-pn.state.add_periodic_callback(tail_server_fix_log_in_html_pane, period=1_000)
+last_order_file_signature = None
+fix_log_tailer = LogTailer(FIX_SERVER_LOG_FILE_PATH, log_line_count_slider.value)
+fix_log_highlighter = FIXLogHighlighter()
+fix_log_index = LogIndex(FIX_SERVER_LOG_FILE_PATH)
+fix_log_index_lock = threading.Lock()
+fix_log_search_highlighter = FIXLogHighlighter()
+threading.Thread(target=update_fix_log_index, daemon=True).start()
+# The order changes are submitted, and the server events received, through the server's API when it's up
+order_manager.control_api_client = ControlAPIClient.connect_if_running()
+if order_manager.control_api_client:
+    threading.Thread(target=watch_server_events, args=(order_manager.control_api_client,), daemon=True).start()
+    pn.state.add_periodic_callback(refresh_on_server_events, period=SERVER_EVENTS_PERIOD_MS)
+else:
+    pn.state.add_periodic_callback(refresh_on_server_events, period=FILE_POLLING_PERIOD_MS)
+log_line_count_slider.param.watch(lambda _: tail_server_fix_log_in_html_pane(), 'value')
+pn.state.add_periodic_callback(refresh_metrics_pane, period=METRICS_PERIOD_MS)
 
 table_theme = pn.widgets.Select(name='Select',
                                 options=['simple', 'default', 'midnight', 'site', 'modern', 'bootstrap',
@@ -220,10 +394,17 @@ table_theme.param.watch(update_theme, 'value')
 
 app = pn.Column(
     title,
+    pn.Row(uuid_filter_input, symbol_filter_input, is_active_filter_select, sort_by_select, ascending_checkbox,
+           page_size_select),
     pn.Row(order_grid, info_pane),
+    pn.Row(previous_page_button, page_info_pane, next_page_button),
     pn.Row(add_row_button, refresh_button),
     log_title,
     log_line_count_slider,
     html_pane,
+    search_input,
+    search_pane,
+    metrics_title,
+    pn.Row(metrics_pane, metrics_table_pane),
 )
 app.servable()
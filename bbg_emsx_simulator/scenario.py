@@ -1,6 +1,6 @@
 import re
 from enum import Enum
-from typing import Dict, Set, List, Tuple, Union
+from typing import Dict, Set, List, Tuple, Union, Iterator
 
 
 class Action(Enum):
@@ -16,6 +16,9 @@ class Action(Enum):
     DELETE_ORDER = "delete_order"
 
     SET = "set"
+    SLEEP = "sleep"
+    LOOP = "loop"
+    END_LOOP = "end_loop"
     END = "end"
     CONTINUE = "continue"
 
@@ -50,15 +53,30 @@ class KeyAlias:
         return converted_key_values
 
 
+VARIABLE_REGEX = re.compile(r'\$(\w+)')
+RANGE_REGEX = re.compile(r'^([$\w]+)\.\.([$\w]+)$')
+
+
+def substitute_variables(value: str, variables: Dict[str, str]) -> str:
+    return VARIABLE_REGEX.sub(lambda match: variables[match.group(1)], value)
+
+
+def to_format_string(value: str) -> str:
+    # 'abc$var' -> 'abc{var}'
+    return VARIABLE_REGEX.sub(r'{\1}', value.replace('{', '{{').replace('}', '}}'))
+
+
 class ActionLine:
     action: Action
     key_values: Dict[str, str]
     line_number: int
     label: str
+    timeout_secs: Union[float, None]
     is_valid: bool
     was_processed: bool
 
     action_keywords: Dict[str, Action] = {action.value: action for action in Action}
+    TIMEOUT_KEY = 'timeout'
 
     def __init__(self, action_keyword: str, key_values: Dict[str, str], line_number: int, label: str):
         action = ActionLine.action_keywords.get(action_keyword.lower(), None)
@@ -69,7 +87,17 @@ class ActionLine:
             self.is_valid = False
             return
 
-        key_values = KeyAlias.convert_aliases(key_values)
+        if action != Action.SET:
+            # (the keys of a set are variable names)
+            key_values = KeyAlias.convert_aliases(key_values)
+        # `timeout` isn't a FIX tag/column, it's how long the step may take (e.g. for a wait)
+        timeout = key_values.pop(ActionLine.TIMEOUT_KEY, None)
+        try:
+            self.timeout_secs = float(timeout) if timeout is not None else None
+        except ValueError:
+            print(f"ERROR: {ActionLine.TIMEOUT_KEY}={timeout} isn't a number of seconds at line:{line_number}")
+            self.is_valid = False
+            return
         mandatory_keys = ActionMandatoryKeys.keys_per_action.get(action, [])
         for mandatory_key in mandatory_keys:
             if mandatory_key not in key_values:
@@ -85,6 +113,24 @@ class ActionLine:
         self.line_number = line_number
         self.is_valid = True
         self.was_processed = False
+        self.variable_names = set(VARIABLE_REGEX.findall(' '.join([*key_values.values(), label or ''])))
+        # the values with $variables, as format strings, so that expanding the line is cheap
+        self.key_value_templates = {key: to_format_string(value) for key, value in key_values.items()
+                                    if '$' in value}
+        self.label_template = to_format_string(label) if label and '$' in label else None
+
+    def expand(self, variables: Dict[str, str]) -> 'ActionLine':
+        # A fresh (unprocessed) copy of this template line with the $variables replaced by their current value
+        action_line = ActionLine.__new__(ActionLine)
+        action_line.__dict__.update(self.__dict__)
+        key_values = dict(self.key_values)
+        for key, template in self.key_value_templates.items():
+            key_values[key] = template.format_map(variables)
+        action_line.key_values = key_values
+        if self.label_template:
+            action_line.label = self.label_template.format_map(variables)
+
+        return action_line
 
     def get(self, key: str):
         return self.key_values.get(key, None)
@@ -98,47 +144,217 @@ class ActionLine:
     def has_been__processed(self) -> bool:
         return self.was_processed
 
+    def to_scenario_line(self) -> str:
+        # the line of a scenario file which would create this action line
+        parts = [self.action.value]
+        parts.extend(f"{KeyAlias.actual_to_alias.get(key, key)}={value}" for key, value in self.key_values.items())
+        if self.timeout_secs is not None:
+            parts.append(f"{ActionLine.TIMEOUT_KEY}={self.timeout_secs:g}")
+        if self.label:
+            parts.append(f'label="{self.label}"')
+        return ' '.join(parts)
+
     def __str__(self):
         key_values_str = ", ".join(f"{key}={value}" for key, value in self.key_values.items())
         label_str = f'label:"{self.label}"' if self.label else "No label"
         return f"action:{self.action.value} | key_values:{key_values_str} | {label_str} | line_number:{self.line_number}"
 
 
-class Scenario:
-    action_lines: List[ActionLine] = []
-    current_line: int = 0
+class ScenarioLoop:
+    # loop <variable>=<first>..<last> [step=<n>] ... end_loop (both bounds are included and may be $variables)
+    variable: str
+    first: str
+    last: str
+    step: str
+    line_number: int
+    body: List[Union[ActionLine, 'ScenarioLoop']]
 
-    def __init__(self, scenario_file_path):
-        with open(scenario_file_path) as fd:
-            errors = 0
-            line_number = 0
-            for file_line in fd.readlines():
-                line_number += 1
-                if file_line.strip() and not file_line.startswith("#"):
-                    action, key_values, label = self.parse_file_line(file_line)
-                    if action:
-                        action_line = ActionLine(action, key_values, line_number, label)
-                        if action_line.is_valid:
-                            self.add_action_line(action_line)
-                        else:
-                            errors += 1
-                    else:
-                        print(f"ERROR:`{file_line}` has an invalid format at line:{line_number}")
+    STEP_KEY = 'step'
+
+    def __init__(self, variable: str, first: str, last: str, step: str, line_number: int):
+        self.variable = variable
+        self.first = first
+        self.last = last
+        self.step = step
+        self.line_number = line_number
+        self.body = []
+
+    def iter_values(self, variables: Dict[str, str]) -> Iterator[str]:
+        first = int(substitute_variables(self.first, variables))
+        last = int(substitute_variables(self.last, variables))
+        step = abs(int(substitute_variables(self.step, variables))) or 1
+        step = step if first <= last else -step
+        for value in range(first, last + (1 if step > 0 else -1), step):
+            yield str(value)
+
+    def __str__(self):
+        return f"loop {self.variable}={self.first}..{self.last} step={self.step} | line_number:{self.line_number}"
+
+
+class Scenario:
+    # The scenario file is compiled once into a plan (the lines as templates and the loops around them) which is
+    # then expanded lazily, one action line at a time, so that a scenario of any size starts right away and uses
+    # a constant amount of memory.
+    # The numeric uuids and order ids are shifted by namespace_offset so that several scenarios written for the
+    # same orders can run side by side. They must then be below namespace_size, or they'd end up in the namespace of
+    # another scenario.
+    NAMESPACED_KEYS = ['50', '37', 'order_id']
+
+    def __init__(self, scenario_file_path, namespace_offset: int = 0, namespace_size: int | None = None):
+        self.scenario_file_path = scenario_file_path
+        self.namespace_offset = namespace_offset
+        self.namespace_size = namespace_size
+        self.plan: List[Union[ActionLine, ScenarioLoop]] = []
+        self.variables: Dict[str, str] = {}
+        self.action_line_count = 0
+        errors = self.compile(scenario_file_path)
         if errors:
             print(f"\nERROR: processing file:{scenario_file_path} resulted in {errors} error(s). Exiting.")
-        elif len(self.action_lines) == 0:
+        elif self.action_line_count == 0:
             print(f"ERROR: processing file:{scenario_file_path} didn't find any valid lines. Exiting.")
         else:
+            self.action_line_iterator = self.iter_action_lines()
+            self.current_action_line = next(self.action_line_iterator, None)
             return
 
         exit(1)
 
     def __str__(self):
-        lines_str = "\n".join(str(line) for line in self.action_lines)
+        lines: List[str] = []
+        self.append_plan_lines(self.plan, lines, '')
+        lines_str = "\n".join(lines)
         return f"Scenario:\n{lines_str}"
 
-    def add_action_line(self, action_line: ActionLine) -> None:
-        self.action_lines.append(action_line)
+    def append_plan_lines(self, plan: List[Union[ActionLine, ScenarioLoop]], lines: List[str], indent: str) -> None:
+        for step in plan:
+            lines.append(f"{indent}{step}")
+            if isinstance(step, ScenarioLoop):
+                self.append_plan_lines(step.body, lines, indent + '    ')
+
+    def compile(self, scenario_file_path: str) -> int:
+        errors = 0
+        # the plan (or loop body) lines are added to, and the variables which can be used at this point
+        plans: List[List[Union[ActionLine, ScenarioLoop]]] = [self.plan]
+        loops: List[ScenarioLoop] = []
+        defined_variables: Set[str] = set()
+        with open(scenario_file_path) as fd:
+            for line_number, file_line in enumerate(fd, start=1):
+                # (lines can be indented, e.g. inside a loop)
+                file_line = file_line.strip()
+                if not file_line or file_line.startswith("#"):
+                    continue
+                action, key_values, label = self.parse_file_line(file_line)
+                if not action:
+                    print(f"ERROR:`{file_line}` has an invalid format at line:{line_number}")
+                    errors += 1
+                    continue
+
+                action = action.lower()
+                loop_variables = {loop.variable for loop in loops}
+                if action == Action.LOOP.value:
+                    loop = self.compile_loop(key_values, line_number, defined_variables | loop_variables)
+                    if loop:
+                        plans[-1].append(loop)
+                        plans.append(loop.body)
+                        loops.append(loop)
+                    else:
+                        errors += 1
+                elif action == Action.END_LOOP.value:
+                    if loops:
+                        loops.pop()
+                        plans.pop()
+                    else:
+                        print(f"ERROR: {Action.END_LOOP.value} without a {Action.LOOP.value} at line:{line_number}")
+                        errors += 1
+                else:
+                    action_line = ActionLine(action, key_values, line_number, label)
+                    if not action_line.is_valid:
+                        errors += 1
+                        continue
+                    undefined_variables = action_line.variable_names - defined_variables - loop_variables
+                    if undefined_variables:
+                        print(f"ERROR: undefined variable(s):{', '.join(sorted(undefined_variables))} "
+                              f"at line:{line_number}")
+                        errors += 1
+                        continue
+                    # (the values with $variables are checked when the line is expanded)
+                    out_of_namespace_error = self.get_out_of_namespace_error(action_line)
+                    if out_of_namespace_error:
+                        print(f"ERROR: {out_of_namespace_error} at line:{line_number}")
+                        errors += 1
+                        continue
+                    if action_line.action == Action.SET:
+                        defined_variables.update(action_line.key_values)
+                    else:
+                        self.action_line_count += 1
+                    plans[-1].append(action_line)
+
+        for loop in loops:
+            print(f"ERROR: {Action.LOOP.value} at line:{loop.line_number} has no {Action.END_LOOP.value}")
+            errors += 1
+
+        return errors
+
+    def compile_loop(self, key_values: Dict[str, str], line_number: int,
+                     defined_variables: Set[str]) -> Union[ScenarioLoop, None]:
+        step = key_values.pop(ScenarioLoop.STEP_KEY, '1')
+        if len(key_values) != 1:
+            print(f"ERROR: {Action.LOOP.value} needs exactly one <variable>=<first>..<last> at line:{line_number}")
+            return None
+        variable, value_range = next(iter(key_values.items()))
+        match = RANGE_REGEX.match(value_range)
+        if not match:
+            print(f"ERROR: {value_range} isn't a <first>..<last> range at line:{line_number}")
+            return None
+        first, last = match.groups()
+        for bound in (first, last, step):
+            undefined_variables = set(VARIABLE_REGEX.findall(bound)) - defined_variables
+            if undefined_variables:
+                print(f"ERROR: undefined variable(s):{', '.join(sorted(undefined_variables))} at line:{line_number}")
+                return None
+            if not bound.startswith('$') and not bound.isdigit():
+                print(f"ERROR: {bound} isn't an integer at line:{line_number}")
+                return None
+
+        return ScenarioLoop(variable, first, last, step, line_number)
+
+    def iter_action_lines(self) -> Iterator[ActionLine]:
+        return self.iter_plan(self.plan)
+
+    def iter_plan(self, plan: List[Union[ActionLine, ScenarioLoop]]) -> Iterator[ActionLine]:
+        for step in plan:
+            if isinstance(step, ScenarioLoop):
+                for value in step.iter_values(self.variables):
+                    self.variables[step.variable] = value
+                    yield from self.iter_plan(step.body)
+            elif step.action == Action.SET:
+                for name, value in step.key_values.items():
+                    self.variables[name] = substitute_variables(value, self.variables)
+            elif self.namespace_offset or self.namespace_size:
+                yield self.apply_namespace_offset(step.expand(self.variables))
+            else:
+                yield step.expand(self.variables)
+
+    def get_out_of_namespace_error(self, action_line: ActionLine) -> str | None:
+        if not self.namespace_size or action_line.action == Action.SET:
+            return None
+        out_of_namespace_values = [f"{key}={action_line.key_values[key]}" for key in Scenario.NAMESPACED_KEYS
+                                   if action_line.key_values.get(key, '').isdigit() and
+                                   int(action_line.key_values[key]) >= self.namespace_size]
+        if not out_of_namespace_values:
+            return None
+        return f"{', '.join(out_of_namespace_values)} must be below {self.namespace_size} when several scenarios run"
+
+    def apply_namespace_offset(self, action_line: ActionLine) -> ActionLine:
+        out_of_namespace_error = self.get_out_of_namespace_error(action_line)
+        if out_of_namespace_error:
+            raise ValueError(f"{out_of_namespace_error} at line:{action_line.line_number} of {self.scenario_file_path}")
+        for key in Scenario.NAMESPACED_KEYS:
+            value = action_line.key_values.get(key, None)
+            if value is not None and value.isdigit():
+                action_line.key_values[key] = str(int(value) + self.namespace_offset)
+
+        return action_line
 
     def parse_file_line(self, file_line: str) -> Tuple[Union[str, None], Union[Dict[str, str], None], Union[str, None]]:
         # action k1=v1 k2=v2 label="some text here"
@@ -149,20 +365,21 @@ class Scenario:
         else:
             label = None
 
-        match = re.match(r'(\w+)\s*([a-zA-Z0-9_= ]*)', file_line)
+        match = re.match(r'(\w+)\s*([a-zA-Z0-9_=.$ ]*)', file_line)
         if match:
             action_keyword = match.group(1)
-            key_value_pairs = dict(re.findall(r'(\w+)=(\w+)', match.group(2)))
+            key_value_pairs = dict(re.findall(r'(\w+)=([\w.$]+)', match.group(2)))
             return action_keyword, key_value_pairs, label
         else:
             return None, None, None
 
     def get_current_action_line(self) -> Union[ActionLine, None]:
-        return self.action_lines[self.current_line]
+        return self.current_action_line
 
     def ready_next_action_line(self) -> bool:
-        if self.current_line < len(self.action_lines) - 1:
-            self.current_line += 1
+        next_action_line = next(self.action_line_iterator, None)
+        if next_action_line:
+            self.current_action_line = next_action_line
             return True
         else:
             return False
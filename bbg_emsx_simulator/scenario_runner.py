@@ -0,0 +1,371 @@
+import asyncio
+import json
+import time
+from collections import deque
+from enum import Enum
+from typing import Dict, List, Deque, Tuple
+
+import quickfix as fix
+
+from client_application import ClientApplication, ExecutionReportType
+from fix_application import FIXMessage, log
+from instrumentation import get_public_method_names
+from latency_histogram import LatencyHistogram, format_summary
+from message_inbox import MessageInbox
+from models import Order
+from order_store import OrderStore
+from scenario import Scenario, ActionLine, Action
+
+FIX_CLIENTID_TAG50 = str(fix.SenderSubID().getField())
+FIX_ORDERID_TAG37 = str(fix.OrderID().getField())
+FIX_ORDERQTY_TAG38 = str(fix.OrderQty().getField())
+
+WAIT_TIMEOUT_SECS = 30
+UPDATE_ORDER_ACK_TIMEOUT_SECS = 10
+ORDER_CHANGES_ACK_POLL_INTERVAL_SECS = .005
+SLEEP_SECS_KEY = 'secs'
+SLEEP_UNTIL_KEY = 'until'
+# The uuids and order ids of the scenario #n are shifted by n * NAMESPACE_SIZE (when several scenarios run, their
+# ids must be below it, see Scenario.namespace_size)
+NAMESPACE_SIZE = 100000
+# The actions sending something (a message or an order change) the server reacts to
+TRIGGERING_ACTIONS = {Action.REQUEST_IOI, Action.RESERVE, Action.ACK, Action.FILL, Action.DFD, Action.UPDATE_ORDER}
+SENT_NS_HISTORY_SIZE = 256
+LATENCY_PERCENTILES = [50.0, 99.0]
+# The keys naming the latency of a WAIT step without a label (the uuid/order id would make it unique)
+UNLABELED_KEYS = {str(fix.MsgType().getField()), str(fix.OrdStatus().getField())}
+
+
+class ScenarioStatus(Enum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    PASSED = "PASSED"
+    FAILED = "FAILED"
+
+
+class ScenarioRun:
+    def __init__(self, scenario: Scenario, namespace_index: int, inbox: MessageInbox):
+        self.scenario = scenario
+        self.namespace_index = namespace_index
+        self.inbox = inbox
+        self.status = ScenarioStatus.PENDING
+        self.step_count = 0
+        self.elapsed_secs = 0.0
+        self.failed_line_number: int | None = None
+        self.is_end_requested = False
+        self.start_time = 0.0
+        # (perf_counter_ns, action) of the latest sends, oldest first
+        self.sent_ns_history: Deque[Tuple[int, Action]] = deque(maxlen=SENT_NS_HISTORY_SIZE)
+
+    def record_send(self, action: Action) -> None:
+        self.sent_ns_history.append((time.perf_counter_ns(), action))
+
+    def get_triggering_send(self, received_ns: int) -> Tuple[int, Action] | None:
+        # The latest send before the message was received
+        for sent_ns, action in reversed(self.sent_ns_history):
+            if sent_ns <= received_ns:
+                return sent_ns, action
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            'scenario_file_path': self.scenario.scenario_file_path,
+            'namespace': self.namespace_index,
+            'status': self.status.value,
+            'failed_line_number': self.failed_line_number,
+            'step_count': self.step_count,
+            'elapsed_secs': round(self.elapsed_secs, 3),
+        }
+
+    def __str__(self):
+        failed_str = f" at line:{self.failed_line_number}" if self.failed_line_number else ""
+        return f"{self.scenario.scenario_file_path:<30} namespace:{self.namespace_index:<3} " \
+               f"{self.status.value}{failed_str} | {self.step_count} step(s) in {self.elapsed_secs:.3f}s"
+
+
+class ScenarioRunner:
+    # Runs one or more scenario files concurrently on the client's session. Each scenario gets its own namespace
+    # (uuids and order ids shifted by NAMESPACE_SIZE) and its own inbox, so that they can't see each other's
+    # messages, and the orders of namespace #0 are copied into the other namespaces before starting.
+    def __init__(self, application: ClientApplication, scenarios: List[Scenario],
+                 inbox_max_messages: int = MessageInbox.DEFAULT_MAX_MESSAGES,
+                 inbox_max_age_secs: float = MessageInbox.DEFAULT_MAX_AGE_SECS, results_file_path: str | None = None):
+        # (the scenario #n must have been created with the namespace_offset n * NAMESPACE_SIZE, see create_scenarios)
+        self.application = application
+        self.results_file_path = results_file_path
+        self.runs: List[ScenarioRun] = [
+            ScenarioRun(scenario, namespace_index, MessageInbox(inbox_max_messages, inbox_max_age_secs))
+            for namespace_index, scenario in enumerate(scenarios)]
+        # the orders file (and the server's order change instructions) is shared, one update at a time
+        self.order_update_lock = asyncio.Lock()
+        self.order_manager = None
+        # (an Instrumentation, to time the order manager calls)
+        self.instrumentation = None
+        # WAIT step label -> time from the triggering send to the reception of the expected message
+        self.latency_per_label: Dict[str, LatencyHistogram] = {}
+        self.elapsed_secs = 0.0
+        # An END step terminates the app, unless the runner is embedded (see loopback.py)
+        self.is_exit_on_end = True
+
+    def get_order_manager(self):
+        if self.order_manager is None:
+            # import here, pandas is only needed by the scenarios updating orders
+            from order_manager import OrderManager
+            self.order_manager = OrderManager()
+            if self.instrumentation:
+                self.instrumentation.instrument(self.order_manager, 'OrderManager',
+                                                get_public_method_names(self.order_manager))
+        return self.order_manager
+
+    def seed_namespace_orders(self) -> int:
+        order_store = OrderStore()
+        # (the scenarios can't use the other orders, see Scenario.namespace_size)
+        base_orders = [order for order in order_store.orders
+                       if order.order_id < NAMESPACE_SIZE and order.uuid < NAMESPACE_SIZE]
+        added_orders: List[Order] = []
+        for run in self.runs[1:]:
+            offset = run.namespace_index * NAMESPACE_SIZE
+            for base_order in base_orders:
+                if str(base_order.order_id + offset) not in order_store.order_per_order_id:
+                    order = Order.from_dict(base_order.to_dict())
+                    order.order_id += offset
+                    order.uuid += offset
+                    added_orders.append(order)
+        if added_orders:
+            order_store.set_orders(order_store.orders + added_orders)
+            order_store.save_orders()
+
+        return len(added_orders)
+
+    def route_message(self, message: FIXMessage, received_ns: int) -> None:
+        if len(self.runs) == 1:
+            self.runs[0].inbox.add(message, received_ns)
+            return
+
+        for tag in (FIX_CLIENTID_TAG50, FIX_ORDERID_TAG37):
+            value = message.message_dict.get(tag, None)
+            if value is not None and value.isdigit():
+                namespace_index = int(value) // NAMESPACE_SIZE
+                if namespace_index < len(self.runs):
+                    self.runs[namespace_index].inbox.add(message, received_ns)
+                    return
+        # not in any namespace
+        for run in self.runs:
+            run.inbox.add(message, received_ns)
+
+    async def run(self) -> bool:
+        seeded_count = self.seed_namespace_orders()
+        if seeded_count:
+            log("SCENARIO", f"Copied {seeded_count} order(s) into the namespaces of {len(self.runs) - 1} scenario(s)")
+        self.application.is_queueing_app_messages = False
+        self.application.add_message_listener(self.route_message)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*[self.run_scenario(run) for run in self.runs])
+        self.elapsed_secs = time.perf_counter() - start_time
+
+        self.log_report()
+        if self.results_file_path:
+            with open(self.results_file_path, 'w') as fp:
+                json.dump(self.get_results(), fp, indent=4)
+        is_passed = all(run.status == ScenarioStatus.PASSED for run in self.runs)
+        if self.is_exit_on_end and any(run.is_end_requested for run in self.runs):
+            exit(0 if is_passed else 1)
+
+        return is_passed
+
+    def log_report(self) -> None:
+        lines: List[str] = []
+        if len(self.runs) > 1:
+            passed_count = sum(1 for run in self.runs if run.status == ScenarioStatus.PASSED)
+            lines.extend(str(run) for run in self.runs)
+            lines.append(f"{passed_count}/{len(self.runs)} scenario(s) PASSED in {self.elapsed_secs:.3f}s "
+                         f"(vs {sum(run.elapsed_secs for run in self.runs):.3f}s one after the other)")
+        if self.latency_per_label:
+            lines.append("WAIT latencies since the triggering send:")
+            lines.extend('  ' + format_summary(label, histogram.summary(LATENCY_PERCENTILES))
+                         for label, histogram in self.latency_per_label.items())
+        if lines:
+            log("SCENARIOS", "\n".join(lines), '\n')
+
+    def get_results(self) -> Dict:
+        return {
+            'elapsed_secs': round(self.elapsed_secs, 3),
+            'scenarios': [run.to_dict() for run in self.runs],
+            'latency_us': {label: histogram.summary(LATENCY_PERCENTILES)
+                           for label, histogram in self.latency_per_label.items()},
+        }
+
+    def record_latency(self, run: ScenarioRun, action_line: ActionLine, received_ns: int) -> str:
+        triggering_send = run.get_triggering_send(received_ns)
+        if triggering_send is None:
+            return "no triggering send"
+        sent_ns, action = triggering_send
+        label = action_line.label if action_line.label else \
+            f"{action.value}->{pretty_kvs({k: v for k, v in action_line.key_values.items() if k in UNLABELED_KEYS})}"
+        histogram = self.latency_per_label.get(label, None)
+        if histogram is None:
+            histogram = self.latency_per_label[label] = LatencyHistogram()
+        latency_us = (received_ns - sent_ns) // 1000
+        histogram.record(latency_us)
+
+        return f"{latency_us}us since {action.value}"
+
+    async def run_scenario(self, run: ScenarioRun) -> bool:
+        scenario = run.scenario
+        run.status = ScenarioStatus.RUNNING
+        start_time = time.perf_counter()
+        # (the deadlines and sleeps follow the event loop's clock, which can be a virtual one)
+        run.start_time = asyncio.get_running_loop().time()
+        action_line = scenario.get_current_action_line()
+        while action_line:
+            if not action_line.has_been__processed():
+                processed = await self.process_action_line(run, action_line)
+                run.elapsed_secs = time.perf_counter() - start_time
+                if not processed:
+                    run.status = ScenarioStatus.FAILED
+                    run.failed_line_number = action_line.line_number
+                    log("SCENARIO", f"{scenario.scenario_file_path} FAILED at line:{action_line.line_number} after "
+                                    f"{run.step_count} step(s) in {run.elapsed_secs:.3f}s")
+                    return False
+                run.step_count += 1
+                if action_line.action == Action.END:
+                    run.is_end_requested = True
+                    break
+            if not scenario.ready_next_action_line():
+                break
+            action_line = scenario.get_current_action_line()
+
+        run.elapsed_secs = time.perf_counter() - start_time
+        run.status = ScenarioStatus.PASSED
+        log("SCENARIO", f"{scenario.scenario_file_path} completed {run.step_count} step(s) in {run.elapsed_secs:.3f}s")
+        return True
+
+    async def wait_for_message(self, run: ScenarioRun, message_kvs: Dict[str, str],
+                               timeout_secs: float) -> Tuple[FIXMessage, int] | None:
+        # Check the messages received so far then, until the timeout, each time a new one has been received
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_secs
+        while True:
+            seen_count = self.application.app_message_count
+            match = run.inbox.pop_match(message_kvs)
+            if match:
+                return match
+            remaining_secs = deadline - loop.time()
+            if remaining_secs <= 0 or not await self.application.wait_for_app_message(seen_count, remaining_secs):
+                inbox = run.inbox
+                log("NOT FOUND!!", f"searched:{pretty_kvs(message_kvs)} for {timeout_secs}s in {len(inbox)} received "
+                                   f"messages(s) (evicted:{inbox.evicted_count} expired:{inbox.expired_count})")
+                return None
+
+    async def process_action_line(self, run: ScenarioRun, action_line: ActionLine) -> bool:
+        application = self.application
+        action = action_line.action
+
+        log("ACTION PRC", f"Process action_line:{action_line}")
+        if action in TRIGGERING_ACTIONS:
+            run.record_send(action)
+
+        # commonly used below
+        client_id = action_line.get(FIX_CLIENTID_TAG50)
+        order_id = action_line.get(FIX_ORDERID_TAG37)
+        order_qty = action_line.get(FIX_ORDERQTY_TAG38)
+
+        if action == Action.REQUEST_IOI:
+            application.send_ioi_query(client_id)
+        elif action == Action.WAIT:
+            timeout_secs = action_line.timeout_secs if action_line.timeout_secs is not None else WAIT_TIMEOUT_SECS
+            match = await self.wait_for_message(run, action_line.key_values, timeout_secs)
+            if not match:
+                return False
+            _, received_ns = match
+            log("FOUND", f"{pretty_kvs(action_line.key_values)} | {self.record_latency(run, action_line, received_ns)}")
+        elif action == Action.RESERVE:
+            application.send_reserve_request(client_id, order_id, order_qty)
+        elif action == Action.ACK:
+            application.send_execution_report(client_id, order_id, order_qty, ExecutionReportType.NewAck)
+        elif action == Action.FILL:
+            application.send_execution_report(client_id, order_id, order_qty, ExecutionReportType.Filled)
+        elif action == Action.DFD:
+            application.send_execution_report(client_id, order_id, order_qty, ExecutionReportType.DFD)
+        elif action == Action.SLEEP:
+            if not await sleep(run, action_line):
+                return False
+        elif action == Action.CONTINUE:
+            log("ACTION", "Continue until killed")
+        elif action == Action.END:
+            log("ACTION", "End of scenario has been requested")
+
+        # OMS Order actions
+        elif action == Action.UPDATE_ORDER:
+            # import here, pandas is only needed by the scenarios updating orders
+            import pandas as pd
+            async with self.order_update_lock:
+                order_manager = self.get_order_manager()
+                previous_seq = order_manager.last_order_changes_seq
+                row = pd.Series(action_line.key_values)
+                outcome = order_manager.update_or_add_row(-1, row, True)
+                seq = order_manager.last_order_changes_seq
+                if seq != previous_seq:
+                    # wait for the server to have applied (and sent the messages for) the change
+                    timeout_secs = action_line.timeout_secs if action_line.timeout_secs is not None \
+                        else UPDATE_ORDER_ACK_TIMEOUT_SECS
+                    if not await wait_for_order_changes_ack(seq, timeout_secs):
+                        log("ERROR", f"The server didn't acknowledge the order changes seq:{seq} within "
+                                     f"{timeout_secs}s ({outcome})")
+                        return False
+
+        else:
+            log("ERROR", f"action:{action} is not supported in action_line:{action_line}")
+            return False
+
+        action_line.mark_as_processed()
+
+        return True
+
+
+async def sleep(run: ScenarioRun, action_line: ActionLine) -> bool:
+    # sleep secs=<n> or until=<n secs since the start of the scenario>
+    try:
+        if SLEEP_SECS_KEY in action_line.key_values:
+            sleep_secs = float(action_line.get(SLEEP_SECS_KEY))
+        else:
+            sleep_secs = run.start_time + float(action_line.get(SLEEP_UNTIL_KEY)) - asyncio.get_running_loop().time()
+    except (TypeError, ValueError):
+        log("ERROR", f"sleep needs a {SLEEP_SECS_KEY}= or an {SLEEP_UNTIL_KEY}= number of seconds")
+        return False
+    if sleep_secs > 0:
+        await asyncio.sleep(sleep_secs)
+
+    return True
+
+
+def create_scenarios(scenario_file_paths: List[str] | None, replay_log_file_paths: List[str] | None = None,
+                     client_comp_id: str | None = None, replay_speed: float = 1.0) -> List[Scenario]:
+    # import here, only needed to replay logs
+    from log_replay import LogConverter, LogScenario
+    scenarios: List[Scenario] = []
+    # (a single scenario can use any id)
+    namespace_size = NAMESPACE_SIZE if len(scenario_file_paths or []) + len(replay_log_file_paths or []) > 1 else None
+    for file_path in scenario_file_paths or []:
+        scenarios.append(Scenario(file_path, len(scenarios) * NAMESPACE_SIZE, namespace_size))
+    for log_file_path in replay_log_file_paths or []:
+        scenarios.append(LogScenario(log_file_path, LogConverter(client_comp_id, replay_speed),
+                                     len(scenarios) * NAMESPACE_SIZE, namespace_size))
+
+    return scenarios
+
+
+async def wait_for_order_changes_ack(seq: int, timeout_secs: float) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_secs
+    while OrderStore.read_applied_order_changes_seq() < seq:
+        if loop.time() >= deadline:
+            return False
+        await asyncio.sleep(ORDER_CHANGES_ACK_POLL_INTERVAL_SECS)
+
+    return True
+
+
+def pretty_kvs(kvs: Dict[str, str]) -> str:
+    return ' | '.join([f"{k}={v}" for k, v in kvs.items()])
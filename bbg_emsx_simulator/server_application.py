@@ -1,13 +1,19 @@
-import queue
 from enum import Enum
-from typing import Set, Dict
+from typing import Set, Dict, Callable, List
 
 import quickfix as fix
-from pandas import Series
 
+from async_runtime import LoopBridge
+from execution_ledger import ExecutionLedger
 from fix_application import FIXApplication, FIXMessage, get_utc_transactime, log, string_to_message, \
     create_fix_string_from_dict, LOG_MSGTYPE_RCVD_APP
-from order_manager import OrderManager
+from instrumentation import Instrumentation, get_public_method_names
+from models import Order, SIDES
+from order_store import OrderStore
+from outbound_throttle import OutboundThrottle, ThrottleConfig
+from server_metrics import ServerMetrics
+
+OUTBOUND_QUEUE_DEPTH_GAUGE = 'outbound_queue_depth'
 
 
 class MessageAction(Enum):
@@ -18,15 +24,35 @@ class MessageAction(Enum):
 
 
 class ServerApplication(fix.Application):
-    order_manager = None
+    order_store = None
     session_id = None
+    is_logged_on = False
     uuids_of_interest: Set[str] = set()
     oms_order_id_per_accepted_reserve_clordid: Dict[str, str] = dict()
+    outbound_throttle: OutboundThrottle = OutboundThrottle()
 
-    def __init__(self):
+    def __init__(self, throttle_config: ThrottleConfig | None = None, send_function: Callable | None = None):
+        # send_function(message, session_id) replaces quickfix's sendToTarget, e.g. for an in-process transport
         super().__init__()
-        self.order_manager = OrderManager()
-        self.from_app_queue = queue.Queue()
+        if throttle_config or send_function:
+            ServerApplication.outbound_throttle = OutboundThrottle(throttle_config,
+                                                                   send_function or fix.Session.sendToTarget)
+        self.order_store = OrderStore()
+        self.loop_bridge = LoopBridge()
+        self.execution_ledger = ExecutionLedger()
+        self.is_fill_flush_scheduled = False
+        # listener(direction, message) is called for each application message sent ('out') or received ('in'),
+        # on quickfix's threads. (without any, the sent messages aren't parsed)
+        self.message_listeners: List[Callable[[str, FIXMessage], None]] = []
+        # (its message rates and latencies are only recorded while the control API, that serves them, runs)
+        self.metrics = ServerMetrics()
+        self.order_store.metrics = self.metrics
+
+    def enable_instrumentation(self, instrumentation: Instrumentation) -> None:
+        # Times the quickfix application callbacks, the message handlers and the order store calls
+        instrumentation.instrument(self, 'ServerApplication',
+                                   ['fromApp', 'toApp'] + get_public_method_names(self, 'process_'))
+        instrumentation.instrument(self.order_store, 'OrderStore', get_public_method_names(self.order_store))
 
     def onCreate(self, session_id):
         # method mandated by parent class
@@ -34,10 +60,12 @@ class ServerApplication(fix.Application):
 
     def onLogon(self, session_id):
         ServerApplication.session_id = session_id
+        ServerApplication.is_logged_on = True
         log('SERVER Session',
             f"{session_id} logged on.<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<", '\n')
 
     def onLogout(self, session_id):
+        ServerApplication.is_logged_on = False
         log('SERVER Session',
             f"{session_id} logged out.>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>", '\n')
 
@@ -55,21 +83,26 @@ class ServerApplication(fix.Application):
 
     def toApp(self, message, session_id):
         log('Sent APP', message)
+        if self.message_listeners:
+            self.notify_message_listeners('out', FIXMessage(message))
 
     def fromApp(self, message, session_id):
         message = FIXMessage(message)
         log(LOG_MSGTYPE_RCVD_APP, message)
-        self.process_message(message)
+        if self.message_listeners:
+            self.notify_message_listeners('in', message)
+        self.loop_bridge.call_in_loop(self.process_message, message)
 
-    def process_message_from_app_queue(self):
-        if self.from_app_queue.not_empty:
-            try:
-                self.from_app_queue.get(block=True, timeout=1)
-            except queue.Empty:
-                return
+    def notify_message_listeners(self, direction: str, message: FIXMessage) -> None:
+        for listener in self.message_listeners:
+            listener(direction, message)
 
     def check_for_order_changes(self):
-        self.order_manager.check_and_process_order_change_instructions()
+        self.order_store.check_and_process_order_change_instructions()
+
+    def sample_metrics(self):
+        queue_depth = sum(stats['queue_depth'] for stats in ServerApplication.outbound_throttle.stats().values())
+        self.metrics.record_gauge(OUTBOUND_QUEUE_DEPTH_GAUGE, queue_depth)
 
     def process_message(self, message: FIXMessage) -> None:
         msg_type = message.get(fix.MsgType())
@@ -83,13 +116,13 @@ class ServerApplication(fix.Application):
     def process_ioi_message(self, message: FIXMessage):
         uuid = message.get(fix.SenderSubID())
         ServerApplication.uuids_of_interest.add(uuid)
-        uuid_orders = self.order_manager.get_orders_for_uuid(uuid)
+        uuid_orders = self.order_store.get_orders_for_uuid(uuid)
         for order in uuid_orders:
             ServerApplication.create_order_message(MessageAction.NewOrder, order, True, True)
 
     def process_reserve_request_message(self, message: FIXMessage):
         order_id = message.get(fix.OrderID())
-        current_qty = self.order_manager.get_order_shares(order_id)
+        current_qty = self.order_store.get_order_shares(order_id)
         if current_qty is not None:
             qty_to_reserve = int(message.get(fix.OrderQty()))
             corrected_qty = current_qty - qty_to_reserve
@@ -110,17 +143,32 @@ class ServerApplication(fix.Application):
             log("ERROR!!!", f"Can't find qty for order_id:{order_id}")
 
     def process_execution_report_message(self, message: FIXMessage):
-        # For now, only do something once we get a Fill or DFD
-        if (message.get(fix.OrdStatus()) == fix.OrdStatus_DONE_FOR_DAY or
-                message.get(fix.OrdStatus()) == fix.OrdStatus_FILLED):
-            clordid = message.get(fix.ClOrdID())
-            oms_order_id = self.oms_order_id_per_accepted_reserve_clordid.get(clordid,
-                                                                              f'?unknown oms_order_id for clordid:{clordid}')
-            # figure out the new qty
-            cum_qty = int(message.get(fix.CumQty()))
-            updated_qty = self.order_manager.update_order_shares(oms_order_id, -cum_qty)
+        clordid = message.get(fix.ClOrdID())
+        oms_order_id = self.oms_order_id_per_accepted_reserve_clordid.get(clordid, None)
+        if oms_order_id is None:
+            log(LOG_MSGTYPE_RCVD_APP, f"Error with order update. ?unknown oms_order_id for clordid:{clordid}")
+            return
+
+        # Each fill (LastShares) is applied exactly once. The order updates and 35=G are batched
+        if self.execution_ledger.record(oms_order_id, message):
+            self.schedule_fill_flush()
+
+    def schedule_fill_flush(self):
+        if self.loop_bridge.is_attached():
+            # Let all the execution reports already handed to the event loop be recorded before flushing
+            if not self.is_fill_flush_scheduled:
+                self.is_fill_flush_scheduled = True
+                self.loop_bridge.loop.call_soon(self.flush_fills)
+        else:
+            self.flush_fills()
+
+    def flush_fills(self):
+        self.is_fill_flush_scheduled = False
+        shares_increment_per_oms_order_id, correction_oms_order_ids = self.execution_ledger.drain()
+        self.order_store.update_orders_shares(shares_increment_per_oms_order_id)
+        for oms_order_id in correction_oms_order_ids:
+            updated_qty = self.order_store.get_order_shares(oms_order_id)
             if updated_qty is not None:
-                updated_qty = int(updated_qty)
                 self.send_correct_message(oms_order_id, updated_qty)
 
                 if updated_qty == 0:
@@ -178,12 +226,12 @@ class ServerApplication(fix.Application):
 
     @staticmethod
     def send_message(message: fix.Message):
-        fix.Session.sendToTarget(message, ServerApplication.session_id)
+        ServerApplication.outbound_throttle.send(message, ServerApplication.session_id)
 
     @staticmethod
     def side_str_to_fix(side: str) -> int:
-        if side in OrderManager.SIDES:
-            return OrderManager.SIDES[side]
+        if side in SIDES:
+            return SIDES[side]
         else:
             return 0
 
@@ -192,10 +240,10 @@ class ServerApplication(fix.Application):
         return str(uuid) in ServerApplication.uuids_of_interest
 
     @staticmethod
-    def create_order_message(action: MessageAction, message: Series | FIXMessage,
+    def create_order_message(action: MessageAction, message: Order | FIXMessage,
                              send_message: bool = False, save_message: bool = False) -> fix.Message:
-        if isinstance(message, Series):
-            # Initiated from the UI
+        if not isinstance(message, FIXMessage):
+            # Initiated from the UI (an Order or a pandas Series row)
             order_id = message['order_id']
             if action == MessageAction.NewOrder:
                 clordid = FIXApplication.get_next_clordid()
@@ -227,7 +275,7 @@ class ServerApplication(fix.Application):
         return message
 
     @staticmethod
-    def create_fix_string_from_series(order: Series, clordid: str) -> str:
+    def create_fix_string_from_series(order: Order, clordid: str) -> str:
         symbol = order['symbol']
         cusip = FIXApplication.KNOWN_SYMBOLS_BY_TICKER.get(symbol, f"??{symbol}??")
 
@@ -0,0 +1,139 @@
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+import quickfix as fix
+
+from fix_application import FIXMessage
+
+METRICS_WINDOW_SECS = 60
+LATENCY_SAMPLE_COUNT = 4096
+LATENCY_PERCENTILES: List[float] = [50.0, 90.0, 99.0]
+# Reserve requests waiting for their accept (or reject), the oldest are forgotten beyond that
+MAX_PENDING_RESERVES = 10000
+# The gauges keep the highest value sampled during each second
+METRICS_SAMPLE_INTERVAL_SECS = .1
+
+
+class RateRing:
+    # Per second counts of the last window_secs seconds, per key: one slot per second, reused every window_secs
+    def __init__(self, window_secs: int = METRICS_WINDOW_SECS):
+        self.window_secs = window_secs
+        self.second_per_slot = array('q', [-1] * window_secs)
+        self.counts_per_key: Dict[str, array] = {}
+
+    def get_slot(self, second: int) -> int:
+        slot = second % self.window_secs
+        if self.second_per_slot[slot] != second:
+            # a second that's now out of the window
+            self.second_per_slot[slot] = second
+            for counts in self.counts_per_key.values():
+                counts[slot] = 0
+        return slot
+
+    def increment(self, key: str, now: float, count: int = 1) -> None:
+        slot = self.get_slot(int(now))
+        counts = self.counts_per_key.get(key, None)
+        if counts is None:
+            counts = self.counts_per_key[key] = array('q', [0] * self.window_secs)
+        counts[slot] += count
+
+    def set_max(self, key: str, now: float, value: int) -> None:
+        # (a gauge: the highest value seen during the second)
+        slot = self.get_slot(int(now))
+        counts = self.counts_per_key.get(key, None)
+        if counts is None:
+            counts = self.counts_per_key[key] = array('q', [0] * self.window_secs)
+        counts[slot] = max(counts[slot], value)
+
+    def snapshot(self, now: float) -> Dict[str, List[int]]:
+        # The values of the last complete seconds, oldest first
+        seconds = range(int(now) - self.window_secs, int(now))
+        values_per_key: Dict[str, List[int]] = {}
+        for key, counts in self.counts_per_key.items():
+            values_per_key[key] = [counts[second % self.window_secs]
+                                   if self.second_per_slot[second % self.window_secs] == second else 0
+                                   for second in seconds]
+
+        return values_per_key
+
+
+class LatencyRing:
+    # The last `capacity` latencies with their time, percentiles are computed over the ones within the window
+    def __init__(self, capacity: int = LATENCY_SAMPLE_COUNT):
+        self.recorded_at = array('d', [0.0] * capacity)
+        self.values = array('d', [0.0] * capacity)
+        self.count = 0
+
+    def record(self, value: float, now: float) -> None:
+        i = self.count % len(self.values)
+        self.recorded_at[i] = now
+        self.values[i] = value
+        self.count += 1
+
+    def summary(self, now: float, window_secs: float = METRICS_WINDOW_SECS) -> Dict[str, float]:
+        since = now - window_secs
+        values = sorted(value for i, value in enumerate(self.values[:min(self.count, len(self.values))])
+                        if self.recorded_at[i] >= since)
+        summary: Dict[str, float] = {'count': len(values)}
+        for percentile in LATENCY_PERCENTILES:
+            summary[f"p{percentile:g}"] = round(values[min(int(len(values) * percentile / 100), len(values) - 1)]) \
+                if values else 0
+        summary['max'] = round(values[-1]) if values else 0
+
+        return summary
+
+
+class ServerMetrics:
+    # Rolling metrics of the server, in fixed size rings: messages per second per direction and MsgType, the
+    # reserve -> accept latency, the outbound queue depth and the order changes apply latency (in microseconds).
+    # on_message() is a ServerApplication message listener, it's called from several threads.
+    def __init__(self, window_secs: int = METRICS_WINDOW_SECS):
+        self.window_secs = window_secs
+        self.lock = threading.Lock()
+        self.message_rates = RateRing(window_secs)
+        self.gauges = RateRing(window_secs)
+        self.reserve_accept_latencies = LatencyRing()
+        self.order_changes_apply_latencies = LatencyRing()
+        self.reserve_received_at_per_clordid: Dict[str, float] = {}
+
+    def on_message(self, direction: str, message: FIXMessage) -> None:
+        now = time.time()
+        msg_type = message.get(fix.MsgType())
+        with self.lock:
+            self.message_rates.increment(f"{direction}:{msg_type}", now)
+            if msg_type == fix.MsgType_NewOrderSingle:
+                if direction == 'in':
+                    if len(self.reserve_received_at_per_clordid) >= MAX_PENDING_RESERVES:
+                        del self.reserve_received_at_per_clordid[next(iter(self.reserve_received_at_per_clordid))]
+                    self.reserve_received_at_per_clordid[message.get(fix.ClOrdID())] = now
+                elif message.get(fix.OrdStatus()) == fix.OrdStatus_NEW:
+                    # an accept, its ClientID is the ClOrdID of the reserve request
+                    received_at = self.reserve_received_at_per_clordid.pop(message.get(fix.ClientID()), None)
+                    if received_at is not None:
+                        self.reserve_accept_latencies.record((now - received_at) * 1e6, now)
+            elif msg_type == fix.MsgType_ExecutionReport and direction == 'out':
+                # a rejected reserve
+                self.reserve_received_at_per_clordid.pop(message.get(fix.ClOrdID()), None)
+
+    def record_order_changes_applied(self, requested_at: float) -> None:
+        now = time.time()
+        with self.lock:
+            self.order_changes_apply_latencies.record((now - requested_at) * 1e6, now)
+
+    def record_gauge(self, name: str, value: int) -> None:
+        with self.lock:
+            self.gauges.set_max(name, time.time(), value)
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        with self.lock:
+            return {
+                'window_secs': self.window_secs,
+                'time': now,
+                'messages_per_second': self.message_rates.snapshot(now),
+                'gauges': self.gauges.snapshot(now),
+                'reserve_accept_latency_us': self.reserve_accept_latencies.summary(now, self.window_secs),
+                'order_changes_apply_latency_us': self.order_changes_apply_latencies.summary(now, self.window_secs),
+            }
@@ -4,6 +4,8 @@ import streamlit as st
 from pandas import DataFrame
 from streamlit_autorefresh import st_autorefresh
 
+from control_api import ControlAPIClient
+from order_book_index import OrderQuery, DEFAULT_PAGE_SIZE, PAGE_SIZES, get_page_count
 from order_manager import OrderManager
 from fix_application import FIXApplication
 
@@ -37,6 +39,25 @@ def create_data_editor(orders_df: DataFrame) -> DataFrame:
     return edited_df
 
 
+def get_order_query(orders_df: DataFrame) -> OrderQuery:
+    # The data editor only gets one page of the orders, filtered and sorted here
+    st.sidebar.header('Orders')
+    uuid = st.sidebar.text_input('uuid', placeholder='all').strip()
+    symbol = st.sidebar.text_input('symbol', placeholder='all').strip()
+    is_active = st.sidebar.selectbox('is_active', [None, True, False],
+                                     format_func=lambda value: 'all' if value is None else str(value))
+    sort_by = st.sidebar.selectbox('sort by', [None] + list(orders_df.columns),
+                                   format_func=lambda value: 'file order' if value is None else value)
+    ascending = st.sidebar.checkbox('ascending', value=True)
+    page_size = st.sidebar.selectbox('rows per page', PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE))
+    if uuid and not uuid.isdigit():
+        st.sidebar.error(f"Invalid uuid:{uuid}")
+        uuid = ''
+
+    return OrderQuery(uuid=int(uuid) if uuid else None, symbol=symbol or None, is_active=is_active,
+                      sort_by=sort_by, ascending=ascending, page_size=page_size)
+
+
 def process_edited_added_rows(orders_df: DataFrame, edited_df: DataFrame) -> None:
     edited_rows = st.session_state[GRID_KEY]["edited_rows"]
     added_rows = st.session_state[GRID_KEY]["added_rows"]
@@ -51,11 +72,12 @@ def process_edited_added_rows(orders_df: DataFrame, edited_df: DataFrame) -> Non
             valid_change_count -= 1
 
     if valid_change_count:
-        order_manager.orders_df = edited_df
-        order_manager.save_orders()
-
-        order_manager.save_order_change_instructions(st.session_state[GRID_KEY])
-        st.success('Orders saved/sent successfully!')
+        # (orders_df is a page of the orders)
+        seq = order_manager.save_page_changes(orders_df, edited_df, st.session_state[GRID_KEY])
+        if order_manager.control_api_client:
+            st.success(f'Orders saved/sent successfully! (applied by the server, seq:{seq})')
+        else:
+            st.success('Orders saved/sent successfully!')
     else:
         if initial_change_count != 1:
             st.warning('No valid order left to save/send')
@@ -73,10 +95,15 @@ def main(order_manager: OrderManager) -> None:
     st.set_page_config(layout="wide")
 #    count = st_autorefresh(interval=2000, limit=100, key="fizzbuzzcounter")
 
-    orders_df = order_manager.orders_df
+    order_query = get_order_query(order_manager.orders_df)
+    page_df, row_count = order_manager.query_orders(order_query)
+    page_count = get_page_count(row_count, order_query.page_size)
+    order_query.page = st.sidebar.number_input(f'page (of {page_count})', min_value=1, max_value=page_count,
+                                               value=1) - 1
+    orders_df, _ = order_manager.query_orders(order_query)
     last_update = order_manager.get_file_timestamp()
     st.title('OMS Order Management')
-    st.write(f'(Last updated {last_update})')
+    st.write(f'(Last updated {last_update}) {row_count} order(s), page {order_query.page + 1}/{page_count}')
 
 #    st.write(f"Count:{count}")
     edited_df = create_data_editor(orders_df)
@@ -107,5 +134,7 @@ def main(order_manager: OrderManager) -> None:
 
 if __name__ == "__main__":
     order_manager = OrderManager()
+    # The order changes go straight to the server, through its API, when it's up
+    order_manager.control_api_client = ControlAPIClient.connect_if_running()
 
     main(order_manager)
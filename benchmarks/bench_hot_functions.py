@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_DIR = os.path.join(REPO_DIR, 'bbg_emsx_simulator')
+sys.path[:0] = [PACKAGE_DIR, REPO_DIR]
+
+import pandas as pd
+import quickfix as fix
+
+from fix_application import FIXMessage, string_to_message, set_logging_enabled
+from load_generator import LoadProfile, generate_order_book
+from models import Order
+from order_manager import OrderManager
+from order_store import OrderStore
+from scenario import Scenario
+from server_application import ServerApplication
+
+BOOK_SIZES = [1_000, 100_000, 1_000_000]
+ORDERS_PER_UUID = 10
+# The per message functions don't depend on the size of the book, they're timed over (up to) that many of its orders
+MESSAGE_SAMPLE_SIZE = 1_000
+# Each sample calls the function enough times to last at least that long...
+MIN_SAMPLE_SECS = .05
+# ...and a benchmark stops taking samples after that long (with at least one sample)
+DEFAULT_MAX_SECS = 10.0
+DEFAULT_REPEAT = 5
+# Slower/faster than the baseline beyond that ratio of its median
+DEFAULT_THRESHOLD = .1
+# The scenario has one line per order of the book, cycling through these
+SCENARIO_LINE_TEMPLATES = [
+    'reserve uuid={uuid} orderid={order_id} qty=100',
+    'wait uuid={uuid} orderid={order_id} 35=D 39=0 qty=100 label="BBG accepted reserve request"',
+    'fill uuid={uuid} orderid={order_id} qty=100',
+    'update_order order_id={order_id} shares=10000',
+]
+SCENARIO_FILE_NAME = 'bench_scenario.txt'
+
+# Returns the function to time and the number of operations it does per call. Called in a directory holding the
+# orders file (and the scenario file), with the orders of that file
+BenchmarkSetup = Callable[[List[Order]], Tuple[Callable[[], object], int]]
+
+
+def create_order_messages(orders: List[Order]) -> List[fix.Message]:
+    return [string_to_message(fix.MsgType_NewOrderSingle, ServerApplication.create_fix_string_from_series(order, '1'))
+            for order in orders[:MESSAGE_SAMPLE_SIZE]]
+
+
+def setup_message_to_dict(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    messages = create_order_messages(orders)
+    return lambda: [FIXMessage.message_to_dict(message) for message in messages], len(messages)
+
+
+def setup_string_to_message(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    fix_strings = [ServerApplication.create_fix_string_from_series(order, '1') for order in orders[:MESSAGE_SAMPLE_SIZE]]
+    return lambda: [string_to_message(fix.MsgType_NewOrderSingle, fix_string) for fix_string in fix_strings], \
+        len(fix_strings)
+
+
+def setup_create_fix_string_from_series(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    sample_orders = orders[:MESSAGE_SAMPLE_SIZE]
+    return lambda: [ServerApplication.create_fix_string_from_series(order, '1') for order in sample_orders], \
+        len(sample_orders)
+
+
+def setup_get_row_index_for_order_id(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    order_manager = OrderManager()
+    order_id = str(orders[len(orders) // 2].order_id)
+    # (it re-reads the orders file every time)
+    return lambda: order_manager.get_row_index_for_order_id(order_id), 1
+
+
+def setup_update_order_shares(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    order_manager = OrderManager()
+    order_id = str(orders[len(orders) // 2].order_id)
+    # (alternately up and down so that the book stays the same, it reads and saves the orders file every time)
+    increments = itertools.cycle([1, -1])
+    return lambda: order_manager.update_order_shares(order_id, next(increments)), 1
+
+
+def setup_get_orders_for_uuid(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    order_manager = OrderManager()
+    uuid = str(orders[len(orders) // 2].uuid)
+    return lambda: order_manager.get_orders_for_uuid(uuid), 1
+
+
+def setup_scenario_parsing(orders: List[Order]) -> Tuple[Callable[[], object], int]:
+    # Compiling the scenario file and expanding all its action lines
+    with open(SCENARIO_FILE_NAME, 'w') as fp:
+        for template, order in zip(itertools.cycle(SCENARIO_LINE_TEMPLATES), orders):
+            fp.write(template.format(uuid=order.uuid, order_id=order.order_id) + '\n')
+    return lambda: sum(1 for _ in Scenario(SCENARIO_FILE_NAME).iter_action_lines()), len(orders)
+
+
+BENCHMARKS: Dict[str, BenchmarkSetup] = {
+    'FIXMessage.message_to_dict': setup_message_to_dict,
+    'string_to_message': setup_string_to_message,
+    'ServerApplication.create_fix_string_from_series': setup_create_fix_string_from_series,
+    'OrderManager.get_row_index_for_order_id': setup_get_row_index_for_order_id,
+    'OrderManager.update_order_shares': setup_update_order_shares,
+    'OrderManager.get_orders_for_uuid': setup_get_orders_for_uuid,
+    'Scenario parsing': setup_scenario_parsing,
+}
+
+
+def time_function(function: Callable[[], object], repeat: int, max_secs: float) -> Tuple[List[float], int]:
+    # The durations of (up to) repeat samples of `number` calls each, and that number
+    start_time = time.perf_counter()
+    function()
+    first_call_secs = time.perf_counter() - start_time
+    number = max(1, int(MIN_SAMPLE_SECS / max(first_call_secs, 1e-9)))
+    if first_call_secs > max_secs:
+        # (too slow to be called again, the first call is the only sample)
+        return [first_call_secs], 1
+
+    durations: List[float] = []
+    deadline = time.perf_counter() + max_secs
+    while len(durations) < repeat and (not durations or time.perf_counter() < deadline):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        durations.append(time.perf_counter() - start_time)
+
+    return durations, number
+
+
+def run_benchmark(name: str, size: int, orders: List[Order], repeat: int, max_secs: float) -> Dict:
+    function, operation_count = BENCHMARKS[name](orders)
+    # (some of them print what they do)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        durations, number = time_function(function, repeat, max_secs)
+    per_operation_us = [duration / number / operation_count * 1e6 for duration in durations]
+
+    return {
+        'name': name,
+        'size': size,
+        'operations_per_call': operation_count,
+        'calls_per_sample': number,
+        'samples': len(durations),
+        'per_call_ms': statistics.median(durations) / number * 1000,
+        'min_us': min(per_operation_us),
+        'median_us': statistics.median(per_operation_us),
+        'max_us': max(per_operation_us),
+    }
+
+
+def get_git_revision() -> Dict[str, str | bool | None]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        is_dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                                       check=True, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'is_dirty': None}
+
+    return {'commit': commit, 'is_dirty': is_dirty}
+
+
+def run(sizes: List[int], names: List[str], repeat: int, max_secs: float) -> Dict:
+    results: List[Dict] = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            for size in sizes:
+                profile = LoadProfile(uuid_count=max(size // ORDERS_PER_UUID, 1), orders_per_uuid=ORDERS_PER_UUID)
+                generate_order_book(profile, OrderStore.ORDERS_FILE_PATH)
+                orders = OrderStore().orders
+                for name in names:
+                    result = run_benchmark(name, len(orders), orders, repeat, max_secs)
+                    print_result(result)
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+
+    return {
+        'git': get_git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def print_result(result: Dict) -> None:
+    print(f"{result['name']:<48} {result['size']:>9,}  median:{result['median_us']:12.3f}µs/op  "
+          f"min:{result['min_us']:12.3f}µs/op  ({result['samples']}x{result['calls_per_sample']} call(s) of "
+          f"{result['operations_per_call']:,} op(s), {result['per_call_ms']:.2f}ms/call)")
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> int:
+    # Prints the median of each benchmark against the baseline's, returns the number of regressions
+    baseline_result_per_key = {(result['name'], result['size']): result for result in baseline['results']}
+    print(f"\nBaseline: {baseline['git']['commit']} ({baseline['time']})  current: {current['git']['commit']} "
+          f"({current['time']})")
+    regressions = 0
+    for result in current['results']:
+        baseline_result = baseline_result_per_key.get((result['name'], result['size']), None)
+        if baseline_result is None:
+            continue
+        ratio = result['median_us'] / baseline_result['median_us']
+        if ratio > 1 + threshold:
+            verdict = 'SLOWER'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        print(f"{result['name']:<48} {result['size']:>9,}  {baseline_result['median_us']:12.3f} -> "
+              f"{result['median_us']:12.3f}µs/op  x{ratio:6.2f}  {verdict}")
+
+    return regressions
+
+
+def load_results(file_path: str) -> Dict:
+    with open(file_path) as fp:
+        return json.load(fp)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                 description="Time the simulator's hot functions at several order book sizes")
+    ap.add_argument('-s', '--sizes', type=int, nargs='+', default=BOOK_SIZES, help="Order book sizes")
+    ap.add_argument('-b', '--benchmarks', type=str, nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                    metavar='NAME', help=f"Benchmarks to run, among: {', '.join(BENCHMARKS)}")
+    ap.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT, help="Samples per benchmark")
+    ap.add_argument('-m', '--max_secs', type=float, default=DEFAULT_MAX_SECS,
+                    help="Stop sampling a benchmark after that long")
+    ap.add_argument('-o', '--output', type=str, help="Optional JSON file to save the results to")
+    ap.add_argument('-c', '--compare', type=str, help="JSON results (e.g. of another commit) to compare with")
+    ap.add_argument('--compare_only', type=str, nargs=2, metavar=('BASELINE', 'CURRENT'),
+                    help="Compare two saved JSON results without running anything")
+    ap.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                    help="Median ratio beyond which a benchmark counts as slower/faster")
+
+    return ap.parse_args()
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    if cli_args.compare_only:
+        exit(1 if compare(*[load_results(file_path) for file_path in cli_args.compare_only], cli_args.threshold) else 0)
+
+    set_logging_enabled(False)
+    baseline_results = load_results(cli_args.compare) if cli_args.compare else None
+    current_results = run(cli_args.sizes, cli_args.benchmarks, cli_args.repeat, cli_args.max_secs)
+    if cli_args.output:
+        with open(cli_args.output, 'w') as fp:
+            json.dump(current_results, fp, indent=4)
+    if baseline_results:
+        exit(1 if compare(baseline_results, current_results, cli_args.threshold) else 0)
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_DIR = os.path.join(REPO_DIR, 'bbg_emsx_simulator')
+
+# modules to import -> what it represents
+MODULES_TO_IMPORT: Dict[str, str] = {
+    'quickfix': 'quickfix alone (lower bound)',
+    'server_application': 'FIX server core with the lean order store',
+    'server_application, order_manager': 'FIX server core + pandas OrderManager (previous server startup)',
+}
+
+
+def time_cold_import(module: str) -> float:
+    # A fresh interpreter each time so that nothing is cached in sys.modules
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGE_DIR, REPO_DIR, env.get('PYTHONPATH', '')])
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, '-c', code], env=env, cwd=REPO_DIR, check=True,
+                            capture_output=True, text=True).stdout
+
+    return float(output.strip().splitlines()[-1])
+
+
+def time_interpreter_start() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - start
+
+
+def run(repeat: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for module, description in MODULES_TO_IMPORT.items():
+        timings: List[float] = [time_cold_import(module) for _ in range(repeat)]
+        results[module] = {
+            'description': description,
+            'min_ms': min(timings) * 1000,
+            'median_ms': statistics.median(timings) * 1000,
+            'max_ms': max(timings) * 1000,
+        }
+        imported_modules = subprocess.run(
+            [sys.executable, '-c', f"import sys; import {module}; print('pandas' in sys.modules)"],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE_DIR, REPO_DIR])), cwd=REPO_DIR,
+            capture_output=True, text=True).stdout.strip()
+        results[module]['imports_pandas'] = imported_modules == 'True'
+
+    return results
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                 description="Measure the cold import time of the FIX server core")
+    ap.add_argument('-r', '--repeat', type=int, default=5, help="Number of cold imports per module")
+    ap.add_argument('-o', '--output', type=str, help="Optional JSON file to save the results to")
+
+    return ap.parse_args()
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    results = run(cli_args.repeat)
+    print(f"Interpreter start: {time_interpreter_start() * 1000:.1f}ms")
+    for module, result in results.items():
+        print(f"{module:<35} median:{result['median_ms']:8.1f}ms  min:{result['min_ms']:8.1f}ms  "
+              f"max:{result['max_ms']:8.1f}ms  pandas:{result['imports_pandas']!s:<5}  ({result['description']})")
+    if cli_args.output:
+        with open(cli_args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
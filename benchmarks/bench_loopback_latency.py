@@ -0,0 +1,171 @@
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_DIR = os.path.join(REPO_DIR, 'bbg_emsx_simulator')
+sys.path[:0] = [PACKAGE_DIR, REPO_DIR]
+
+from latency_histogram import format_summary
+from load_generator import LoadProfile, generate_order_book, LATENCY_RESERVE_TO_ACCEPT, LATENCY_FILL_TO_CORRECTION, \
+    FLOW_FILL
+
+BOOK_SIZES = [1_000, 10_000, 100_000]
+CONCURRENCIES = [1, 10, 100]
+DEFAULT_FLOW_COUNT = 1000
+# Fill flows: reserve -> accept, then fill -> correction
+DEFAULT_MIX = f"{FLOW_FILL}=1"
+MAX_ORDERS_PER_UUID = 10
+# Different from the config files' so that the benchmark doesn't clash with a running server
+DEFAULT_PORT = 9977
+SERVER_STARTED_LINE = 'FIX Server started.'
+DEFAULT_SERVER_START_TIMEOUT_SECS = 120
+DEFAULT_MAX_RUN_SECS = 300
+# The files the server and the client need in their working directory
+CONFIG_FILE_NAMES = ['server.cfg', 'client.cfg', 'FIX42_BBG.xml']
+
+
+def write_config_file(file_name: str, work_dir: str, port: int) -> None:
+    # The repo's config file with the benchmark's port and without the control API
+    with open(os.path.join(REPO_DIR, file_name)) as fp:
+        config = fp.read()
+    config = re.sub(r'^(SocketAcceptPort|SocketConnectPort)=.*$', rf'\g<1>={port}', config, flags=re.MULTILINE)
+    config = re.sub(r'^ControlApiPort=.*$', 'ControlApiPort=0', config, flags=re.MULTILINE)
+    with open(os.path.join(work_dir, file_name), 'w') as fp:
+        fp.write(config)
+
+
+def get_load_profile(concurrency: int, flow_count: int, max_run_secs: float) -> LoadProfile:
+    # One flow in flight per order of the profile
+    orders_per_uuid = min(concurrency, MAX_ORDERS_PER_UUID)
+    return LoadProfile(uuid_count=math.ceil(concurrency / orders_per_uuid), orders_per_uuid=orders_per_uuid,
+                       flows_per_sec=0, flow_count=flow_count, duration_secs=max_run_secs)
+
+
+def start_server(work_dir: str, timeout_secs: float) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE_DIR, REPO_DIR]))
+    with open(os.path.join(work_dir, 'server.out'), 'w') as fp:
+        server = subprocess.Popen([sys.executable, '-u', os.path.join(PACKAGE_DIR, 'fix_server.py'), 'server.cfg'],
+                                  cwd=work_dir, env=env, stdout=fp, stderr=subprocess.STDOUT)
+    # (it only starts accepting connections once the orders are loaded)
+    deadline = time.monotonic() + timeout_secs
+    while time.monotonic() < deadline and server.poll() is None:
+        with open(os.path.join(work_dir, 'server.out')) as fp:
+            if SERVER_STARTED_LINE in fp.read():
+                return server
+        time.sleep(.1)
+    stop_server(server)
+    raise RuntimeError(f"The server didn't start, see {os.path.join(work_dir, 'server.out')}")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    if server.poll() is None:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def run_client(work_dir: str, profile: LoadProfile, mix: str, max_run_secs: float) -> Dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE_DIR, REPO_DIR]))
+    results_file_path = os.path.join(work_dir, 'load_results.json')
+    with open(os.path.join(work_dir, 'client.out'), 'w') as fp:
+        subprocess.run([sys.executable, '-u', os.path.join(PACKAGE_DIR, 'fix_client.py'), 'client.cfg', '--load',
+                        '--uuids', str(profile.uuid_count), '--orders_per_uuid', str(profile.orders_per_uuid),
+                        '--rate', '0', '--flows', str(profile.flow_count), '--duration', str(profile.duration_secs),
+                        '--mix', mix, '--results_json', results_file_path],
+                       cwd=work_dir, env=env, stdout=fp, stderr=subprocess.STDOUT,
+                       timeout=max_run_secs + DEFAULT_SERVER_START_TIMEOUT_SECS)
+    if not os.path.exists(results_file_path):
+        raise RuntimeError(f"The client didn't save its results, see {os.path.join(work_dir, 'client.out')}")
+    with open(results_file_path) as fp:
+        return json.load(fp)
+
+
+def run_one(book_size: int, concurrency: int, flow_count: int, mix: str, port: int, max_run_secs: float,
+            keep_dir: bool) -> Dict:
+    profile = get_load_profile(concurrency, flow_count, max_run_secs)
+    work_dir = tempfile.mkdtemp(prefix=f"bench_loopback_{book_size}_{concurrency}_")
+    try:
+        for file_name in CONFIG_FILE_NAMES:
+            if file_name.endswith('.cfg'):
+                write_config_file(file_name, work_dir, port)
+            else:
+                shutil.copy(os.path.join(REPO_DIR, file_name), work_dir)
+        profile_order_count = profile.uuid_count * profile.orders_per_uuid
+        generate_order_book(profile, os.path.join(work_dir, 'oms_orders.csv'),
+                            background_order_count=max(book_size - profile_order_count, 0))
+        server = start_server(work_dir, DEFAULT_SERVER_START_TIMEOUT_SECS)
+        try:
+            load_results = run_client(work_dir, profile, mix, max_run_secs)
+        finally:
+            stop_server(server)
+    finally:
+        if not keep_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'book_size': max(book_size, profile_order_count),
+        'concurrency': profile_order_count,
+        'flows': flow_count,
+        'elapsed_secs': load_results['elapsed_secs'],
+        'completed_flows_per_sec': load_results['completed_flows_per_sec'],
+        'counters': load_results['counters'],
+        'latency_us': load_results['latency_us'],
+        'work_dir': work_dir if keep_dir else None,
+    }
+
+
+def print_result(result: Dict) -> None:
+    print(f"\nBook:{result['book_size']:,} order(s)  concurrency:{result['concurrency']}  "
+          f"completed flows/sec:{result['completed_flows_per_sec']}  ({result['elapsed_secs']}s)")
+    print('  ' + '  '.join(f"{k}:{v}" for k, v in result['counters'].items()))
+    for name in [LATENCY_RESERVE_TO_ACCEPT, LATENCY_FILL_TO_CORRECTION]:
+        summary = result['latency_us'].get(name, None)
+        if summary:
+            print('  ' + format_summary(name, summary))
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                 description="Run the FIX server and a load generating client on localhost and "
+                                             "measure the reserve->accept and fill->correction latencies and the "
+                                             "sustained throughput for several book sizes and concurrencies")
+    ap.add_argument('-b', '--book_sizes', type=int, nargs='+', default=BOOK_SIZES,
+                    help="Number of orders of the server's book")
+    ap.add_argument('-c', '--concurrencies', type=int, nargs='+', default=CONCURRENCIES,
+                    help="Number of orders with a flow in flight at any time (rounded up to whole uuids)")
+    ap.add_argument('-n', '--flows', type=int, default=DEFAULT_FLOW_COUNT, help="Flows per run")
+    ap.add_argument('--mix', type=str, default=DEFAULT_MIX, help="Flow mix weights, see fix_client.py --mix")
+    ap.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port the server listens on")
+    ap.add_argument('--max_run_secs', type=float, default=DEFAULT_MAX_RUN_SECS,
+                    help="Each run stops after that long even if it hasn't completed its flows")
+    ap.add_argument('--keep', action='store_true', help="Keep the working directory (logs, outputs) of each run")
+    ap.add_argument('-o', '--output', type=str, help="Optional JSON file to save the results to")
+
+    return ap.parse_args()
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    results: List[Dict] = []
+    for size in cli_args.book_sizes:
+        for concurrency_count in cli_args.concurrencies:
+            result = run_one(size, concurrency_count, cli_args.flows, cli_args.mix, cli_args.port,
+                             cli_args.max_run_secs, cli_args.keep)
+            print_result(result)
+            results.append(result)
+    if cli_args.output:
+        with open(cli_args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
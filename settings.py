@@ -1,5 +1,30 @@
+from typing import Dict, List
+
 import quickfix as fix
 
 def get_settings(config_file):
     settings = fix.SessionSettings(config_file)
-    return settings
\ No newline at end of file
+    return settings
+
+
+def get_session_settings_dicts(config_file) -> List[Dict[str, str]]:
+    # quickfix's python bindings can't enumerate the sessions (getSessions() isn't iterable) so read them directly.
+    # Each [SESSION] dictionary includes the [DEFAULT] values it doesn't override.
+    default_settings: Dict[str, str] = {}
+    session_settings_dicts: List[Dict[str, str]] = []
+    current_settings = None
+    with open(config_file) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.upper() == '[DEFAULT]':
+                current_settings = default_settings
+            elif line.upper() == '[SESSION]':
+                current_settings = {}
+                session_settings_dicts.append(current_settings)
+            elif '=' in line and current_settings is not None:
+                key, value = line.split('=', 1)
+                current_settings[key.strip()] = value.strip()
+
+    return [dict(default_settings, **session_settings) for session_settings in session_settings_dicts]
@@ -0,0 +1,7 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_DIR = os.path.join(REPO_DIR, 'bbg_emsx_simulator')
+# The modules import each other by name (settings.py lives at the repo root), as when run from the package directory
+sys.path[:0] = [PACKAGE_DIR, REPO_DIR]
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+from checkpoint import ServerCheckpoint
+from fix_application import FIXApplication
+from fix_log import FIX_SEPARATOR, LOG_TIMESTAMP_SEPARATOR
+from server_application import ServerApplication
+
+SERVER_COMP_ID = 'FIXSERVER'
+CLIENT_COMP_ID = 'FIXCLIENT'
+
+
+@pytest.fixture
+def server_dir(tmp_path, monkeypatch):
+    # (the server's state is class attributes)
+    monkeypatch.chdir(tmp_path)
+    for cls, name in [(ServerApplication, 'uuids_of_interest'),
+                      (ServerApplication, 'oms_order_id_per_accepted_reserve_clordid'),
+                      (FIXApplication, 'latest_clordid_per_oms_order_id'),
+                      (FIXApplication, 'latest_fix_message_per_oms_order_id')]:
+        monkeypatch.setattr(cls, name, type(getattr(cls, name))())
+    (tmp_path / 'oms_orders.csv').write_text('order_id,is_active,uuid,symbol,side,shares,price\n'
+                                             '456,True,1234,BOOM,Buy,1000,12.34\n'
+                                             '457,True,1234,CAKE,Sell,20000,0\n')
+    (tmp_path / 'log').mkdir()
+    return tmp_path
+
+
+def append_log_messages(file_path, messages):
+    with open(file_path, 'a') as fp:
+        for fields in messages:
+            fix_string = FIX_SEPARATOR.join(f"{tag}={value}" for tag, value in fields.items())
+            fp.write(f"20261019-10:00:00.000{LOG_TIMESTAMP_SEPARATOR}8=FIX.4.2{FIX_SEPARATOR}{fix_string}"
+                     f"{FIX_SEPARATOR}10=000{FIX_SEPARATOR}\n")
+
+
+def accept(clordid, order_id):
+    return {'35': 'D', '49': SERVER_COMP_ID, '56': CLIENT_COMP_ID, '11': clordid, '37': order_id, '39': '0',
+            '109': f"REQ{clordid}"}
+
+
+def fill(clordid, exec_id, last_shares, ord_status):
+    return {'35': '8', '49': CLIENT_COMP_ID, '56': SERVER_COMP_ID, '11': clordid, '17': exec_id,
+            '32': str(last_shares), '39': ord_status}
+
+
+async def save_once(checkpoint):
+    run_task = asyncio.create_task(checkpoint.run())
+    await asyncio.sleep(.5)
+    run_task.cancel()
+
+
+def test_restore_replays_the_log_written_after_the_checkpoint(server_dir, monkeypatch):
+    log_file_path = str(server_dir / 'log' / f"FIX.4.2-{SERVER_COMP_ID}-{CLIENT_COMP_ID}.messages.current.log")
+    checkpoint_file_path = str(server_dir / 'store' / 'checkpoint.json')
+    append_log_messages(log_file_path, [accept('ACC1', '456'), fill('ACC1', 'E1', 100, '1'),
+                                        accept('ACC2', '457'), fill('ACC2', 'E2', 300, '2')])
+    checkpoint = ServerCheckpoint(ServerApplication(), {log_file_path: SERVER_COMP_ID}, checkpoint_file_path, 60)
+    checkpoint.restore()
+    asyncio.run(save_once(checkpoint))
+
+    with open(checkpoint_file_path) as fp:
+        state = json.load(fp)
+    # (ACC2 is filled)
+    assert state['fills_per_clordid'] == {'ACC1': ['456', 100, ['E1']]}
+
+    # after the checkpoint, then a restart
+    append_log_messages(log_file_path, [fill('ACC1', 'E3', 50, '1'), fill('ACC1', 'E1', 100, '1'),
+                                        accept('ACC3', '457')])
+    monkeypatch.setattr(ServerApplication, 'oms_order_id_per_accepted_reserve_clordid', {})
+    application = ServerApplication()
+    assert ServerCheckpoint(application, {log_file_path: SERVER_COMP_ID}, checkpoint_file_path, 60).restore()
+
+    ledger = application.execution_ledger
+    # (replayed from the checkpoint on, ACC2's fill is before it)
+    assert 'ACC2' not in ledger.closed_fills_per_clordid
+    assert list(ledger.fills_per_clordid) == ['ACC1']
+    assert ledger.fills_per_clordid['ACC1'].cum_qty == 150
+    assert list(ledger.fills_per_clordid['ACC1'].exec_ids) == ['E1', 'E3']
+    assert ledger.duplicate_count == 1
+    assert ServerApplication.oms_order_id_per_accepted_reserve_clordid == {'ACC1': '456', 'ACC2': '457',
+                                                                          'ACC3': '457'}
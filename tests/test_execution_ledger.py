@@ -0,0 +1,71 @@
+import quickfix as fix
+
+import execution_ledger
+from execution_ledger import ExecutionLedger
+from fix_application import FIXMessage
+
+
+def execution_report(clordid: str, exec_id: str | None, ord_status: str, last_shares: int | None = None,
+                     cum_qty: int | None = None) -> FIXMessage:
+    message = FIXMessage({'35': fix.MsgType_ExecutionReport, '11': clordid, '39': ord_status})
+    message.set(fix.ExecID(), exec_id)
+    message.set(fix.LastShares(), None if last_shares is None else str(last_shares))
+    message.set(fix.CumQty(), None if cum_qty is None else str(cum_qty))
+    return message
+
+
+def test_a_duplicate_exec_id_is_applied_once():
+    ledger = ExecutionLedger()
+
+    assert ledger.record('456', execution_report('ID1', 'E1', fix.OrdStatus_PARTIALLY_FILLED, 100, 100))
+    assert not ledger.record('456', execution_report('ID1', 'E1', fix.OrdStatus_PARTIALLY_FILLED, 100, 100))
+
+    assert ledger.duplicate_count == 1
+    assert ledger.drain() == ({'456': -100}, {'456'})
+
+
+def test_last_shares_or_the_cum_qty_delta():
+    ledger = ExecutionLedger()
+
+    ledger.record('456', execution_report('ID1', 'E1', fix.OrdStatus_PARTIALLY_FILLED, 100, 100))
+    # (no LastShares, the delta from what's been applied)
+    ledger.record('456', execution_report('ID1', 'E2', fix.OrdStatus_PARTIALLY_FILLED, None, 250))
+    # (LastShares wins over an inconsistent CumQty)
+    ledger.record('456', execution_report('ID1', 'E3', fix.OrdStatus_PARTIALLY_FILLED, 50, 1000))
+    # (a CumQty going backwards applies nothing)
+    assert not ledger.record('456', execution_report('ID1', 'E4', fix.OrdStatus_PARTIALLY_FILLED, None, 200))
+
+    assert ledger.fills_per_clordid['ID1'].cum_qty == 300
+    assert ledger.drain() == ({'456': -300}, {'456'})
+
+
+def test_a_terminal_clordid_is_closed_and_still_catches_resends(monkeypatch):
+    monkeypatch.setattr(execution_ledger, 'MAX_CLOSED_CLORDID_EXEC_IDS', 2)
+    ledger = ExecutionLedger()
+    for i in range(3):
+        ledger.record('456', execution_report('ID1', f"E{i}", fix.OrdStatus_PARTIALLY_FILLED, 100))
+    ledger.record('456', execution_report('ID1', 'E3', fix.OrdStatus_FILLED, 100))
+    ledger.drain()
+
+    assert 'ID1' not in ledger.fills_per_clordid
+    closed_fills = ledger.closed_fills_per_clordid['ID1']
+    assert closed_fills.cum_qty == 400
+    assert list(closed_fills.exec_ids) == ['E2', 'E3']
+    # late resend
+    assert not ledger.record('456', execution_report('ID1', 'E3', fix.OrdStatus_FILLED, 100))
+    assert ledger.drain() == ({}, set())
+
+
+def test_the_closed_clordids_are_bounded(monkeypatch):
+    monkeypatch.setattr(execution_ledger, 'MAX_CLOSED_CLORDIDS', 3)
+    ledger = ExecutionLedger()
+    for i in range(5):
+        ledger.record('456', execution_report(f"ID{i}", f"E{i}", fix.OrdStatus_FILLED, 100))
+
+    assert list(ledger.closed_fills_per_clordid) == ['ID2', 'ID3', 'ID4']
+    assert ledger.fills_per_clordid == {}
+
+    # and they expire
+    monkeypatch.setattr(execution_ledger, 'CLOSED_CLORDID_TTL_SECS', 0)
+    ledger.record('456', execution_report('ID5', 'E5', fix.OrdStatus_CANCELED))
+    assert list(ledger.closed_fills_per_clordid) == ['ID5']
@@ -0,0 +1,41 @@
+from log_index import LogIndex, parse_search_query
+
+LINE = "20261019-10:00:00.000 : 8=FIX.4.2\x0135=8\x0137={order_id}\x0111=ID{line_number}\x0139=0\x0110=000\x01\n"
+
+
+def write_log(file_path, line_count):
+    with open(file_path, 'w') as fp:
+        for line_number in range(line_count):
+            fp.write(LINE.format(order_id=line_number % 10, line_number=line_number))
+
+
+def test_update_by_chunks_indexes_the_same_lines(tmp_path):
+    log_file_path = str(tmp_path / 'FIX.4.2-S-C.messages.current.log')
+    write_log(log_file_path, 1000)
+    log_index = LogIndex(log_file_path)
+    update_count = 0
+    while not log_index.is_up_to_date:
+        log_index.update(max_bytes=4096)
+        update_count += 1
+        # (searchable in between)
+        log_index.search(parse_search_query('3'))
+
+    full_log_index = LogIndex(log_file_path)
+    full_log_index.update()
+    assert update_count > 1
+    assert log_index.line_count() == full_log_index.line_count() == 1000
+    assert log_index.search(parse_search_query('3'), None) == full_log_index.search(parse_search_query('3'), None)
+
+
+def test_a_line_being_written_doesnt_keep_it_updating(tmp_path):
+    log_file_path = str(tmp_path / 'FIX.4.2-S-C.messages.current.log')
+    write_log(log_file_path, 10)
+    with open(log_file_path, 'a') as fp:
+        fp.write('20261019-10:00:00.000 : 8=FIX.4.2\x0135=8\x0158=' + 'x' * 10000)
+    log_index = LogIndex(log_file_path)
+
+    log_index.update(max_bytes=4096)
+    log_index.update(max_bytes=4096)
+
+    assert log_index.is_up_to_date
+    assert log_index.line_count() == 10
@@ -0,0 +1,21 @@
+import os
+
+from conftest import REPO_DIR
+from fix_application import set_logging_enabled
+from loopback import run_loopback
+
+GOLDEN_DIR = os.path.join(REPO_DIR, 'golden')
+
+
+def test_test_scenario_matches_golden_flow():
+    set_logging_enabled(False)
+    try:
+        passed, flow = run_loopback([os.path.join(REPO_DIR, 'test_scenario.txt')],
+                                    os.path.join(GOLDEN_DIR, 'test_scenario.orders.csv'))
+    finally:
+        set_logging_enabled(True)
+
+    with open(os.path.join(GOLDEN_DIR, 'test_scenario.flow')) as fp:
+        golden_flow = fp.read().splitlines()
+    assert passed
+    assert flow == golden_flow
@@ -0,0 +1,39 @@
+import pytest
+
+from scenario import Scenario
+
+
+def test_labelled_step_with_a_trailing_variable(tmp_path):
+    scenario_file_path = tmp_path / 'scenario.txt'
+    scenario_file_path.write_text('set u=1234 q=100\n'
+                                  'reserve uuid=$u orderid=456 qty=$q label="Reserve $q"\n')
+
+    action_lines = list(Scenario(str(scenario_file_path)).iter_action_lines())
+
+    assert len(action_lines) == 1
+    assert action_lines[0].key_values == {'50': '1234', '37': '456', '38': '100'}
+    assert action_lines[0].label == 'Reserve 100'
+
+
+def test_ids_beyond_the_namespace_size_are_rejected(tmp_path, capsys):
+    scenario_file_path = tmp_path / 'scenario.txt'
+    scenario_file_path.write_text('reserve uuid=1234 orderid=1000000 qty=100\n')
+
+    with pytest.raises(SystemExit):
+        Scenario(str(scenario_file_path), 100000, namespace_size=100000)
+    assert '37=1000000 must be below 100000 when several scenarios run at line:1' in capsys.readouterr().out
+
+    # (only known once the variable is expanded)
+    scenario_file_path.write_text('set o=1000000\n'
+                                  'reserve uuid=1234 orderid=$o qty=100\n')
+    with pytest.raises(ValueError, match='37=1000000 must be below 100000'):
+        Scenario(str(scenario_file_path), 0, namespace_size=100000)
+
+
+def test_ids_are_shifted_into_their_namespace(tmp_path):
+    scenario_file_path = tmp_path / 'scenario.txt'
+    scenario_file_path.write_text('reserve uuid=1234 orderid=99999 qty=100\n')
+
+    action_lines = list(Scenario(str(scenario_file_path), 100000, namespace_size=100000).iter_action_lines())
+
+    assert action_lines[0].key_values == {'50': '101234', '37': '199999', '38': '100'}